@@ -1,16 +1,31 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Request, Response, Cookie
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, APIRouter, HTTPException, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorGridFSBucket
+from pymongo import IndexModel, ReplaceOne, UpdateOne, ReturnDocument, ASCENDING, DESCENDING, monitoring
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
+from bson import ObjectId
 import os
 import logging
 import asyncio
+import threading
+import sys
+import time
+import csv
+import io
+import re
+import json
+import base64
+import zlib
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from pydantic import BaseModel, Field, ConfigDict, EmailStr
-from typing import List, Optional, Dict
+from pydantic import BaseModel, Field, ConfigDict, EmailStr, ValidationError
+from typing import Any, List, Optional, Dict, AsyncIterator, Callable
 import uuid
 import hashlib
+import hmac
 import secrets
 from datetime import datetime, timezone, timedelta
 import httpx
@@ -29,9 +44,178 @@ from emergentintegrations.payments.stripe.checkout import (
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
+# ============================================
+# MONGODB POOL METRICS
+# ============================================
+
+# Upper bounds (ms) of the checkout wait / command latency histogram buckets
+LATENCY_BUCKETS_MS = [1, 5, 25, 100, 500, 2000]
+
+
+def _latency_bucket(elapsed_ms: float) -> str:
+    for bound in LATENCY_BUCKETS_MS:
+        if elapsed_ms < bound:
+            return f"<{bound}ms"
+    return f">={LATENCY_BUCKETS_MS[-1]}ms"
+
+
+class MongoMetrics(monitoring.ConnectionPoolListener, monitoring.CommandListener):
+    """
+    pymongo CMAP + command listener that tracks pool saturation.
+
+    Records connection checkout wait time, open / in-use connection counts and
+    per-command latency. Motor runs pymongo on executor threads, so listener
+    callbacks happen off the event loop and all state is guarded by a lock;
+    the checkout start time is kept thread-local because a checkout starts and
+    completes on the same thread.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.connections_open = 0
+        self.connections_in_use = 0
+        self.max_connections_in_use = 0
+        self.checkouts = 0
+        self.checkout_failures: Dict[str, int] = {}
+        self.checkout_wait_total_ms = 0.0
+        self.checkout_wait_max_ms = 0.0
+        self.checkout_wait_histogram: Dict[str, int] = {}
+        self.pool_clears = 0
+        self.commands: Dict[str, dict] = {}
+
+    # Connection pool events
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        with self._lock:
+            self.pool_clears += 1
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        with self._lock:
+            self.connections_open += 1
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        with self._lock:
+            self.connections_open -= 1
+
+    def connection_check_out_started(self, event):
+        self._local.checkout_started = time.perf_counter()
+
+    def connection_check_out_failed(self, event):
+        wait_ms = self._checkout_wait_ms()
+        with self._lock:
+            self.checkout_failures[event.reason] = self.checkout_failures.get(event.reason, 0) + 1
+            self._record_wait(wait_ms)
+
+    def connection_checked_out(self, event):
+        wait_ms = self._checkout_wait_ms()
+        with self._lock:
+            self.checkouts += 1
+            self.connections_in_use += 1
+            self.max_connections_in_use = max(self.max_connections_in_use, self.connections_in_use)
+            self._record_wait(wait_ms)
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.connections_in_use -= 1
+
+    def _checkout_wait_ms(self) -> float:
+        started = getattr(self._local, "checkout_started", None)
+        self._local.checkout_started = None
+        return (time.perf_counter() - started) * 1000 if started is not None else 0.0
+
+    def _record_wait(self, wait_ms: float):
+        self.checkout_wait_total_ms += wait_ms
+        self.checkout_wait_max_ms = max(self.checkout_wait_max_ms, wait_ms)
+        bucket = _latency_bucket(wait_ms)
+        self.checkout_wait_histogram[bucket] = self.checkout_wait_histogram.get(bucket, 0) + 1
+
+    # Command events
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self._record_command(event.command_name, event.duration_micros / 1000, failed=False)
+
+    def failed(self, event):
+        self._record_command(event.command_name, event.duration_micros / 1000, failed=True)
+
+    def _record_command(self, name: str, elapsed_ms: float, failed: bool):
+        with self._lock:
+            stats = self.commands.setdefault(name, {"count": 0, "failures": 0, "total_ms": 0.0, "max_ms": 0.0, "histogram": {}})
+            stats["count"] += 1
+            stats["failures"] += int(failed)
+            stats["total_ms"] += elapsed_ms
+            stats["max_ms"] = max(stats["max_ms"], elapsed_ms)
+            bucket = _latency_bucket(elapsed_ms)
+            stats["histogram"][bucket] = stats["histogram"].get(bucket, 0) + 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            attempts = self.checkouts + sum(self.checkout_failures.values())
+            return {
+                "connections": {
+                    "open": self.connections_open,
+                    "in_use": self.connections_in_use,
+                    "max_in_use": self.max_connections_in_use,
+                    "pool_clears": self.pool_clears,
+                },
+                "checkout": {
+                    "count": self.checkouts,
+                    "failures": dict(self.checkout_failures),
+                    "avg_wait_ms": round(self.checkout_wait_total_ms / attempts, 3) if attempts else 0,
+                    "max_wait_ms": round(self.checkout_wait_max_ms, 3),
+                    "wait_histogram": dict(self.checkout_wait_histogram),
+                },
+                "commands": {
+                    name: {
+                        "count": stats["count"],
+                        "failures": stats["failures"],
+                        "avg_ms": round(stats["total_ms"] / stats["count"], 3) if stats["count"] else 0,
+                        "max_ms": round(stats["max_ms"], 3),
+                        "histogram": dict(stats["histogram"]),
+                    }
+                    for name, stats in self.commands.items()
+                },
+            }
+
+
+def _env_int(name: str) -> Optional[int]:
+    value = os.environ.get(name)
+    return int(value) if value else None
+
+
 # MongoDB connection
+# Pool sizing/timeouts are optional env overrides; unset values keep the driver defaults.
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+MONGO_POOL_OPTIONS = {
+    option: value
+    for option, value in {
+        "maxPoolSize": _env_int('MONGO_MAX_POOL_SIZE'),
+        "minPoolSize": _env_int('MONGO_MIN_POOL_SIZE'),
+        "waitQueueTimeoutMS": _env_int('MONGO_WAIT_QUEUE_TIMEOUT_MS'),
+        "serverSelectionTimeoutMS": _env_int('MONGO_SERVER_SELECTION_TIMEOUT_MS'),
+    }.items()
+    if value is not None
+}
+mongo_metrics = MongoMetrics()
+client = AsyncIOMotorClient(
+    mongo_url,
+    tz_aware=True,  # dates come back as aware UTC datetimes
+    event_listeners=[mongo_metrics],
+    **MONGO_POOL_OPTIONS
+)
 db = client[os.environ['DB_NAME']]
 
 # Resend configuration
@@ -218,6 +402,15 @@ class BulkEmailRequest(BaseModel):
     subject: str
     html_content: str
     target: str = "all"  # "all", "waitlist", "users", "early_access"
+    segment: Optional[Dict[str, Any]] = None  # segment expression; overrides target
+
+class SegmentRequest(BaseModel):
+    segment: Dict[str, Any]  # e.g. {"and": [{"discipline": "WAG"}, {"not": {"ordered": True}}]}
+    limit: int = 100  # emails returned with the count
+
+class AdminJobRequest(BaseModel):
+    type: str  # "bulk_email", "export_contacts", "merge_duplicates", "bulk_delete"
+    params: Dict[str, Any] = {}
 
 class AdminStatsResponse(BaseModel):
     total_users: int
@@ -430,103 +623,2675 @@ class UserResponse(BaseModel):
     needs_profile_completion: bool = False  # True if Google OAuth user without gymnastics_type
 
 
-# APEX Credits Redemption Tiers
-CREDIT_TIERS = [
-    {"credits": 100, "discount": 5.00, "label": "$5 off"},
-    {"credits": 200, "discount": 15.00, "label": "$15 off"},
-    {"credits": 300, "discount": 25.00, "label": "$25 off"},
-]
+# APEX Credits Redemption Tiers
+CREDIT_TIERS = [
+    {"credits": 100, "discount": 5.00, "label": "$5 off"},
+    {"credits": 200, "discount": 15.00, "label": "$15 off"},
+    {"credits": 300, "discount": 25.00, "label": "$25 off"},
+]
+
+# Bonus Credits
+SIGNUP_BONUS_CREDITS = 10
+REVIEW_BONUS_CREDITS = 5
+REFERRAL_BONUS_CREDITS = 20
+
+
+class CreditRedemptionRequest(BaseModel):
+    tier_credits: int  # 100, 200, or 300
+
+
+class CreditBalanceResponse(BaseModel):
+    current_credits: int
+    total_earned: int
+    total_redeemed: int
+    available_tiers: List[dict]
+    next_tier: Optional[dict] = None
+
+
+# Inventory Models
+class InventoryItem(BaseModel):
+    product_id: int
+    product_name: str
+    color: str
+    size: str
+    quantity: int = 0
+    reserved: int = 0  # Reserved during checkout
+    low_stock_threshold: int = 5
+    updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+class InventoryUpdate(BaseModel):
+    product_id: int
+    color: str
+    size: str
+    quantity: int
+
+class InventoryBulkUpdate(BaseModel):
+    items: List[InventoryUpdate]
+
+
+# Promo Code Models
+class PromoCode(BaseModel):
+    code: str
+    discount_type: str = "percentage"  # "percentage" or "fixed"
+    discount_value: float  # 10 = 10% or $10
+    min_order: float = 0  # Minimum order amount
+    max_uses: Optional[int] = None  # None = unlimited
+    uses: int = 0
+    active: bool = True
+    expires_at: Optional[datetime] = None
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+class PromoCodeValidate(BaseModel):
+    code: str
+    subtotal: float
+
+class PromoCodeCreate(BaseModel):
+    code: str
+    discount_type: str = "percentage"
+    discount_value: float
+    min_order: float = 0
+    max_uses: Optional[int] = None
+    expires_at: Optional[str] = None
+
+
+# Default promo codes
+DEFAULT_PROMO_CODES = [
+    {"code": "WELCOME10", "discount_type": "percentage", "discount_value": 10, "min_order": 0, "max_uses": None},
+    {"code": "LAUNCH15", "discount_type": "percentage", "discount_value": 15, "min_order": 50, "max_uses": 100},
+    {"code": "APEX20", "discount_type": "percentage", "discount_value": 20, "min_order": 75, "max_uses": 50},
+]
+
+
+# ============================================
+# HELPER FUNCTIONS
+# ============================================
+
+# Password hashes are stored as pbkdf2_sha256$<iterations>$<salt>$<hex digest>.
+# Older "<salt>:<hex digest>" hashes used 100000 iterations; any hash not in
+# the current format or iteration count is replaced on the next login.
+PASSWORD_HASH_ALGORITHM = "pbkdf2_sha256"
+PASSWORD_HASH_ITERATIONS = int(os.environ.get("PASSWORD_HASH_ITERATIONS", "100000"))
+LEGACY_PASSWORD_HASH_ITERATIONS = 100000
+
+def hash_password(password: str) -> str:
+    """Hash password with salt (CPU-bound: call through password_hasher from async code)"""
+    salt = secrets.token_hex(16)
+    hash_obj = hashlib.pbkdf2_hmac('sha256', password.encode(), salt.encode(), PASSWORD_HASH_ITERATIONS)
+    return f"{PASSWORD_HASH_ALGORITHM}${PASSWORD_HASH_ITERATIONS}${salt}${hash_obj.hex()}"
+
+def _parse_password_hash(password_hash: str) -> tuple:
+    """(iterations, salt, hex digest) of a stored hash; raises ValueError if malformed"""
+    if password_hash.startswith(f"{PASSWORD_HASH_ALGORITHM}$"):
+        _, iterations, salt, hash_value = password_hash.split('$')
+        return int(iterations), salt, hash_value
+    salt, hash_value = password_hash.split(':')
+    return LEGACY_PASSWORD_HASH_ITERATIONS, salt, hash_value
+
+def verify_password(password: str, password_hash: str) -> bool:
+    """Verify password against hash (CPU-bound: call through password_hasher from async code)"""
+    try:
+        iterations, salt, hash_value = _parse_password_hash(password_hash)
+        hash_obj = hashlib.pbkdf2_hmac('sha256', password.encode(), salt.encode(), iterations)
+        return hmac.compare_digest(hash_obj.hex(), hash_value)
+    except ValueError:
+        return False
+
+def password_needs_rehash(password_hash: str) -> bool:
+    """True when a stored hash predates the current format or iteration count"""
+    try:
+        iterations, _, _ = _parse_password_hash(password_hash)
+    except ValueError:
+        return False
+    return not password_hash.startswith(f"{PASSWORD_HASH_ALGORITHM}$") or iterations != PASSWORD_HASH_ITERATIONS
+
+def normalize_email(email: Optional[str]) -> str:
+    """Canonical form of an email address used for indexed lookups"""
+    return (email or "").strip().lower()
+
+def parse_datetime(value: Optional[str]) -> Optional[datetime]:
+    """Parse an ISO date/datetime string into an aware UTC datetime (None if empty)"""
+    if not value:
+        return None
+    if value.endswith("Z"):
+        value = value[:-1] + "+00:00"
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+def to_iso(value) -> str:
+    """Render a stored date for CSV/text output"""
+    return value.isoformat() if isinstance(value, datetime) else (value or "")
+
+def encode_cursor(position: dict) -> str:
+    """Pack a pagination position into an opaque URL-safe token"""
+    raw = json.dumps(position, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+def decode_cursor(token: str) -> dict:
+    """Unpack a token from encode_cursor; raises ValueError if it is malformed"""
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        position = json.loads(raw)
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if not isinstance(position, dict):
+        raise ValueError("Invalid cursor")
+    return position
+
+# Rows buffered per chunk yielded by stream_csv
+CSV_STREAM_CHUNK_ROWS = 500
+
+async def stream_csv(rows: AsyncIterator[dict], fieldnames: List[str], compress: bool = False) -> AsyncIterator[bytes]:
+    """Yield a CSV document in chunks as rows arrive, optionally gzip-compressed
+
+    Only one chunk of rows is held in memory at a time.
+    """
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=fieldnames, extrasaction="ignore")
+    gzipper = zlib.compressobj(wbits=zlib.MAX_WBITS | 16) if compress else None
+
+    def drain() -> bytes:
+        data = buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate(0)
+        return gzipper.compress(data) if gzipper else data
+
+    # Header goes out before the first database batch
+    writer.writeheader()
+    yield drain()
+
+    pending = 0
+    async for row in rows:
+        writer.writerow(row)
+        pending += 1
+        if pending >= CSV_STREAM_CHUNK_ROWS:
+            chunk = drain()
+            if chunk:
+                yield chunk
+            pending = 0
+
+    tail = drain()
+    if gzipper:
+        tail += gzipper.flush()
+    if tail:
+        yield tail
+
+
+# ============================================
+# PASSWORD HASHING POOL
+# ============================================
+
+PASSWORD_HASH_WORKERS = int(os.environ.get("PASSWORD_HASH_WORKERS", "2"))
+
+
+class PasswordHasher:
+    """
+    Runs hash_password / verify_password on a dedicated thread pool.
+
+    pbkdf2_hmac releases the GIL, so hashes run beside the event loop instead
+    of stalling it. At most PASSWORD_HASH_WORKERS hashes run at once; further
+    callers wait on a semaphore, and that wait is reported by stats().
+    """
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="password-hash")
+        self._slots = asyncio.Semaphore(workers)
+        self.waiting = 0
+        self.running = 0
+        self.calls = 0
+        self.wait_ms_total = 0.0
+        self.wait_ms_max = 0.0
+        self.hash_ms_total = 0.0
+
+    async def run(self, fn: Callable, *args):
+        queued = time.perf_counter()
+        self.waiting += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self.waiting -= 1
+
+        started = time.perf_counter()
+        wait_ms = (started - queued) * 1000
+        self.wait_ms_total += wait_ms
+        self.wait_ms_max = max(self.wait_ms_max, wait_ms)
+        self.running += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+        finally:
+            self.running -= 1
+            self.calls += 1
+            self.hash_ms_total += (time.perf_counter() - started) * 1000
+            self._slots.release()
+
+    async def hash(self, password: str) -> str:
+        return await self.run(hash_password, password)
+
+    async def verify(self, password: str, password_hash: str) -> bool:
+        return await self.run(verify_password, password, password_hash)
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "iterations": PASSWORD_HASH_ITERATIONS,
+            "running": self.running,
+            "waiting": self.waiting,
+            "calls": self.calls,
+            "avg_wait_ms": round(self.wait_ms_total / self.calls, 3) if self.calls else None,
+            "max_wait_ms": round(self.wait_ms_max, 3),
+            "avg_hash_ms": round(self.hash_ms_total / self.calls, 3) if self.calls else None
+        }
+
+
+password_hasher = PasswordHasher(PASSWORD_HASH_WORKERS)
+
+async def rehash_password(user_id: str, old_hash: str, password: str):
+    """Store a current-format hash for a password that just verified against old_hash"""
+    try:
+        new_hash = await password_hasher.hash(password)
+        # Only replace the hash that was verified, in case the password changed meanwhile
+        result = await db.users.update_one(
+            {"user_id": user_id, "password_hash": old_hash},
+            {"$set": {"password_hash": new_hash}}
+        )
+        if result.modified_count:
+            invalidate_cached_user(user_id)
+            logging.info(f"[auth] Rehashed password for {user_id}")
+    except Exception as e:
+        logging.error(f"[auth] Password rehash failed for {user_id}: {str(e)}")
+
+
+# ============================================
+# DATABASE INDEXES
+# ============================================
+
+# Declarative index registry: collection name -> indexes it must have.
+# ensure_indexes() creates whatever is missing on startup; get_index_drift()
+# compares this registry with what actually exists in MongoDB.
+# Index names are explicit so drift can be matched by name.
+
+# Log entries are removed by TTL indexes once they are this old
+ACTIVITY_LOG_RETENTION_DAYS = int(os.environ.get("ACTIVITY_LOG_RETENTION_DAYS", "180"))
+EMAIL_LOG_RETENTION_DAYS = int(os.environ.get("EMAIL_LOG_RETENTION_DAYS", "90"))
+# User sessions are kept this long past expires_at
+USER_SESSION_GRACE_SECONDS = int(os.environ.get("USER_SESSION_GRACE_SECONDS", "0"))
+# Checkout data for Stripe sessions that were never paid
+PENDING_ORDER_RETENTION_HOURS = int(os.environ.get("PENDING_ORDER_RETENTION_HOURS", "48"))
+# Unpaid payment transactions; applied when a transaction is created
+PAYMENT_TRANSACTION_RETENTION_DAYS = int(os.environ.get("PAYMENT_TRANSACTION_RETENTION_DAYS", "30"))
+
+MONGO_INDEXES: Dict[str, List[IndexModel]] = {
+    "users": [
+        IndexModel([("email", ASCENDING)], name="email_unique", unique=True),
+        IndexModel([("email_normalized", ASCENDING)], name="email_normalized"),
+        IndexModel([("user_id", ASCENDING)], name="user_id_unique", unique=True),
+        IndexModel([("created_at", DESCENDING), ("_id", DESCENDING)], name="created_at_id_desc"),
+    ],
+    "user_sessions": [
+        IndexModel([("session_token", ASCENDING)], name="session_token_unique", unique=True),
+        IndexModel([("expires_at", ASCENDING)], name="expires_at_ttl", expireAfterSeconds=USER_SESSION_GRACE_SECONDS),
+        IndexModel([("user_id", ASCENDING)], name="user_id"),
+    ],
+    "orders": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("order_number", ASCENDING)], name="order_number_unique", unique=True),
+        IndexModel(
+            [("stripe_session_id", ASCENDING)],
+            name="stripe_session_id_unique",
+            unique=True,
+            partialFilterExpression={"stripe_session_id": {"$type": "string"}}
+        ),
+        IndexModel(
+            [("shipping.email", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)],
+            name="shipping_email_created_at_id"
+        ),
+        IndexModel([("email_normalized", ASCENDING)], name="email_normalized"),
+        IndexModel(
+            [("status", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)],
+            name="status_created_at_id"
+        ),
+        IndexModel([("created_at", DESCENDING), ("_id", DESCENDING)], name="created_at_id_desc"),
+        IndexModel([("discount_code", ASCENDING)], name="discount_code", sparse=True),
+    ],
+    "pending_orders": [
+        IndexModel([("session_id", ASCENDING)], name="session_id"),
+        # Only unpaid checkouts carry expires_at (see record_payment_status)
+        IndexModel([("expires_at", ASCENDING)], name="expires_at_ttl", expireAfterSeconds=0),
+    ],
+    "payment_transactions": [
+        IndexModel([("session_id", ASCENDING)], name="session_id"),
+        # Only unpaid transactions carry expires_at (see record_payment_status)
+        IndexModel([("expires_at", ASCENDING)], name="expires_at_ttl", expireAfterSeconds=0),
+    ],
+    "waitlist": [
+        IndexModel(
+            [("access_code", ASCENDING)],
+            name="access_code_unique",
+            unique=True,
+            partialFilterExpression={"access_code": {"$type": "string"}}
+        ),
+        IndexModel([("email", ASCENDING), ("product_id", ASCENDING), ("variant", ASCENDING)], name="email_product_variant"),
+        IndexModel([("email_normalized", ASCENDING)], name="email_normalized"),
+        IndexModel([("created_at", DESCENDING), ("_id", DESCENDING)], name="created_at_id_desc"),
+    ],
+    "email_subscriptions": [
+        IndexModel([("email", ASCENDING), ("source", ASCENDING)], name="email_source"),
+        IndexModel([("email_normalized", ASCENDING), ("source", ASCENDING)], name="email_normalized_source"),
+        IndexModel(
+            [("source", ASCENDING), ("timestamp", DESCENDING), ("_id", DESCENDING)],
+            name="source_timestamp_id"
+        ),
+        IndexModel([("timestamp", DESCENDING), ("_id", DESCENDING)], name="timestamp_id_desc"),
+    ],
+    "inventory": [
+        IndexModel(
+            [("product_id", ASCENDING), ("color", ASCENDING), ("size", ASCENDING)],
+            name="product_color_size_unique",
+            unique=True
+        ),
+    ],
+    "promo_codes": [
+        IndexModel([("code", ASCENDING)], name="code_unique", unique=True),
+    ],
+    "discount_codes": [
+        IndexModel([("code", ASCENDING)], name="code"),
+    ],
+    "visitor_sessions": [
+        IndexModel([("session_id", ASCENDING)], name="session_id"),
+        IndexModel([("first_visit", DESCENDING)], name="first_visit_desc"),
+        IndexModel([("is_active", ASCENDING), ("last_activity", DESCENDING)], name="is_active_last_activity"),
+    ],
+    "page_views": [
+        IndexModel([("timestamp", DESCENDING)], name="timestamp_desc"),
+    ],
+    "analytics_events": [
+        IndexModel([("event_type", ASCENDING), ("timestamp", DESCENDING)], name="event_type_timestamp"),
+        IndexModel([("timestamp", DESCENDING)], name="timestamp_desc"),
+    ],
+    "abandoned_carts": [
+        IndexModel([("email", ASCENDING), ("recovered", ASCENDING)], name="email_recovered"),
+        IndexModel([("email_normalized", ASCENDING)], name="email_normalized"),
+        IndexModel([("recovered", ASCENDING), ("created_at", ASCENDING)], name="recovered_created_at"),
+    ],
+    "activity_log": [
+        IndexModel([("timestamp", DESCENDING), ("_id", DESCENDING)], name="timestamp_id_desc"),
+        IndexModel(
+            [("timestamp", ASCENDING)], name="timestamp_ttl",
+            expireAfterSeconds=ACTIVITY_LOG_RETENTION_DAYS * 86400
+        ),
+    ],
+    "email_logs": [
+        IndexModel([("sent_at", ASCENDING)], name="sent_at_ttl", expireAfterSeconds=EMAIL_LOG_RETENTION_DAYS * 86400),
+        IndexModel([("status", ASCENDING), ("sent_at", DESCENDING)], name="status_sent_at"),
+        IndexModel([("email_normalized", ASCENDING), ("sent_at", DESCENDING)], name="email_normalized_sent_at"),
+    ],
+    "admin_sessions": [
+        IndexModel([("expires_at", ASCENDING)], name="expires_at_ttl", expireAfterSeconds=0),
+    ],
+    "revoked_sessions": [
+        IndexModel([("expires_at", ASCENDING)], name="expires_at_ttl", expireAfterSeconds=0),
+    ],
+    "user_notes": [
+        IndexModel([("email_normalized", ASCENDING), ("created_at", DESCENDING)], name="email_normalized_created_at"),
+    ],
+    "carts": [
+        IndexModel([("email_normalized", ASCENDING)], name="email_normalized"),
+    ],
+    "contacts": [
+        IndexModel([("signup_date", DESCENDING), ("_id", DESCENDING)], name="signup_date_id_desc"),
+        IndexModel([("built_at", ASCENDING)], name="built_at"),
+        IndexModel([("schema_version", ASCENDING)], name="schema_version"),
+        IndexModel([("search_tokens", ASCENDING)], name="search_tokens"),
+    ],
+    "admin_jobs": [
+        IndexModel([("status", ASCENDING), ("created_at", ASCENDING)], name="status_created_at"),
+        IndexModel([("created_at", DESCENDING), ("_id", DESCENDING)], name="created_at_id_desc"),
+    ],
+}
+
+# Index options that make two indexes on the same key behave differently
+INDEX_COMPARED_OPTIONS = ("unique", "sparse", "partialFilterExpression", "expireAfterSeconds")
+
+
+def _normalize_index_spec(spec: dict) -> dict:
+    """Reduce an index definition (declared or from index_information) to comparable fields"""
+    key = spec["key"]
+    key_items = key.items() if hasattr(key, "items") else key
+    normalized = {
+        "key": [[field, int(direction) if isinstance(direction, (int, float)) else direction]
+                for field, direction in key_items]
+    }
+    for option in INDEX_COMPARED_OPTIONS:
+        if spec.get(option) not in (None, False):
+            normalized[option] = spec[option]
+    return normalized
+
+
+def diff_indexes(declared: List[IndexModel], existing: dict) -> dict:
+    """Compare declared IndexModels against index_information() output"""
+    drift = {"missing": [], "mismatched": [], "extra": []}
+    declared_names = set()
+
+    for index in declared:
+        name = index.document["name"]
+        declared_names.add(name)
+        want = _normalize_index_spec(index.document)
+
+        if name not in existing:
+            drift["missing"].append({"name": name, "declared": want})
+            continue
+
+        have = _normalize_index_spec(existing[name])
+        if have != want:
+            drift["mismatched"].append({"name": name, "declared": want, "actual": have})
+
+    for name, info in existing.items():
+        if name != "_id_" and name not in declared_names:
+            drift["extra"].append({"name": name, "actual": _normalize_index_spec(info)})
+
+    return drift
+
+
+async def get_index_drift() -> dict:
+    """Report drift between MONGO_INDEXES and the indexes that exist in MongoDB"""
+    report = {}
+    for collection_name, indexes in MONGO_INDEXES.items():
+        existing = await db[collection_name].index_information()
+        drift = diff_indexes(indexes, existing)
+        if any(drift.values()):
+            report[collection_name] = drift
+    return report
+
+
+async def ensure_indexes() -> dict:
+    """
+    Create every missing index declared in MONGO_INDEXES.
+
+    Indexes are created one at a time so a single failure (e.g. a unique index
+    over data that already has duplicates) doesn't block the rest. Existing
+    indexes whose definition differs are never dropped automatically - they
+    are reported as drift for an operator to resolve.
+
+    Returns:
+        {"created": [...], "failed": [...], "drift": {...}}
+    """
+    created = []
+    failed = []
+
+    for collection_name, indexes in MONGO_INDEXES.items():
+        collection = db[collection_name]
+        existing = await collection.index_information()
+
+        for index in indexes:
+            name = index.document["name"]
+            if name in existing:
+                continue
+            try:
+                await collection.create_indexes([index])
+                created.append(f"{collection_name}.{name}")
+            except OperationFailure as e:
+                failed.append({"index": f"{collection_name}.{name}", "error": str(e)})
+                logging.error(f"[indexes] Could not create {collection_name}.{name}: {str(e)}")
+
+    drift = await get_index_drift()
+
+    if created:
+        logging.info(f"[indexes] Created {len(created)} indexes: {', '.join(created)}")
+    if drift:
+        logging.warning(f"[indexes] Index drift detected in: {', '.join(drift.keys())}")
+
+    return {"created": created, "failed": failed, "drift": drift}
+
+
+# ============================================
+# NORMALIZED EMAIL FIELD
+# ============================================
+
+# Collections keyed by email -> field holding the raw address.
+# Every document in these collections carries an `email_normalized` copy
+# (see normalize_email) so lookups are indexed equality matches instead of
+# case-insensitive regex scans.
+EMAIL_KEYED_COLLECTIONS = {
+    "users": "email",
+    "email_subscriptions": "email",
+    "waitlist": "email",
+    "carts": "email",
+    "abandoned_carts": "email",
+    "user_notes": "email",
+    "orders": "shipping.email",
+    "email_logs": "recipient",
+}
+
+
+async def backfill_normalized_emails() -> Dict[str, int]:
+    """Set email_normalized on documents written before the field existed"""
+    updated = {}
+    for collection_name, source_field in EMAIL_KEYED_COLLECTIONS.items():
+        result = await db[collection_name].update_many(
+            {"email_normalized": {"$exists": False}, source_field: {"$type": "string"}},
+            [{"$set": {"email_normalized": {"$toLower": {"$trim": {"input": f"${source_field}"}}}}}]
+        )
+        if result.modified_count:
+            updated[collection_name] = result.modified_count
+
+    if updated:
+        logging.info(f"[email_normalized] Backfilled: {updated}")
+    return updated
+
+
+async def group_by_email(collection, emails: List[str], projection: Optional[dict] = None) -> Dict[str, List[dict]]:
+    """Fetch documents for many emails in one $in query, grouped by normalized email"""
+    keys = list({normalize_email(e) for e in emails if e})
+    if not keys:
+        return {}
+
+    fields = {"_id": 0, **(projection or {})}
+    if any(value for key, value in fields.items() if key != "_id"):
+        # Inclusion projection - make sure the grouping key comes back
+        fields["email_normalized"] = 1
+
+    grouped = defaultdict(list)
+    async for doc in collection.find({"email_normalized": {"$in": keys}}, fields):
+        grouped[doc.get("email_normalized")].append(doc)
+    return grouped
+
+
+# ============================================
+# NATIVE DATE FIELDS
+# ============================================
+
+# Timestamp fields stored as BSON dates. Older documents have ISO strings
+# here; backfill_date_fields() converts them in place.
+DATE_FIELDS = {
+    "users": ["created_at", "updated_at", "unsubscribed_at"],
+    "user_sessions": ["created_at", "expires_at"],
+    "email_subscriptions": ["timestamp", "unsubscribed_at", "upsell_sent_at", "winner_selected_at"],
+    "waitlist": ["created_at", "updated_at", "unsubscribed_at"],
+    "orders": ["created_at", "updated_at", "shipped_at", "delivered_at"],
+    "pending_orders": ["created_at"],
+    "payment_transactions": ["created_at", "updated_at"],
+    "visitor_sessions": ["first_visit", "last_activity"],
+    "page_views": ["timestamp"],
+    "analytics_events": ["timestamp"],
+    "status_checks": ["timestamp"],
+    "inventory": ["updated_at"],
+    "promo_codes": ["created_at", "expires_at"],
+    "discount_codes": ["created_at", "expires_at"],
+    "activity_log": ["timestamp"],
+    "email_logs": ["sent_at"],
+    "user_notes": ["created_at"],
+    "failed_webhooks": ["failed_at"],
+}
+
+DATE_BACKFILL_BATCH_SIZE = 1000
+# Fields already converted are listed in migrations under this _id
+DATE_BACKFILL_MIGRATION_ID = "date_fields"
+
+
+async def backfill_date_fields(force: bool = False) -> Dict[str, int]:
+    """
+    Convert ISO-string timestamps listed in DATE_FIELDS to BSON dates.
+
+    Each field is scanned (a collection scan: nothing indexes $type) until
+    one pass completes, which is then recorded in the migrations collection;
+    later boots only scan fields added to DATE_FIELDS since, unless force is
+    set. Empty or unparseable strings are unset rather than left as strings.
+    """
+    migration = await db.migrations.find_one({"_id": DATE_BACKFILL_MIGRATION_ID}) or {}
+    completed = set() if force else set(migration.get("fields", []))
+
+    converted = {}
+    for collection_name, fields in DATE_FIELDS.items():
+        collection = db[collection_name]
+        for field in fields:
+            key = f"{collection_name}.{field}"
+            if key in completed:
+                continue
+            count = 0
+            batch = []
+            cursor = collection.find({field: {"$type": "string"}}, {field: 1})
+            async for doc in cursor:
+                try:
+                    update = {"$set": {field: parse_datetime(doc[field])}}
+                except ValueError:
+                    update = {"$unset": {field: ""}}
+                batch.append(UpdateOne({"_id": doc["_id"]}, update))
+                if len(batch) >= DATE_BACKFILL_BATCH_SIZE:
+                    count += (await collection.bulk_write(batch, ordered=False)).modified_count
+                    batch = []
+            if batch:
+                count += (await collection.bulk_write(batch, ordered=False)).modified_count
+            if count:
+                converted[key] = count
+            await db.migrations.update_one(
+                {"_id": DATE_BACKFILL_MIGRATION_ID},
+                {"$addToSet": {"fields": key}, "$set": {"updated_at": datetime.now(timezone.utc)}},
+                upsert=True
+            )
+
+    if converted:
+        logging.info(f"[dates] Converted string timestamps: {converted}")
+    return converted
+
+
+# ============================================
+# FACETED COUNTS
+# ============================================
+
+async def facet_counts(collection, facets: Dict[str, dict], match: Optional[dict] = None) -> Dict[str, int]:
+    """Count several filters over one collection in a single $facet round trip
+
+    Args:
+        collection: Motor collection to aggregate
+        facets: name -> filter, each counted independently
+        match: optional filter applied before faceting; every facet filter
+            must be a subset of it so the prefilter can use an index
+    """
+    pipeline = []
+    if match:
+        pipeline.append({"$match": match})
+    pipeline.append({"$facet": {
+        name: [{"$match": query}, {"$count": "n"}]
+        for name, query in facets.items()
+    }})
+
+    result = await collection.aggregate(pipeline).to_list(1)
+    row = result[0] if result else {}
+    return {name: (row.get(name) or [{"n": 0}])[0]["n"] for name in facets}
+
+
+# ============================================
+# KEYSET PAGINATION
+# ============================================
+
+class TTLCache:
+    """Small in-process LRU cache whose entries expire `ttl` seconds after being set"""
+
+    def __init__(self, ttl: float, maxsize: int = 1024):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._entries: Dict = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        entry = self._entries.pop(key, None)
+        if entry is None or entry[0] < time.monotonic():
+            self.misses += 1
+            return default
+        # Re-insert so dict order stays least recently used first
+        self._entries[key] = entry
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key, value):
+        self._entries.pop(key, None)
+        if len(self._entries) >= self.maxsize:
+            # Evict the least recently used entry
+            self._entries.pop(next(iter(self._entries)))
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+
+    def invalidate(self, key=None):
+        if key is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(key, None)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else None
+        }
+
+
+COUNT_CACHE_TTL_SECONDS = int(os.environ.get("COUNT_CACHE_TTL_SECONDS", "60"))
+count_cache = TTLCache(COUNT_CACHE_TTL_SECONDS)
+
+async def cached_count(collection, query: Optional[dict] = None) -> int:
+    """Total for a list endpoint: collection metadata when unfiltered,
+    otherwise a count_documents result cached for COUNT_CACHE_TTL_SECONDS"""
+    if not query:
+        return await collection.estimated_document_count()
+
+    key = (collection.name, json.dumps(query, sort_keys=True, default=str))
+    total = count_cache.get(key)
+    if total is None:
+        total = await collection.count_documents(query)
+        count_cache.set(key, total)
+    return total
+
+def _cursor_id(value) -> dict:
+    return {"oid": str(value)} if isinstance(value, ObjectId) else {"id": value}
+
+def _cursor_id_value(position: dict):
+    if "oid" in position:
+        if not isinstance(position["oid"], str) or not ObjectId.is_valid(position["oid"]):
+            raise ValueError("Invalid cursor")
+        return ObjectId(position["oid"])
+    value = position.get("id")
+    if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+        raise ValueError("Invalid cursor")
+    return value
+
+async def keyset_page(collection, query: dict, sort_field: str, limit: int, cursor: str = "",
+                      projection: Optional[dict] = None):
+    """One page of `collection` ordered newest first by (sort_field, _id)
+
+    Returns (documents, next_cursor). The cursor records the last row's sort
+    key, so every page is an index range scan regardless of depth. Documents
+    without sort_field sort after all dated ones, as MongoDB orders them.
+    Raises ValueError for a malformed cursor.
+    """
+    page_query = dict(query)
+    if cursor:
+        position = decode_cursor(cursor)
+        last_id = _cursor_id_value(position)
+        if position.get("v") is not None and not isinstance(position["v"], str):
+            raise ValueError("Invalid cursor")
+        last_value = parse_datetime(position.get("v"))
+        if last_value is None:
+            after = {sort_field: None, "_id": {"$lt": last_id}}
+        else:
+            after = {"$or": [
+                {sort_field: {"$lt": last_value}},
+                {sort_field: last_value, "_id": {"$lt": last_id}},
+                {sort_field: None}
+            ]}
+        page_query = {"$and": [query, after]} if query else after
+
+    fields = dict(projection or {})
+    hide_id = fields.get("_id") == 0
+    fields.pop("_id", None)
+
+    docs = await collection.find(page_query, fields or None).sort(
+        [(sort_field, DESCENDING), ("_id", DESCENDING)]
+    ).limit(limit + 1).to_list(limit + 1)
+
+    next_cursor = None
+    if len(docs) > limit:
+        docs = docs[:limit]
+        last = docs[-1]
+        value = last.get(sort_field)
+        next_cursor = encode_cursor({
+            "v": value.isoformat() if isinstance(value, datetime) else None,
+            **_cursor_id(last["_id"])
+        })
+
+    if hide_id:
+        for doc in docs:
+            doc.pop("_id", None)
+    return docs, next_cursor
+
+def page_limit(limit: int, maximum: int = 1000) -> int:
+    return min(max(limit, 1), maximum)
+
+
+# ============================================
+# SESSION CACHE
+# ============================================
+
+# get_current_user resolves session token -> (user_id, expires_at) -> user
+# document through these caches. Writes made in this process invalidate
+# them; the TTLs bound how long another process can serve a stale entry
+# (e.g. a session logged out elsewhere).
+SESSION_CACHE_TTL_SECONDS = int(os.environ.get("SESSION_CACHE_TTL_SECONDS", "60"))
+USER_CACHE_TTL_SECONDS = int(os.environ.get("USER_CACHE_TTL_SECONDS", "15"))
+SESSION_CACHE_MAXSIZE = int(os.environ.get("SESSION_CACHE_MAXSIZE", "10000"))
+
+session_cache = TTLCache(SESSION_CACHE_TTL_SECONDS, SESSION_CACHE_MAXSIZE)
+user_cache = TTLCache(USER_CACHE_TTL_SECONDS, SESSION_CACHE_MAXSIZE)
+
+def invalidate_cached_user(user_id: Optional[str] = None):
+    """Drop a cached user document after a write (all of them when user_id is None)"""
+    user_cache.invalidate(user_id)
+
+
+# ============================================
+# SIGNED SESSION TOKENS
+# ============================================
+
+# SESSION_MODE=signed issues stateless tokens instead of user_sessions rows:
+#   v1.<base64url JSON claims>.<base64url HMAC-SHA256 of the claims part>
+# Claims: uid (user_id), em (email), adm (admin flag), iat / exp (epoch
+# seconds; iat keeps its fraction so a revocation can't catch a token issued
+# later in the same second) and jti (token id). Both token kinds are accepted in either mode,
+# so switching modes logs nobody out. Logout and user deletion go through a
+# small revocation list kept in revoked_sessions until the tokens expire.
+SESSION_MODE = os.environ.get("SESSION_MODE", "database")
+SESSION_SECRET = os.environ.get("SESSION_SECRET", "")
+SESSION_TTL_SECONDS = 7 * 24 * 60 * 60
+SESSION_TOKEN_PREFIX = "v1."
+# How often each process reloads revocations made by the others
+SESSION_REVOCATION_REFRESH_SECONDS = 30
+
+if SESSION_MODE == "signed" and not SESSION_SECRET:
+    logging.error("[sessions] SESSION_MODE=signed requires SESSION_SECRET; using database sessions")
+    SESSION_MODE = "database"
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).decode("ascii").rstrip("=")
+
+def _b64decode(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+def _session_signature(body: str) -> bytes:
+    return hmac.new(SESSION_SECRET.encode("utf-8"), body.encode("ascii"), hashlib.sha256).digest()
+
+def is_signed_session_token(token: str) -> bool:
+    # Random database tokens are plain base64url and never contain '.'
+    return token.startswith(SESSION_TOKEN_PREFIX)
+
+def sign_session_token(user_id: str, email: str) -> str:
+    now = time.time()
+    claims = {
+        "uid": user_id,
+        "em": email,
+        "adm": is_admin_user(email),
+        "iat": now,
+        "exp": int(now) + SESSION_TTL_SECONDS,
+        "jti": secrets.token_hex(8)
+    }
+    body = _b64encode(json.dumps(claims, separators=(",", ":")).encode("utf-8"))
+    return f"{SESSION_TOKEN_PREFIX}{body}.{_b64encode(_session_signature(body))}"
+
+def verify_session_token(token: str) -> Optional[dict]:
+    """Claims of a valid, unexpired, unrevoked signed token, else None"""
+    if not SESSION_SECRET:
+        return None
+    try:
+        body, signature = token[len(SESSION_TOKEN_PREFIX):].split(".")
+        if not hmac.compare_digest(_b64decode(signature), _session_signature(body)):
+            return None
+        claims = json.loads(_b64decode(body))
+    except ValueError:
+        return None
+    if claims.get("exp", 0) < time.time() or session_revocations.is_revoked(claims):
+        return None
+    return claims
+
+
+class SessionRevocations:
+    """Revoked signed tokens (by jti) and users whose earlier tokens are all revoked"""
+
+    def __init__(self):
+        self.tokens: Dict[str, float] = {}
+        # user_id -> tokens issued at or before this time are revoked
+        self.users: Dict[str, float] = {}
+
+    def is_revoked(self, claims: dict) -> bool:
+        if claims.get("jti") in self.tokens:
+            return True
+        revoked_before = self.users.get(claims.get("uid"))
+        return revoked_before is not None and claims.get("iat", 0) <= revoked_before
+
+    async def revoke_token(self, claims: dict):
+        self.tokens[claims["jti"]] = claims["exp"]
+        await db.revoked_sessions.update_one(
+            {"_id": f"jti:{claims['jti']}"},
+            {"$set": {"expires_at": datetime.fromtimestamp(claims["exp"], timezone.utc)}},
+            upsert=True
+        )
+
+    async def revoke_user(self, user_id: str):
+        now = time.time()
+        self.users[user_id] = now
+        await db.revoked_sessions.update_one(
+            {"_id": f"user:{user_id}"},
+            {"$set": {
+                "revoked_before": now,
+                "expires_at": datetime.fromtimestamp(now + SESSION_TTL_SECONDS, timezone.utc)
+            }},
+            upsert=True
+        )
+
+    async def load(self):
+        tokens, users = {}, {}
+        async for doc in db.revoked_sessions.find({}):
+            kind, _, key = doc["_id"].partition(":")
+            if kind == "jti":
+                tokens[key] = doc["expires_at"].timestamp()
+            elif kind == "user":
+                users[key] = doc["revoked_before"]
+        self.tokens, self.users = tokens, users
+
+
+session_revocations = SessionRevocations()
+
+async def session_revocation_loop():
+    """Pick up revocations made by other processes"""
+    while True:
+        try:
+            await session_revocations.load()
+        except Exception as e:
+            logging.error(f"[sessions] Revocation list refresh failed: {str(e)}")
+        await asyncio.sleep(SESSION_REVOCATION_REFRESH_SECONDS)
+
+async def issue_session(user_id: str, email: str) -> str:
+    """Start a session for the user and return its token"""
+    if SESSION_MODE == "signed":
+        return sign_session_token(user_id, email)
+    session = UserSession(user_id=user_id)
+    await db.user_sessions.insert_one(session.model_dump())
+    return session.session_token
+
+
+# ============================================
+# PUBLIC STATS COUNTERS
+# ============================================
+
+# daily_counters holds one document per UTC day (_id "YYYY-MM-DD") plus an
+# "all_time" document, each with signups / waitlist / giveaway fields.
+COUNTER_ALL_TIME = "all_time"
+
+# metric -> (collection, timestamp field, base filter)
+COUNTER_SOURCES = {
+    "signups": ("users", "created_at", {}),
+    "waitlist": ("waitlist", "created_at", {}),
+    "giveaway": ("email_subscriptions", "timestamp", {"source": "giveaway_popup"}),
+}
+
+# How many recent days the reconcile job recounts, and how often it runs
+COUNTER_RECONCILE_DAYS = int(os.environ.get("COUNTER_RECONCILE_DAYS", "7"))
+COUNTER_RECONCILE_INTERVAL_MINUTES = int(os.environ.get("COUNTER_RECONCILE_INTERVAL_MINUTES", "60"))
+
+def counter_day(at: Optional[datetime] = None) -> str:
+    """UTC date key for a daily_counters document"""
+    return (at or datetime.now(timezone.utc)).astimezone(timezone.utc).strftime("%Y-%m-%d")
+
+async def adjust_counters(changes: Dict[str, Dict[str, int]]):
+    """Apply {counter _id: {metric: delta}} to daily_counters"""
+    try:
+        await db.daily_counters.bulk_write([
+            UpdateOne({"_id": key}, {"$inc": deltas}, upsert=True)
+            for key, deltas in changes.items()
+        ], ordered=False)
+    except Exception as e:
+        # Counters are repaired by reconcile_counters; never fail the write path
+        logging.error(f"[counters] Failed to adjust {changes}: {str(e)}")
+
+async def increment_counter(metric: str):
+    """Bump a public stats counter for today and all time"""
+    await adjust_counters({COUNTER_ALL_TIME: {metric: 1}, counter_day(): {metric: 1}})
+
+async def delete_counted(collection_name: str, query: dict) -> int:
+    """delete_many that also takes the removed entries off the stats counters
+
+    Each entry is decremented on the day it was created.
+    """
+    collection = db[collection_name]
+    sources = [
+        (metric, field, base) for metric, (name, field, base) in COUNTER_SOURCES.items()
+        if name == collection_name
+    ]
+    if not sources:
+        return (await collection.delete_many(query)).deleted_count
+
+    projection = {"_id": 1}
+    for _, field, base in sources:
+        projection.update({field: 1, **{key: 1 for key in base}})
+    docs = await collection.find(query, projection).to_list(None)
+    if not docs:
+        return 0
+    deleted = (await collection.delete_many({"_id": {"$in": [doc["_id"] for doc in docs]}})).deleted_count
+    if deleted != len(docs):
+        # Some were removed concurrently; the scheduled reconcile settles the counts
+        return deleted
+
+    changes = {}
+    for doc in docs:
+        for metric, field, base in sources:
+            if any(doc.get(key) != value for key, value in base.items()):
+                continue
+            keys = [COUNTER_ALL_TIME]
+            if isinstance(doc.get(field), datetime):
+                keys.append(counter_day(doc[field]))
+            for key in keys:
+                changes.setdefault(key, {}).setdefault(metric, 0)
+                changes[key][metric] -= 1
+    if changes:
+        await adjust_counters(changes)
+    return deleted
+
+async def reconcile_counters(days: int = COUNTER_RECONCILE_DAYS) -> dict:
+    """Recount all-time and recent daily counters from source collections
+
+    Returns the counters that had drifted, as stored vs actual values.
+    """
+    days = max(days, 1)
+    today_start = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+    since = today_start - timedelta(days=days - 1)
+    day_keys = [counter_day(since + timedelta(days=i)) for i in range(days)]
+
+    # Read the stored values before recounting: an increment landing after
+    # this read changes the value, so the conditional write below leaves that
+    # counter for the next run instead of overwriting the increment
+    stored = await db.daily_counters.find({"_id": {"$in": [COUNTER_ALL_TIME] + day_keys}}).to_list(None)
+    stored = {doc["_id"]: doc for doc in stored}
+
+    async def recount(collection_name: str, field: str, base: dict):
+        collection = db[collection_name]
+        total, per_day = await asyncio.gather(
+            collection.count_documents(base),
+            collection.aggregate([
+                {"$match": {**base, field: {"$gte": since}}},
+                {"$group": {
+                    "_id": {"$dateToString": {"format": "%Y-%m-%d", "date": f"${field}"}},
+                    "count": {"$sum": 1}
+                }}
+            ]).to_list(None)
+        )
+        return total, {row["_id"]: row["count"] for row in per_day}
+
+    metrics = list(COUNTER_SOURCES)
+    results = await asyncio.gather(*(recount(*COUNTER_SOURCES[m]) for m in metrics))
+
+    expected = {key: {} for key in [COUNTER_ALL_TIME] + day_keys}
+    for metric, (total, per_day) in zip(metrics, results):
+        expected[COUNTER_ALL_TIME][metric] = total
+        for day in day_keys:
+            expected[day][metric] = per_day.get(day, 0)
+
+    drift = []
+    writes = []
+    for key, values in expected.items():
+        doc = stored.get(key)
+        for metric, actual in values.items():
+            current = (doc or {}).get(metric, 0)
+            if current != actual:
+                drift.append({"counter": key, "metric": metric, "stored": current, "actual": actual})
+                if doc is not None:
+                    expected_value = doc[metric] if metric in doc else {"$exists": False}
+                    writes.append(UpdateOne({"_id": key, metric: expected_value}, {"$set": {metric: actual}}))
+        if doc is None:
+            # No-op if an increment created the document in the meantime
+            writes.append(UpdateOne({"_id": key}, {"$setOnInsert": values}, upsert=True))
+
+    if writes:
+        try:
+            await db.daily_counters.bulk_write(writes, ordered=False)
+        except BulkWriteError as e:
+            # Concurrent upserts of the same day; the next run repairs it
+            logging.warning(f"[counters] Reconcile write conflict: {e.details.get('writeErrors', [])[:1]}")
+
+    if drift:
+        logging.info(f"[counters] Repaired {len(drift)} drifted counters")
+    return {"days": days, "drift": drift}
+
+async def counter_reconcile_loop():
+    """Recount the stats counters on a schedule while the server runs"""
+    while True:
+        try:
+            await reconcile_counters()
+        except Exception as e:
+            logging.error(f"[counters] Reconcile failed: {str(e)}")
+        await asyncio.sleep(COUNTER_RECONCILE_INTERVAL_MINUTES * 60)
+
+
+# ============================================
+# ANALYTICS ROLLUPS
+# ============================================
+
+# analytics_rollups holds one document per UTC hour (_id = start of the hour)
+# folding visitor_sessions, page_views and analytics_events into totals, plus
+# a "watermark" document recording the first hour not yet rolled up.
+# Sessions are bucketed by first_visit but their duration keeps growing with
+# heartbeats, so each run re-folds the last few closed hours. Buckets keep
+# their distinct session_ids so unique visitors over a window are counted as
+# the size of the union, not the sum of hourly uniques.
+ANALYTICS_ROLLUP_STATE = "watermark"
+# Bumped when the bucket shape changes; buckets of an older version are re-folded
+ANALYTICS_ROLLUP_VERSION = 2
+ANALYTICS_FUNNEL_EVENTS = ("add_to_cart", "begin_checkout", "purchase")
+ANALYTICS_ROLLUP_REPROCESS_HOURS = int(os.environ.get("ANALYTICS_ROLLUP_REPROCESS_HOURS", "2"))
+ANALYTICS_ROLLUP_INTERVAL_SECONDS = int(os.environ.get("ANALYTICS_ROLLUP_INTERVAL_SECONDS", "300"))
+ANALYTICS_ROLLUP_CHUNK_HOURS = 24 * 7
+
+def floor_hour(value: datetime) -> datetime:
+    """Truncate a datetime to the start of its hour"""
+    return value.replace(minute=0, second=0, microsecond=0)
+
+def _hour_of(field: str) -> dict:
+    """Aggregation expression truncating a date field to its UTC hour"""
+    return {"$dateFromParts": {
+        "year": {"$year": f"${field}"},
+        "month": {"$month": f"${field}"},
+        "day": {"$dayOfMonth": f"${field}"},
+        "hour": {"$hour": f"${field}"}
+    }}
+
+def _empty_analytics_bucket() -> dict:
+    return {
+        "visitors": 0,
+        "unique_visitors": 0,
+        "session_ids": [],
+        "registered": 0,
+        "guests": 0,
+        "duration_sum": 0,
+        "page_views": 0,
+        "pages": [],
+        "countries": [],
+        "referrers": [],
+        "events": {event: 0 for event in ANALYTICS_FUNNEL_EVENTS}
+    }
+
+async def aggregate_analytics_hours(start: datetime, end: datetime) -> Dict[datetime, dict]:
+    """Fold raw analytics in [start, end) into hourly buckets keyed by hour"""
+    hour = _hour_of("first_visit")
+    sessions, pages, events = await asyncio.gather(
+        db.visitor_sessions.aggregate([
+            {"$match": {"first_visit": {"$gte": start, "$lt": end}}},
+            {"$facet": {
+                "totals": [
+                    {"$group": {
+                        "_id": hour,
+                        "visitors": {"$sum": 1},
+                        "session_ids": {"$addToSet": "$session_id"},
+                        "registered": {"$sum": {"$cond": [{"$eq": ["$user_type", "registered"]}, 1, 0]}},
+                        "guests": {"$sum": {"$cond": [{"$eq": ["$user_type", "guest"]}, 1, 0]}},
+                        "duration_sum": {"$sum": {"$ifNull": ["$session_duration", 0]}}
+                    }},
+                    {"$addFields": {"unique_visitors": {"$size": "$session_ids"}}}
+                ],
+                "countries": [
+                    {"$match": {"country": {"$ne": None}}},
+                    {"$group": {
+                        "_id": {"hour": hour, "key": "$country"},
+                        "count": {"$sum": 1},
+                        "code": {"$first": "$country_code"}
+                    }}
+                ],
+                "referrers": [
+                    {"$group": {"_id": {"hour": hour, "key": "$referrer"}, "count": {"$sum": 1}}}
+                ]
+            }}
+        ]).to_list(1),
+        db.page_views.aggregate([
+            {"$match": {"timestamp": {"$gte": start, "$lt": end}}},
+            {"$group": {"_id": {"hour": _hour_of("timestamp"), "key": "$page_path"}, "count": {"$sum": 1}}}
+        ]).to_list(None),
+        db.analytics_events.aggregate([
+            {"$match": {
+                "timestamp": {"$gte": start, "$lt": end},
+                "event_type": {"$in": list(ANALYTICS_FUNNEL_EVENTS)}
+            }},
+            {"$group": {"_id": {"hour": _hour_of("timestamp"), "key": "$event_type"}, "count": {"$sum": 1}}}
+        ]).to_list(None)
+    )
+    facets = sessions[0] if sessions else {}
+
+    buckets: Dict[datetime, dict] = {}
+    def bucket(hour_start: datetime) -> dict:
+        return buckets.setdefault(hour_start, _empty_analytics_bucket())
+
+    for row in facets.get("totals", []):
+        bucket(row.pop("_id")).update(row)
+    for row in facets.get("countries", []):
+        bucket(row["_id"]["hour"])["countries"].append(
+            {"key": row["_id"]["key"], "code": row.get("code"), "count": row["count"]}
+        )
+    for row in facets.get("referrers", []):
+        bucket(row["_id"]["hour"])["referrers"].append(
+            {"key": row["_id"]["key"] or "direct", "count": row["count"]}
+        )
+    for row in pages:
+        target = bucket(row["_id"]["hour"])
+        target["page_views"] += row["count"]
+        target["pages"].append({"key": row["_id"]["key"], "count": row["count"]})
+    for row in events:
+        bucket(row["_id"]["hour"])["events"][row["_id"]["key"]] = row["count"]
+
+    return buckets
+
+def merge_analytics_buckets(buckets: List[dict]) -> dict:
+    """Combine hourly buckets into window totals and top-10 breakdowns"""
+    totals = _empty_analytics_bucket()
+    pages, countries, referrers = defaultdict(int), defaultdict(int), defaultdict(int)
+    country_codes = {}
+    session_ids = set()
+
+    for b in buckets:
+        for field in ("visitors", "registered", "guests", "duration_sum", "page_views"):
+            totals[field] += b.get(field, 0)
+        if "session_ids" in b:
+            session_ids.update(b["session_ids"])
+        else:
+            # Rolled up before buckets kept their session ids
+            totals["unique_visitors"] += b.get("unique_visitors", 0)
+        for event, count in b.get("events", {}).items():
+            totals["events"][event] = totals["events"].get(event, 0) + count
+        for row in b.get("pages", []):
+            pages[row["key"]] += row["count"]
+        for row in b.get("referrers", []):
+            referrers[row["key"]] += row["count"]
+        for row in b.get("countries", []):
+            countries[row["key"]] += row["count"]
+            country_codes.setdefault(row["key"], row.get("code"))
+
+    def top(counts: dict) -> list:
+        return sorted(counts.items(), key=lambda item: item[1], reverse=True)[:10]
+
+    totals["unique_visitors"] += len(session_ids)
+    del totals["session_ids"]
+    totals["pages"] = [{"page": k, "views": n} for k, n in top(pages)]
+    totals["countries"] = [
+        {"country": k, "country_code": country_codes.get(k), "visitors": n}
+        for k, n in top(countries)
+    ]
+    totals["referrers"] = [{"source": k, "visitors": n} for k, n in top(referrers)]
+    return totals
+
+async def rollup_analytics() -> dict:
+    """Fold closed hours since the watermark into analytics_rollups"""
+    current_hour = floor_hour(datetime.now(timezone.utc))
+    state = await db.analytics_rollups.find_one({"_id": ANALYTICS_ROLLUP_STATE})
+
+    if state and state.get("version") == ANALYTICS_ROLLUP_VERSION:
+        start = min(state["through"], current_hour) - timedelta(hours=ANALYTICS_ROLLUP_REPROCESS_HOURS)
+    else:
+        # First run (or older bucket shape) - start from the oldest raw record
+        oldest = await asyncio.gather(
+            db.visitor_sessions.find_one({}, {"first_visit": 1}, sort=[("first_visit", 1)]),
+            db.page_views.find_one({}, {"timestamp": 1}, sort=[("timestamp", 1)]),
+            db.analytics_events.find_one({}, {"timestamp": 1}, sort=[("timestamp", 1)])
+        )
+        firsts = [doc.get("first_visit") or doc.get("timestamp") for doc in oldest if doc]
+        firsts = [value for value in firsts if isinstance(value, datetime)]
+        start = floor_hour(min(firsts)) if firsts else current_hour
+
+    written = 0
+    chunk_start = start
+    while chunk_start < current_hour:
+        chunk_end = min(chunk_start + timedelta(hours=ANALYTICS_ROLLUP_CHUNK_HOURS), current_hour)
+        buckets = await aggregate_analytics_hours(chunk_start, chunk_end)
+
+        # Hours that no longer have raw data must not keep stale buckets
+        await db.analytics_rollups.delete_many({
+            "_id": {"$gte": chunk_start, "$lt": chunk_end, "$nin": list(buckets)}
+        })
+        if buckets:
+            await db.analytics_rollups.bulk_write([
+                ReplaceOne({"_id": hour_start}, values, upsert=True)
+                for hour_start, values in buckets.items()
+            ], ordered=False)
+        written += len(buckets)
+        chunk_start = chunk_end
+
+    await db.analytics_rollups.update_one(
+        {"_id": ANALYTICS_ROLLUP_STATE},
+        {"$set": {
+            "through": current_hour, "version": ANALYTICS_ROLLUP_VERSION, "updated_at": datetime.now(timezone.utc)
+        }},
+        upsert=True
+    )
+    return {"from": start, "through": current_hour, "hours_written": written}
+
+async def analytics_rollup_loop():
+    """Keep analytics rollups current while the server runs"""
+    while True:
+        try:
+            await rollup_analytics()
+        except Exception as e:
+            logging.error(f"[analytics] Rollup failed: {str(e)}")
+        await asyncio.sleep(ANALYTICS_ROLLUP_INTERVAL_SECONDS)
+
+
+# ============================================
+# CONTACT AUTOCOMPLETE
+# ============================================
+
+class _TrieNode:
+    # Containers are allocated on first use: most nodes are either leaves
+    # (values, no edges) or branch points (edges, no values)
+    __slots__ = ("edges", "values")
+
+    def __init__(self):
+        # first character -> (edge label, child node)
+        self.edges: Optional[Dict[str, tuple]] = None
+        self.values: Optional[set] = None
+
+
+class PrefixIndex:
+    """
+    Compressed (radix) prefix trie mapping lowercase keys to sets of values.
+
+    Edges carry whole label strings rather than single characters, so a
+    chain of single-child nodes collapses into one edge; nodes are split on
+    insert and merged back on removal to keep that invariant.
+    """
+
+    def __init__(self):
+        self.root = _TrieNode()
+        self.keys = 0
+
+    def add(self, key: str, value: str):
+        node = self.root
+        while key:
+            edge = node.edges.get(key[0]) if node.edges else None
+            if edge is None:
+                child = _TrieNode()
+                if node.edges is None:
+                    node.edges = {}
+                node.edges[key[0]] = (key, child)
+                node = child
+                break
+            label, child = edge
+            common = 0
+            while common < min(len(label), len(key)) and label[common] == key[common]:
+                common += 1
+            if common < len(label):
+                # Split the edge at the divergence point
+                middle = _TrieNode()
+                middle.edges = {label[common]: (label[common:], child)}
+                node.edges[key[0]] = (label[:common], middle)
+                child = middle
+            node = child
+            key = key[common:]
+        if not node.values:
+            self.keys += 1
+            node.values = set()
+        node.values.add(value)
+
+    def remove(self, key: str, value: str):
+        path = []
+        node = self.root
+        while key:
+            edge = node.edges.get(key[0]) if node.edges else None
+            if edge is None or not key.startswith(edge[0]):
+                return
+            path.append((node, key[0]))
+            node = edge[1]
+            key = key[len(edge[0]):]
+        if not node.values or value not in node.values:
+            return
+        node.values.discard(value)
+        if not node.values:
+            node.values = None
+            self.keys -= 1
+
+        # Prune emptied leaves and re-merge pass-through nodes, bottom up
+        while path:
+            parent, first = path.pop()
+            label, child = parent.edges[first]
+            if child.values:
+                break
+            if not child.edges:
+                del parent.edges[first]
+                if not parent.edges:
+                    parent.edges = None
+            elif len(child.edges) == 1:
+                (child_label, grandchild), = child.edges.values()
+                parent.edges[first] = (label + child_label, grandchild)
+            else:
+                break
+
+    def search(self, prefix: str, limit: int) -> List[str]:
+        """Up to `limit` distinct values under `prefix`, nearest nodes first"""
+        node = self.root
+        while prefix:
+            edge = node.edges.get(prefix[0]) if node.edges else None
+            if edge is None:
+                return []
+            label, child = edge
+            if prefix.startswith(label):
+                prefix = prefix[len(label):]
+            elif label.startswith(prefix):
+                prefix = ""
+            else:
+                return []
+            node = child
+
+        # Breadth-first so completions with fewer branch points win
+        found, seen = [], set()
+        level = [node]
+        while level and len(found) < limit:
+            next_level = []
+            for current in level:
+                for value in sorted(current.values or ()):
+                    if value not in seen:
+                        seen.add(value)
+                        found.append(value)
+                        if len(found) >= limit:
+                            return found
+                if current.edges:
+                    next_level.extend(current.edges[c][1] for c in sorted(current.edges))
+            level = next_level
+        return found
+
+    def stats(self) -> dict:
+        """Node/edge counts and an approximate deep memory footprint"""
+        nodes = edges = label_chars = values = 0
+        size = sys.getsizeof(self)
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            nodes += 1
+            size += sys.getsizeof(node)
+            if node.values:
+                values += len(node.values)
+                size += sys.getsizeof(node.values)
+            if node.edges:
+                size += sys.getsizeof(node.edges)
+                for edge in node.edges.values():
+                    label, child = edge
+                    edges += 1
+                    label_chars += len(label)
+                    size += sys.getsizeof(edge) + sys.getsizeof(label)
+                    stack.append(child)
+        return {
+            "keys": self.keys,
+            "nodes": nodes,
+            "edges": edges,
+            "label_chars": label_chars,
+            "values": values,
+            "approx_bytes": size
+        }
+
+
+class ContactAutocomplete:
+    """
+    Email / name completions for the admin dashboard.
+
+    Each contact is indexed under its email, full name and each name word.
+    The index lives in this process only: it is loaded from the contacts read
+    model at startup and updated by this process's build_contacts() calls;
+    sync_contact_autocomplete() picks up contacts written by other processes.
+    """
+
+    def __init__(self):
+        self.index = PrefixIndex()
+        self.names: Dict[str, str] = {}
+        # When the full load started, and when contacts were last read
+        self.loaded_at: Optional[datetime] = None
+        self.synced_at: Optional[datetime] = None
+
+    @staticmethod
+    def _keys(email: str, name: str) -> set:
+        name = (name or "").strip().lower()
+        keys = {email}
+        if name:
+            keys.add(name)
+            keys.update(name.split())
+        return keys
+
+    def add(self, email: str, name: str = ""):
+        if email in self.names:
+            if self.names[email] == (name or ""):
+                return
+            self.remove(email)
+        self.names[email] = name or ""
+        for key in self._keys(email, name):
+            self.index.add(key, email)
+
+    def remove(self, email: str):
+        name = self.names.pop(email, None)
+        if name is None:
+            return
+        for key in self._keys(email, name):
+            self.index.remove(key, email)
+
+    def complete(self, prefix: str, limit: int = 10) -> List[dict]:
+        emails = self.index.search(prefix.strip().lower(), limit)
+        return [{"email": email, "name": self.names.get(email, "")} for email in emails]
+
+    def stats(self) -> dict:
+        names_bytes = sys.getsizeof(self.names) + sum(
+            sys.getsizeof(email) + sys.getsizeof(name) for email, name in self.names.items()
+        )
+        index = self.index.stats()
+        return {
+            "contacts": len(self.names),
+            **index,
+            "approx_bytes": index["approx_bytes"] + names_bytes
+        }
+
+
+contact_autocomplete = ContactAutocomplete()
+
+# In-memory contact indexes are brought up to date with the contacts
+# collection this often, and fully reloaded at least this often
+CONTACT_INDEX_SYNC_SECONDS = int(os.environ.get("CONTACT_INDEX_SYNC_SECONDS", "30"))
+CONTACT_INDEX_RELOAD_MINUTES = int(os.environ.get("CONTACT_INDEX_RELOAD_MINUTES", "30"))
+# Contacts built this long before the last sync are read again, covering
+# builds still in flight at the time and clock skew between processes
+CONTACT_INDEX_SYNC_OVERLAP_SECONDS = 120
+
+async def load_contact_autocomplete() -> int:
+    """Fill the autocomplete index from the contacts read model"""
+    started = time.perf_counter()
+    autocomplete = ContactAutocomplete()
+    autocomplete.loaded_at = autocomplete.synced_at = datetime.now(timezone.utc)
+    async for contact in db.contacts.find({}, {"_id": 1, "name": 1}).batch_size(5000):
+        autocomplete.add(contact["_id"], contact.get("name", ""))
+
+    # Swap in the finished index so lookups never see a partial build
+    global contact_autocomplete
+    contact_autocomplete = autocomplete
+    logging.info(
+        f"[autocomplete] Indexed {len(autocomplete.names)} contacts "
+        f"in {(time.perf_counter() - started) * 1000:.0f}ms"
+    )
+    return len(autocomplete.names)
+
+async def sync_contact_autocomplete():
+    """Apply contacts built since the last sync, reloading when that can't be enough
+
+    Removed contacts leave nothing to read, so a count mismatch (or a load
+    older than CONTACT_INDEX_RELOAD_MINUTES) triggers a full reload.
+    """
+    autocomplete = contact_autocomplete
+    now = datetime.now(timezone.utc)
+    if autocomplete.loaded_at is None or now - autocomplete.loaded_at > timedelta(minutes=CONTACT_INDEX_RELOAD_MINUTES):
+        await load_contact_autocomplete()
+        return
+
+    since = autocomplete.synced_at - timedelta(seconds=CONTACT_INDEX_SYNC_OVERLAP_SECONDS)
+    async for contact in db.contacts.find({"built_at": {"$gte": since}}, {"_id": 1, "name": 1}):
+        autocomplete.add(contact["_id"], contact.get("name", ""))
+    autocomplete.synced_at = now
+
+    if await db.contacts.estimated_document_count() != len(autocomplete.names):
+        await load_contact_autocomplete()
+
+
+# ============================================
+# AUDIENCE SEGMENTS
+# ============================================
+
+# Contact fields the segment attributes are derived from
+SEGMENT_CONTACT_PROJECTION = {
+    "discipline": 1, "sources": 1, "waitlist_products": 1, "orders_count": 1, "signed_up": 1,
+    "counts": 1, "has_early_access": 1, "has_giveaway_entry": 1, "has_cart": 1, "unsubscribed": 1
+}
+
+# Segment leaves taking a value; every other leaf is a true/false flag
+SEGMENT_VALUE_ATTRIBUTES = ("discipline", "source", "waitlist")
+SEGMENT_FLAG_ATTRIBUTES = (
+    "signed_up", "subscribed", "waitlist", "ordered", "early_access", "giveaway", "has_cart", "unsubscribed"
+)
+
+def segment_attributes(contact: dict) -> frozenset:
+    """The (attribute, value) pairs a contact is a member of"""
+    counts = contact.get("counts") or {}
+    attributes = {("discipline", (contact.get("discipline") or "unknown").lower())}
+    attributes.update(("source", source.lower()) for source in contact.get("sources", []) if source)
+    attributes.update(("waitlist", product.lower()) for product in contact.get("waitlist_products", []) if product)
+
+    flags = {
+        "signed_up": contact.get("signed_up"),
+        "subscribed": counts.get("subscription", 0) > 0,
+        "waitlist": counts.get("waitlist", 0) > 0,
+        "ordered": contact.get("orders_count", 0) > 0,
+        "early_access": contact.get("has_early_access"),
+        "giveaway": contact.get("has_giveaway_entry"),
+        "has_cart": contact.get("has_cart"),
+        "unsubscribed": contact.get("unsubscribed"),
+    }
+    attributes.update((flag, True) for flag, value in flags.items() if value)
+    return frozenset(attributes)
+
+
+class SegmentIndex:
+    """
+    Membership bitmaps for audience segments.
+
+    Each contact holds a dense integer id (freed ids are reused) and every
+    attribute value keeps a bitmap of its members as a Python int, bit n
+    standing for contact n. Segment expressions are evaluated with bitwise
+    and / or / not over those ints, without touching the database. Like the
+    autocomplete index it is loaded at startup, updated by build_contacts()
+    and synced with other processes' writes by sync_segment_index(); it
+    backs segment previews and resolves bulk email audiences.
+
+    Expressions are JSON: {"and": [...]}, {"or": [...]}, {"not": expr} or a
+    single-key leaf such as {"discipline": "WAG"}, {"source": "giveaway_popup"},
+    {"waitlist": "Product name"} or a flag like {"ordered": true}.
+    """
+
+    def __init__(self):
+        # When the full load started, and when contacts were last read
+        self.loaded_at: Optional[datetime] = None
+        self.synced_at: Optional[datetime] = None
+        self.ids: Dict[str, int] = {}
+        self.emails: List[Optional[str]] = []
+        self.free_ids: List[int] = []
+        self.universe = 0
+        # (attribute, value) -> bitmap of member ids
+        self.bitmaps: Dict[tuple, int] = {}
+        # email -> its attributes, so an update only flips the bits that changed
+        self.attributes: Dict[str, frozenset] = {}
+
+    def set(self, email: str, contact: dict):
+        attributes = segment_attributes(contact)
+        previous = self.attributes.get(email)
+        if previous == attributes:
+            return
+
+        if email in self.ids:
+            contact_id = self.ids[email]
+        else:
+            contact_id = self.free_ids.pop() if self.free_ids else len(self.emails)
+            if contact_id == len(self.emails):
+                self.emails.append(email)
+            else:
+                self.emails[contact_id] = email
+            self.ids[email] = contact_id
+            self.universe |= 1 << contact_id
+            previous = frozenset()
+
+        bit = 1 << contact_id
+        for key in previous - attributes:
+            self.bitmaps[key] &= ~bit
+        for key in attributes - previous:
+            self.bitmaps[key] = self.bitmaps.get(key, 0) | bit
+        self.attributes[email] = attributes
+
+    def remove(self, email: str):
+        contact_id = self.ids.pop(email, None)
+        if contact_id is None:
+            return
+        bit = 1 << contact_id
+        for key in self.attributes.pop(email):
+            self.bitmaps[key] &= ~bit
+        self.universe &= ~bit
+        self.emails[contact_id] = None
+        self.free_ids.append(contact_id)
+
+    def evaluate(self, expression) -> int:
+        """Bitmap of the contacts matching an expression; raises ValueError if it is malformed"""
+        if not isinstance(expression, dict) or len(expression) != 1:
+            raise ValueError("Segment expressions are objects with exactly one key")
+        (operator, operand), = expression.items()
+
+        if operator in ("and", "or"):
+            if not isinstance(operand, list) or not operand:
+                raise ValueError(f"'{operator}' takes a non-empty list")
+            bitmaps = [self.evaluate(item) for item in operand]
+            result = bitmaps[0]
+            for bitmap in bitmaps[1:]:
+                result = result & bitmap if operator == "and" else result | bitmap
+            return result
+        if operator == "not":
+            return self.universe & ~self.evaluate(operand)
+
+        if operand is True or operand is False:
+            if operator not in SEGMENT_FLAG_ATTRIBUTES:
+                raise ValueError(f"Unknown segment flag: {operator}")
+            bitmap = self.bitmaps.get((operator, True), 0)
+            return bitmap if operand else self.universe & ~bitmap
+        if operator not in SEGMENT_VALUE_ATTRIBUTES or not isinstance(operand, str):
+            raise ValueError(f"Unknown segment attribute: {operator}")
+        return self.bitmaps.get((operator, operand.strip().lower()), 0)
+
+    def members(self, bitmap: int, limit: Optional[int] = None) -> List[str]:
+        """Emails of the contacts in a bitmap, in id order"""
+        emails = []
+        data = bitmap.to_bytes((bitmap.bit_length() + 7) // 8, "little")
+        for offset, byte in enumerate(data):
+            while byte:
+                low = byte & -byte
+                emails.append(self.emails[offset * 8 + low.bit_length() - 1])
+                if limit is not None and len(emails) >= limit:
+                    return emails
+                byte ^= low
+        return emails
+
+    def stats(self) -> dict:
+        values = defaultdict(dict)
+        for (attribute, value), bitmap in self.bitmaps.items():
+            if bitmap:
+                values[attribute][str(value).lower() if value is True else value] = bitmap.bit_count()
+        return {
+            "contacts": len(self.ids),
+            "id_space": len(self.emails),
+            "bitmaps": sum(1 for bitmap in self.bitmaps.values() if bitmap),
+            "approx_bytes": sum(sys.getsizeof(bitmap) for bitmap in self.bitmaps.values()),
+            "attributes": values
+        }
+
+
+segment_index = SegmentIndex()
+
+async def load_segment_index() -> int:
+    """Fill the segment bitmaps from the contacts read model"""
+    started = time.perf_counter()
+    index = SegmentIndex()
+    index.loaded_at = index.synced_at = datetime.now(timezone.utc)
+    async for contact in db.contacts.find({}, SEGMENT_CONTACT_PROJECTION).sort("_id", 1).batch_size(5000):
+        index.set(contact["_id"], contact)
+
+    # Swap in the finished index so segment queries never see a partial build
+    global segment_index
+    segment_index = index
+    logging.info(
+        f"[segments] Indexed {len(index.ids)} contacts into {len(index.bitmaps)} bitmaps "
+        f"in {(time.perf_counter() - started) * 1000:.0f}ms"
+    )
+    return len(index.ids)
+
+async def sync_segment_index():
+    """Apply contacts built since the last sync, as sync_contact_autocomplete does"""
+    index = segment_index
+    now = datetime.now(timezone.utc)
+    if index.loaded_at is None or now - index.loaded_at > timedelta(minutes=CONTACT_INDEX_RELOAD_MINUTES):
+        await load_segment_index()
+        return
+
+    since = index.synced_at - timedelta(seconds=CONTACT_INDEX_SYNC_OVERLAP_SECONDS)
+    async for contact in db.contacts.find({"built_at": {"$gte": since}}, SEGMENT_CONTACT_PROJECTION):
+        index.set(contact["_id"], contact)
+    index.synced_at = now
+
+    if await db.contacts.estimated_document_count() != len(index.ids):
+        await load_segment_index()
+
+async def contact_index_sync_loop():
+    """Keep this process's in-memory contact indexes in step with the contacts collection"""
+    while True:
+        await asyncio.sleep(CONTACT_INDEX_SYNC_SECONDS)
+        for name, sync in (("autocomplete", sync_contact_autocomplete), ("segments", sync_segment_index)):
+            try:
+                await sync()
+            except Exception as e:
+                logging.error(f"[{name}] Sync failed: {str(e)}")
+
+
+# ============================================
+# CONTACTS READ MODEL
+# ============================================
+
+# contacts holds one document per normalized email (_id) summarising that
+# address across users, email_subscriptions, waitlist, orders and carts.
+# Write paths call refresh_contacts() (or schedule_contact_refresh() when
+# they shouldn't wait) for the emails they touch; each document records in
+# built_at when its source rows were read, and a refresh never replaces a
+# document built from a later read.
+# rebuild_contacts() regenerates everything and runs at startup whenever
+# stored documents predate CONTACTS_SCHEMA_VERSION.
+CONTACTS_SCHEMA_VERSION = 3
+CONTACTS_BATCH_SIZE = 500
+
+# Contact fields returned by the admin endpoints
+CONTACT_FIELDS = [
+    "email", "name", "discipline", "auth_provider", "signed_up", "signup_date",
+    "signup_source", "has_giveaway_entry", "has_early_access", "waitlist_products",
+    "orders_count", "total_spent", "has_cart"
+]
+CONTACT_PROJECTION = {"_id": 0, **{field: 1 for field in CONTACT_FIELDS}}
+
+# Collections whose entries make an email a contact (orders and carts only enrich)
+CONTACT_SOURCE_COLLECTIONS = ("users", "email_subscriptions", "waitlist")
+
+def contact_search_tokens(*values: str) -> List[str]:
+    """Lowercased search tokens: each whole value plus its alphanumeric parts"""
+    tokens = set()
+    for value in values:
+        value = (value or "").strip().lower()
+        if not value:
+            continue
+        tokens.add(value)
+        tokens.update(part for part in re.split(r"[^a-z0-9]+", value) if part)
+    return sorted(tokens)
+
+def build_contact(key: str, users: List[dict], subscriptions: List[dict], waitlist: List[dict],
+                  orders: List[dict], carts: List[dict]) -> Optional[dict]:
+    """Summarise one email's documents into a contacts document"""
+    if not (users or subscriptions or waitlist):
+        return None
+
+    oldest = datetime.min.replace(tzinfo=timezone.utc)
+    subscriptions = sorted(subscriptions, key=lambda s: s.get('timestamp') or oldest)
+    waitlist = sorted(waitlist, key=lambda w: w.get('created_at') or oldest)
+    user = users[0] if users else None
+    first = user or (subscriptions[0] if subscriptions else waitlist[0])
+    sources = [s.get('source', '') for s in subscriptions]
+
+    if user:
+        signup_date = user.get('created_at')
+        signup_source = "direct"
+        for source in sources:
+            if source == 'giveaway_popup':
+                signup_source = "giveaway"
+                break
+            elif source == 'early_access':
+                signup_source = "early_access"
+                break
+    elif subscriptions:
+        signup_date = subscriptions[0].get('timestamp')
+        signup_source = sources[0]
+    else:
+        signup_date = waitlist[0].get('created_at')
+        signup_source = "waitlist"
+
+    waitlist_products = []
+    for entry in waitlist:
+        product = entry.get('product_name', '')
+        if product and product not in waitlist_products:
+            waitlist_products.append(product)
+
+    counts = {"user": len(users), "subscription": len(subscriptions), "waitlist": len(waitlist)}
+    name = first.get('name', '')
+    unsubscribed = any(doc.get('email_subscribed') is False for doc in users + subscriptions + waitlist)
+
+    return {
+        "_id": key,
+        "email": key,
+        "name": name,
+        "discipline": first.get('discipline', 'unknown'),
+        "auth_provider": user.get('auth_provider', '') if user else "",
+        "signed_up": user is not None,
+        "signup_date": signup_date,
+        "signup_source": signup_source,
+        "sources": sorted(set(sources)),
+        "has_giveaway_entry": 'giveaway_popup' in sources,
+        "has_early_access": 'early_access' in sources,
+        "waitlist_products": waitlist_products,
+        "orders_count": len(orders),
+        "total_spent": sum(o.get('total', 0) or 0 for o in orders),
+        "has_cart": len(carts) > 0,
+        "unsubscribed": unsubscribed,
+        "counts": counts,
+        "search_tokens": contact_search_tokens(key, name, *(o.get('order_number') for o in orders)),
+        "schema_version": CONTACTS_SCHEMA_VERSION,
+        "built_at": datetime.now(timezone.utc)
+    }
+
+async def build_contacts(keys: List[str]) -> int:
+    """Recompute the contacts documents for a batch of normalized emails"""
+    read_at = datetime.now(timezone.utc)
+    users, subscriptions, waitlist, orders, carts = await asyncio.gather(
+        group_by_email(db.users, keys, {
+            "name": 1, "discipline": 1, "auth_provider": 1, "created_at": 1, "email_subscribed": 1
+        }),
+        group_by_email(db.email_subscriptions, keys, {
+            "source": 1, "timestamp": 1, "name": 1, "discipline": 1, "email_subscribed": 1
+        }),
+        group_by_email(db.waitlist, keys, {
+            "product_name": 1, "created_at": 1, "name": 1, "discipline": 1, "email_subscribed": 1
+        }),
+        group_by_email(db.orders, keys, {"total": 1, "order_number": 1}),
+        group_by_email(db.carts, keys, {"email_normalized": 1})
+    )
+
+    replacements, gone = [], []
+    for key in keys:
+        contact = build_contact(
+            key, users.get(key, []), subscriptions.get(key, []), waitlist.get(key, []),
+            orders.get(key, []), carts.get(key, [])
+        )
+        if contact:
+            contact["built_at"] = read_at
+            replacements.append(ReplaceOne({"_id": key, "built_at": {"$lte": read_at}}, contact, upsert=True))
+            contact_autocomplete.add(key, contact["name"])
+            segment_index.set(key, contact)
+        else:
+            gone.append(key)
+            contact_autocomplete.remove(key)
+            segment_index.remove(key)
+
+    if replacements:
+        try:
+            await db.contacts.bulk_write(replacements, ordered=False)
+        except BulkWriteError as e:
+            # Duplicate keys are upserts that lost to a newer build of the same contact
+            if any(error.get("code") != 11000 for error in e.details.get("writeErrors", [])):
+                raise
+    if gone:
+        await db.contacts.delete_many({"_id": {"$in": gone}, "built_at": {"$lte": read_at}})
+    return len(replacements)
+
+async def refresh_contacts(*emails: str):
+    """Bring the contacts documents for these emails up to date after a write"""
+    keys = list({normalize_email(email) for email in emails if email})
+    if not keys:
+        return
+    try:
+        await build_contacts(keys)
+    except Exception as e:
+        # rebuild_contacts repairs anything missed here
+        logging.error(f"[contacts] Refresh failed for {keys}: {str(e)}")
+
+# Refreshes started by schedule_contact_refresh, kept so they aren't collected mid-run
+contact_refresh_tasks = set()
+
+def schedule_contact_refresh(*emails: str):
+    """Refresh contacts in the background without holding up the request"""
+    task = asyncio.create_task(refresh_contacts(*emails))
+    contact_refresh_tasks.add(task)
+    task.add_done_callback(contact_refresh_tasks.discard)
+
+async def rebuild_contacts(on_progress=None) -> dict:
+    """Regenerate the whole contacts collection from the source collections
+
+    on_progress(built), if given, is awaited after each batch.
+    """
+    started = datetime.now(timezone.utc)
+    seen = set()
+    batch = []
+    built = 0
+
+    for collection_name in CONTACT_SOURCE_COLLECTIONS:
+        cursor = db[collection_name].aggregate([
+            {"$match": {"email_normalized": {"$type": "string"}}},
+            {"$group": {"_id": "$email_normalized"}}
+        ], allowDiskUse=True)
+        async for row in cursor:
+            if row["_id"] in seen:
+                continue
+            seen.add(row["_id"])
+            batch.append(row["_id"])
+            if len(batch) >= CONTACTS_BATCH_SIZE:
+                built += await build_contacts(batch)
+                batch = []
+                if on_progress:
+                    await on_progress(built)
+    if batch:
+        built += await build_contacts(batch)
+
+    # Anything not rebuilt (or refreshed) during this pass no longer exists
+    removed = (await db.contacts.delete_many({"built_at": {"$lt": started}})).deleted_count
+
+    logging.info(f"[contacts] Rebuilt {built} contacts, removed {removed}")
+    return {"built": built, "removed": removed, "schema_version": CONTACTS_SCHEMA_VERSION}
+
+async def ensure_contacts():
+    """Queue a rebuild_contacts job if the collection is empty or from an older schema
+
+    The job id is fixed per schema version, so when every worker starts at
+    once only one rebuild is queued, and it runs on a single job worker.
+    """
+    stale = await db.contacts.find_one({"schema_version": {"$ne": CONTACTS_SCHEMA_VERSION}}, {"_id": 1})
+    empty = await db.contacts.find_one({}, {"_id": 1}) is None
+    if stale or empty:
+        await queue_contacts_rebuild()
+
+async def queue_contacts_rebuild() -> dict:
+    """Queue the rebuild_contacts job unless one is already queued or running"""
+    job_id = f"rebuild_contacts-v{CONTACTS_SCHEMA_VERSION}"
+    # A finished (or failed) earlier rebuild makes way for a new one
+    await db.admin_jobs.delete_one({"_id": job_id, "status": {"$in": list(ADMIN_JOB_TERMINAL_STATES)}})
+    try:
+        return await submit_admin_job("rebuild_contacts", job_id=job_id)
+    except DuplicateKeyError:
+        job = await db.admin_jobs.find_one({"_id": job_id}, {"type": 1, "status": 1})
+        return {"job_id": job_id, "type": "rebuild_contacts", "status": job["status"] if job else "queued"}
+
+
+# ============================================
+# BULK CONTACT CLEANUP
+# ============================================
+
+# Emails handled per batch by the bulk delete / merge helpers
+CONTACT_CLEANUP_CHUNK_SIZE = 500
+
+# Emails kept verbatim in a bulk action's activity log entry
+ACTIVITY_LOG_EMAIL_SAMPLE = 100
+
+def chunked(items: List, size: int):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+def _cleanup_keys(emails: List[str]) -> List[str]:
+    return sorted({normalize_email(email) for email in emails if email and email.strip()})
+
+async def bulk_delete_emails(emails: List[str], collections: List[str], on_progress=None) -> dict:
+    """Delete every entry for these emails from the given collections
+
+    Works through CONTACT_CLEANUP_CHUNK_SIZE emails at a time with one
+    $in delete_many per collection per chunk, calling
+    on_progress(done, total, deleted) after each chunk.
+    """
+    keys = _cleanup_keys(emails)
+    deleted = {name: 0 for name in collections}
+
+    done = 0
+    for chunk in chunked(keys, CONTACT_CLEANUP_CHUNK_SIZE):
+        query = {"email_normalized": {"$in": chunk}}
+        results = await asyncio.gather(*(delete_counted(name, query) for name in collections))
+        for name, count in zip(collections, results):
+            deleted[name] += count
+        if "users" in collections:
+            # Cached user documents are keyed by user_id, which isn't known here
+            invalidate_cached_user()
+        await refresh_contacts(*chunk)
+
+        done += len(chunk)
+        logging.info(f"[cleanup] Deleted entries for {done}/{len(keys)} emails")
+        if on_progress:
+            await on_progress(done, len(keys), deleted)
+
+    return {"emails": len(keys), "deleted": deleted}
+
+async def bulk_merge_duplicates(emails: List[str], on_progress=None) -> dict:
+    """Drop surplus subscription (per source) and waitlist (per product) entries
+
+    The oldest entry of each group is kept. Surplus ids for a whole chunk of
+    emails are removed with a single delete_many per collection.
+    """
+    keys = _cleanup_keys(emails)
+    # collection -> field that must be unique per email
+    unique_per_email = {"email_subscriptions": "source", "waitlist": "product_name"}
+    deleted = {name: 0 for name in unique_per_email}
+
+    done = 0
+    for chunk in chunked(keys, CONTACT_CLEANUP_CHUNK_SIZE):
+        query = {"email_normalized": {"$in": chunk}}
+        for name, field in unique_per_email.items():
+            seen = set()
+            surplus = []
+            cursor = db[name].find(query, {"_id": 1, "email_normalized": 1, field: 1}).sort("_id", 1)
+            async for doc in cursor:
+                group = (doc.get("email_normalized"), doc.get(field, ''))
+                if group in seen:
+                    surplus.append(doc["_id"])
+                else:
+                    seen.add(group)
+            if surplus:
+                deleted[name] += await delete_counted(name, {"_id": {"$in": surplus}})
+        await refresh_contacts(*chunk)
+
+        done += len(chunk)
+        logging.info(f"[cleanup] Merged duplicates for {done}/{len(keys)} emails")
+        if on_progress:
+            await on_progress(done, len(keys), deleted)
+
+    return {"emails": len(keys), "deleted": deleted}
+
+def log_bulk_action(action: str, emails: List[str], result: dict):
+    """Queue one summarised activity log entry for a bulk contact action"""
+    entry = {
+        "action": action,
+        "email_count": len(emails),
+        "emails": emails[:ACTIVITY_LOG_EMAIL_SAMPLE],
+        "emails_truncated": len(emails) > ACTIVITY_LOG_EMAIL_SAMPLE,
+        "deleted": result["deleted"],
+        "deleted_count": sum(result["deleted"].values()),
+        "timestamp": datetime.now(timezone.utc)
+    }
+    if len(emails) == 1:
+        # Single-contact entries keep the "email" field the dashboard shows
+        entry["email"] = emails[0]
+    log_writer.write("activity_log", entry)
+
+
+# ============================================
+# DUPLICATE DETECTION
+# ============================================
+
+# Collection -> key used for its entry count in duplicate results
+DUPLICATE_SOURCES = {"users": "user", "email_subscriptions": "subscription", "waitlist": "waitlist"}
+
+# Cached report written by build_duplicates_report(); its metadata lives in
+# admin_reports under _id "duplicates"
+DUPLICATES_REPORT_COLLECTION = "duplicates_report"
+
+def duplicates_pipeline() -> List[dict]:
+    """Aggregation run on users that unions the email-keyed collections and
+    returns one row per normalized email with more than one entry in any of them"""
+    def tagged(tag: str) -> List[dict]:
+        return [
+            {"$match": {"email_normalized": {"$type": "string"}}},
+            {"$project": {"_id": 0, "email_normalized": 1, "source": {"$literal": tag}}}
+        ]
+
+    collections = list(DUPLICATE_SOURCES.items())
+    pipeline = tagged(collections[0][1])
+    for collection_name, tag in collections[1:]:
+        pipeline.append({"$unionWith": {"coll": collection_name, "pipeline": tagged(tag)}})
+
+    pipeline += [
+        {"$group": {
+            "_id": "$email_normalized",
+            **{tag: {"$sum": {"$cond": [{"$eq": ["$source", tag]}, 1, 0]}} for tag in DUPLICATE_SOURCES.values()}
+        }},
+        {"$match": {"$or": [{tag: {"$gt": 1}} for tag in DUPLICATE_SOURCES.values()]}},
+        {"$sort": {"_id": 1}}
+    ]
+    return pipeline
+
+def format_duplicate(row: dict) -> dict:
+    return {
+        "email": row["_id"],
+        "counts": {tag: row.get(tag, 0) for tag in DUPLICATE_SOURCES.values()},
+        "reason": "multiple_entries"
+    }
+
+async def build_duplicates_report() -> dict:
+    """Materialise the duplicates aggregation into duplicates_report"""
+    started = time.perf_counter()
+    first_collection = next(iter(DUPLICATE_SOURCES))
+    await db[first_collection].aggregate(
+        duplicates_pipeline() + [{"$out": DUPLICATES_REPORT_COLLECTION}],
+        allowDiskUse=True
+    ).to_list(None)
+
+    meta = {
+        "total": await db[DUPLICATES_REPORT_COLLECTION].count_documents({}),
+        "generated_at": datetime.now(timezone.utc),
+        "took_ms": round((time.perf_counter() - started) * 1000)
+    }
+    await db.admin_reports.update_one({"_id": "duplicates"}, {"$set": meta}, upsert=True)
+    logging.info(f"[duplicates] Report built: {meta['total']} emails in {meta['took_ms']}ms")
+    return meta
+
+
+# ============================================
+# BATCHED LOG WRITER
+# ============================================
+
+# activity_log and email_logs entries are queued in memory and flushed with
+# one insert_many per collection, so writing a log never waits on MongoDB.
+# Both collections are bounded by TTL indexes (see MONGO_INDEXES).
+LOG_FLUSH_INTERVAL_SECONDS = 1
+# A buffer this long is flushed without waiting for the interval
+LOG_FLUSH_BATCH_SIZE = 200
+# Entries kept per collection while MongoDB is unreachable; the oldest go first
+LOG_BUFFER_MAX = 10000
+
+# Lifetime email log totals per status live in log_counters under this _id;
+# unlike email_logs itself they are never expired
+EMAIL_LOG_COUNTER_ID = "email_logs"
+
+
+class LogWriter:
+    """Buffers log entries and writes them in batches from a background task"""
+
+    def __init__(self):
+        self.buffers: Dict[str, List[dict]] = defaultdict(list)
+        self.written = 0
+        self.dropped = 0
+        self._wakeup = asyncio.Event()
+        self._stopping = asyncio.Event()
+
+    def write(self, collection_name: str, doc: dict):
+        """Queue a log entry; returns immediately"""
+        buffer = self.buffers[collection_name]
+        buffer.append(doc)
+        if len(buffer) > LOG_BUFFER_MAX:
+            del buffer[0]
+            self.dropped += 1
+        if len(buffer) >= LOG_FLUSH_BATCH_SIZE:
+            self._wakeup.set()
+
+    async def flush(self):
+        """Write every buffered entry now"""
+        for collection_name in list(self.buffers):
+            batch = self.buffers[collection_name]
+            if not batch:
+                continue
+            self.buffers[collection_name] = []
+            try:
+                await db[collection_name].insert_many(batch, ordered=False)
+            except BulkWriteError as e:
+                # Some entries were written; retrying the batch would duplicate them
+                failed = len(e.details.get("writeErrors", []))
+                self.written += len(batch) - failed
+                self.dropped += failed
+                logging.error(f"[logs] {failed} {collection_name} entries could not be written")
+                continue
+            except Exception as e:
+                # Keep the entries for the next flush
+                self.buffers[collection_name] = (batch + self.buffers[collection_name])[-LOG_BUFFER_MAX:]
+                logging.error(f"[logs] Flush to {collection_name} failed: {str(e)}")
+                continue
+
+            self.written += len(batch)
+            if collection_name == "email_logs":
+                await count_email_log_statuses(batch)
+
+    async def run(self):
+        """Flush every LOG_FLUSH_INTERVAL_SECONDS, or sooner when a buffer fills, until stop()"""
+        while not self._stopping.is_set():
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), LOG_FLUSH_INTERVAL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    def stop(self):
+        """Make run() return once any flush in progress has finished"""
+        self._stopping.set()
+        self._wakeup.set()
+
+    def stats(self) -> dict:
+        return {
+            "pending": {name: len(buffer) for name, buffer in self.buffers.items()},
+            "written": self.written,
+            "dropped": self.dropped
+        }
+
+
+log_writer = LogWriter()
+
+async def count_email_log_statuses(entries: List[dict]):
+    """Add a batch of email log entries to the per-status totals"""
+    by_status = defaultdict(int)
+    for entry in entries:
+        by_status[entry.get("status") or "unknown"] += 1
+    try:
+        await db.log_counters.update_one(
+            {"_id": EMAIL_LOG_COUNTER_ID},
+            {"$inc": {f"status.{status}": count for status, count in by_status.items()}},
+            upsert=True
+        )
+    except Exception as e:
+        logging.error(f"[logs] Email status counter update failed: {str(e)}")
+
+async def seed_email_log_counters():
+    """Start the email status totals from the existing logs the first time they are needed"""
+    if await db.log_counters.find_one({"_id": EMAIL_LOG_COUNTER_ID}, {"_id": 1}):
+        return
+    rows = await db.email_logs.aggregate([
+        {"$group": {"_id": "$status", "count": {"$sum": 1}}}
+    ]).to_list(None)
+    await db.log_counters.update_one(
+        {"_id": EMAIL_LOG_COUNTER_ID},
+        {"$setOnInsert": {"status": {(row["_id"] or "unknown"): row["count"] for row in rows}}},
+        upsert=True
+    )
+    logging.info(f"[logs] Seeded email status counters from {sum(row['count'] for row in rows)} logs")
+
+
+# ============================================
+# DATA RETENTION
+# ============================================
+
+# user_sessions, and pending_orders / payment_transactions of unpaid
+# checkouts, expire through the TTL indexes in MONGO_INDEXES. A paid
+# checkout's pending order is the only copy of its items and shipping address
+# until the customer's return to the success page creates the order, so
+# payment removes the expiry from both. The TTL monitor ignores documents
+# whose date field is missing or not a BSON date, so sweep_retention() dates
+# (or, for unusable sessions, deletes) those legacy rows. It runs at startup
+# and every RETENTION_SWEEP_INTERVAL_HOURS; its last report is kept in
+# admin_reports under _id "retention".
+RETENTION_SWEEP_INTERVAL_HOURS = int(os.environ.get("RETENTION_SWEEP_INTERVAL_HOURS", "24"))
+RETENTION_SWEEP_BATCH_SIZE = 1000
+
+async def record_payment_status(session_id: str, fields: dict):
+    """Store a checkout's transaction status; once paid, nothing of it expires"""
+    update = {"$set": fields}
+    if fields.get("payment_status") == "paid":
+        update["$unset"] = {"expires_at": ""}
+        await db.pending_orders.update_one({"session_id": session_id}, {"$unset": {"expires_at": ""}})
+    await db.payment_transactions.update_one({"session_id": session_id}, update)
+
+def retention_policies(now: datetime) -> Dict[str, dict]:
+    """Per collection: configured retention and the filter for rows already past it"""
+    return {
+        "user_sessions": {
+            "retention": f"{USER_SESSION_GRACE_SECONDS}s after expires_at",
+            "expired": {"expires_at": {"$lt": now - timedelta(seconds=USER_SESSION_GRACE_SECONDS)}}
+        },
+        "pending_orders": {
+            "retention": f"{PENDING_ORDER_RETENTION_HOURS}h after created_at, unpaid only",
+            "expired": {"expires_at": {"$lt": now}}
+        },
+        "payment_transactions": {
+            "retention": f"{PAYMENT_TRANSACTION_RETENTION_DAYS}d after created_at, unpaid only",
+            "expired": {"expires_at": {"$lt": now}}
+        }
+    }
+
+async def count_paid_pending_orders() -> int:
+    """Pending orders kept because their checkout was paid but the order never created
+
+    Joined to payment_transactions on session_id, so legacy rows the sweep
+    has not dated yet don't count.
+    """
+    result = await db.pending_orders.aggregate([
+        {"$match": {"expires_at": {"$exists": False}}},
+        {"$lookup": {
+            "from": "payment_transactions", "localField": "session_id",
+            "foreignField": "session_id", "as": "transactions"
+        }},
+        {"$match": {"transactions.payment_status": "paid"}},
+        {"$count": "count"}
+    ]).to_list(1)
+    return result[0]["count"] if result else 0
+
+def _created_at(doc: dict) -> Optional[datetime]:
+    """A legacy row's creation time: created_at, else the time in its ObjectId"""
+    if isinstance(doc.get("created_at"), datetime):
+        return doc["created_at"]
+    if isinstance(doc.get("_id"), ObjectId):
+        return doc["_id"].generation_time
+    return None
+
+async def _date_legacy_rows(collection, query: dict, retention: timedelta, skip_paid: bool = False) -> int:
+    """Give rows matching query an expires_at `retention` after their creation
+
+    With skip_paid, rows whose session_id has a paid transaction are left alone.
+    """
+    dated = 0
+
+    async def write(docs: List[dict]) -> int:
+        if skip_paid:
+            paid = set(await db.payment_transactions.distinct("session_id", {
+                "session_id": {"$in": [doc.get("session_id") for doc in docs]}, "payment_status": "paid"
+            }))
+            docs = [doc for doc in docs if doc.get("session_id") not in paid]
+        updates = [
+            UpdateOne({"_id": doc["_id"]}, {"$set": {"expires_at": _created_at(doc) + retention}})
+            for doc in docs if _created_at(doc)
+        ]
+        return (await collection.bulk_write(updates, ordered=False)).modified_count if updates else 0
+
+    batch = []
+    async for doc in collection.find(query, {"created_at": 1, "session_id": 1}):
+        batch.append(doc)
+        if len(batch) >= RETENTION_SWEEP_BATCH_SIZE:
+            dated += await write(batch)
+            batch = []
+    if batch:
+        dated += await write(batch)
+    return dated
+
+async def sweep_retention() -> dict:
+    """Date or delete the rows the TTL indexes cannot see; returns a report"""
+    now = datetime.now(timezone.utc)
+    no_expiry = {"expires_at": {"$exists": False}}
+
+    # Sessions keep working with a string expires_at (see get_current_user);
+    # convert those, and drop sessions whose expiry is missing or unreadable
+    sessions_dated = 0
+    unusable = []
+    async for doc in db.user_sessions.find({"expires_at": {"$not": {"$type": "date"}}}, {"expires_at": 1}):
+        try:
+            expires_at = parse_datetime(doc.get("expires_at")) if isinstance(doc.get("expires_at"), str) else None
+        except ValueError:
+            expires_at = None
+        if expires_at is None:
+            unusable.append(doc["_id"])
+        else:
+            await db.user_sessions.update_one({"_id": doc["_id"]}, {"$set": {"expires_at": expires_at}})
+            sessions_dated += 1
+    sessions_deleted = (await db.user_sessions.delete_many({"_id": {"$in": unusable}})).deleted_count if unusable else 0
+
+    dated = {
+        "user_sessions": sessions_dated,
+        # Checkouts from before expires_at existed, unless they were paid
+        "pending_orders": await _date_legacy_rows(
+            db.pending_orders, no_expiry, timedelta(hours=PENDING_ORDER_RETENTION_HOURS), skip_paid=True
+        ),
+        "payment_transactions": await _date_legacy_rows(
+            db.payment_transactions, {**no_expiry, "payment_status": {"$ne": "paid"}, "order_id": None},
+            timedelta(days=PAYMENT_TRANSACTION_RETENTION_DAYS)
+        )
+    }
+
+    report = {"swept_at": now, "deleted": {"user_sessions": sessions_deleted}, "dated": dated}
+    await db.admin_reports.update_one({"_id": "retention"}, {"$set": report}, upsert=True)
+    if sessions_deleted or any(dated.values()):
+        logging.info(f"[retention] Swept legacy rows: dated {dated}, deleted {sessions_deleted} sessions")
+    return report
+
+async def retention_sweep_loop():
+    """Run sweep_retention on a schedule while the server runs"""
+    while True:
+        try:
+            await sweep_retention()
+        except Exception as e:
+            logging.error(f"[retention] Sweep failed: {str(e)}")
+        await asyncio.sleep(RETENTION_SWEEP_INTERVAL_HOURS * 3600)
+
+async def ttl_deleted_documents() -> Optional[int]:
+    """Documents removed by TTL indexes since the server started (needs serverStatus access)"""
+    try:
+        status = await db.command("serverStatus")
+    except OperationFailure:
+        return None
+    return status.get("metrics", {}).get("ttl", {}).get("deletedDocuments")
+
+
+# ============================================
+# GIVEAWAY DRAWS
+# ============================================
+
+# Draws use $sample, which returns a uniformly random subset of the eligible
+# entries in random order. Keeping the first entry of each email in that order
+# is the same as drawing one entry at a time and then removing every other
+# entry of the winner's email.
+GIVEAWAY_SOURCE = "giveaway_popup"
+
+async def draw_giveaway_entries(count: int = 1, exclude_previous: bool = True) -> List[dict]:
+    """Draw up to `count` giveaway entries belonging to distinct emails
 
-# Bonus Credits
-SIGNUP_BONUS_CREDITS = 10
-REVIEW_BONUS_CREDITS = 5
-REFERRAL_BONUS_CREDITS = 20
+    With exclude_previous, entries marked is_winner and every other entry of
+    a past winner's email are ineligible.
+    """
+    excluded = set()
+    if exclude_previous:
+        excluded.update(await db.email_subscriptions.distinct(
+            "email_normalized", {"source": GIVEAWAY_SOURCE, "is_winner": True}
+        ))
 
+    winners = []
+    while len(winners) < count:
+        query = {"source": GIVEAWAY_SOURCE, "email_normalized": {"$nin": list(excluded)}}
+        if exclude_previous:
+            query["is_winner"] = {"$ne": True}
+
+        needed = count - len(winners)
+        entries = await db.email_subscriptions.aggregate([
+            {"$match": query},
+            {"$sample": {"size": needed}},
+            # draw_key is left over on subscriptions from before $sample draws
+            {"$project": {"_id": 0, "draw_key": 0}}
+        ]).to_list(needed)
+        if not entries:
+            break
 
-class CreditRedemptionRequest(BaseModel):
-    tier_credits: int  # 100, 200, or 300
+        # Entries sharing an email leave a shortfall, which the next round fills
+        for entry in entries:
+            if entry.get("email_normalized") in excluded:
+                continue
+            excluded.add(entry.get("email_normalized"))
+            winners.append(entry)
+    return winners
 
 
-class CreditBalanceResponse(BaseModel):
-    current_credits: int
-    total_earned: int
-    total_redeemed: int
-    available_tiers: List[dict]
-    next_tier: Optional[dict] = None
+# ============================================
+# ADMIN JOBS
+# ============================================
 
+# Long-running admin operations are submitted as documents in admin_jobs and
+# claimed by a fixed pool of workers. Handlers report progress together with
+# a checkpoint; a job whose worker stopped renewing its lease is claimed
+# again and resumes from the last checkpoint. Each claim issues a new
+# lease_token and every progress or result write is conditional on it, so a
+# worker that lost its lease stops at its next write instead of racing the
+# new owner.
 
-# Inventory Models
-class InventoryItem(BaseModel):
-    product_id: int
-    product_name: str
-    color: str
-    size: str
-    quantity: int = 0
-    reserved: int = 0  # Reserved during checkout
-    low_stock_threshold: int = 5
-    updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+ADMIN_JOB_WORKERS = int(os.environ.get("ADMIN_JOB_WORKERS", "2"))
+# Idle workers look for claimable jobs this often (submits wake them at once)
+ADMIN_JOB_POLL_SECONDS = 5
+# A running job whose lease is not renewed in this time is reclaimed
+ADMIN_JOB_LEASE_SECONDS = int(os.environ.get("ADMIN_JOB_LEASE_SECONDS", "300"))
+ADMIN_JOB_MAX_ATTEMPTS = 3
+ADMIN_JOB_TERMINAL_STATES = ("succeeded", "failed")
 
-class InventoryUpdate(BaseModel):
-    product_id: int
-    color: str
-    size: str
-    quantity: int
+# Files produced by jobs (contact exports) live in GridFS
+admin_job_files = AsyncIOMotorGridFSBucket(db, bucket_name="admin_job_files")
 
-class InventoryBulkUpdate(BaseModel):
-    items: List[InventoryUpdate]
+# Job type -> async handler(job: AdminJob) returning the job result
+ADMIN_JOB_HANDLERS: Dict[str, Callable] = {}
+# Job type -> validate(params) returning cleaned params; raises ValueError
+ADMIN_JOB_VALIDATORS: Dict[str, Callable] = {}
 
+_admin_job_wakeup = asyncio.Event()
 
-# Promo Code Models
-class PromoCode(BaseModel):
-    code: str
-    discount_type: str = "percentage"  # "percentage" or "fixed"
-    discount_value: float  # 10 = 10% or $10
-    min_order: float = 0  # Minimum order amount
-    max_uses: Optional[int] = None  # None = unlimited
-    uses: int = 0
-    active: bool = True
-    expires_at: Optional[datetime] = None
-    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+def admin_job(job_type: str, validate: Optional[Callable] = None):
+    """Register the decorated coroutine as the handler for job_type
 
-class PromoCodeValidate(BaseModel):
-    code: str
-    subtotal: float
+    validate(params), if given, runs when the job is submitted.
+    """
+    def register(handler):
+        ADMIN_JOB_HANDLERS[job_type] = handler
+        if validate:
+            ADMIN_JOB_VALIDATORS[job_type] = validate
+        return handler
+    return register
 
-class PromoCodeCreate(BaseModel):
-    code: str
-    discount_type: str = "percentage"
-    discount_value: float
-    min_order: float = 0
-    max_uses: Optional[int] = None
-    expires_at: Optional[str] = None
+def lease_expiry() -> datetime:
+    return datetime.now(timezone.utc) + timedelta(seconds=ADMIN_JOB_LEASE_SECONDS)
 
 
-# Default promo codes
-DEFAULT_PROMO_CODES = [
-    {"code": "WELCOME10", "discount_type": "percentage", "discount_value": 10, "min_order": 0, "max_uses": None},
-    {"code": "LAUNCH15", "discount_type": "percentage", "discount_value": 15, "min_order": 50, "max_uses": 100},
-    {"code": "APEX20", "discount_type": "percentage", "discount_value": 20, "min_order": 75, "max_uses": 50},
-]
+class AdminJobLeaseLost(Exception):
+    """The job was reclaimed by another worker after this one's lease expired"""
 
 
-# ============================================
-# HELPER FUNCTIONS
-# ============================================
+class AdminJob:
+    """What a handler sees of its job: params, last checkpoint and progress reporting"""
 
-def hash_password(password: str) -> str:
-    """Hash password with salt"""
-    salt = secrets.token_hex(16)
-    hash_obj = hashlib.pbkdf2_hmac('sha256', password.encode(), salt.encode(), 100000)
-    return f"{salt}:{hash_obj.hex()}"
+    def __init__(self, doc: dict):
+        self.id = doc["_id"]
+        self.type = doc["type"]
+        self.params = doc.get("params") or {}
+        self.checkpoint = doc.get("checkpoint") or {}
+        self.lease_token = doc.get("lease_token")
 
-def verify_password(password: str, password_hash: str) -> bool:
-    """Verify password against hash"""
+    @property
+    def owned(self) -> dict:
+        """Filter matching the job only while this worker still holds its lease"""
+        return {"_id": self.id, "status": "running", "lease_token": self.lease_token}
+
+    async def progress(self, done: int, total: Optional[int], checkpoint: Optional[dict] = None):
+        """Record progress and renew the lease; a checkpoint is where a retry resumes
+
+        Raises AdminJobLeaseLost if another worker has taken the job over.
+        """
+        update = {
+            "progress": {"done": done, "total": total},
+            "lease_expires_at": lease_expiry(),
+            "updated_at": datetime.now(timezone.utc)
+        }
+        if checkpoint is not None:
+            update["checkpoint"] = checkpoint
+        result = await db.admin_jobs.update_one(self.owned, {"$set": update})
+        if result.matched_count == 0:
+            raise AdminJobLeaseLost(f"Lost the lease on job {self.id}")
+        if checkpoint is not None:
+            self.checkpoint = checkpoint
+
+
+def format_admin_job(doc: dict) -> dict:
+    job = {"job_id": doc["_id"]}
+    hidden = ("_id", "checkpoint", "lease_expires_at", "lease_token")
+    job.update({key: value for key, value in doc.items() if key not in hidden})
+    return job
+
+async def submit_admin_job(job_type: str, params: Optional[dict] = None, job_id: Optional[str] = None) -> dict:
+    """Queue a job; raises ValueError for an unknown job type or invalid params
+
+    A fixed job_id makes the submit idempotent: a second one raises
+    DuplicateKeyError while the first job document exists.
+    """
+    if job_type not in ADMIN_JOB_HANDLERS:
+        raise ValueError(f"Unknown job type: {job_type}")
+    params = params or {}
+    if job_type in ADMIN_JOB_VALIDATORS:
+        params = ADMIN_JOB_VALIDATORS[job_type](params)
+
+    now = datetime.now(timezone.utc)
+    job = {
+        "_id": job_id or str(uuid.uuid4()),
+        "type": job_type,
+        "params": params,
+        "status": "queued",
+        "progress": {"done": 0, "total": None},
+        "checkpoint": {},
+        "result": None,
+        "error": None,
+        "attempts": 0,
+        "created_at": now,
+        "updated_at": now
+    }
+    await db.admin_jobs.insert_one(job)
+    _admin_job_wakeup.set()
+    logging.info(f"[jobs] Queued {job_type} job {job['_id']}")
+    return {"job_id": job["_id"], "type": job_type, "status": "queued"}
+
+async def claim_admin_job() -> Optional[dict]:
+    """Atomically take the oldest queued job, or a running one whose lease expired"""
+    now = datetime.now(timezone.utc)
+    expired = {"status": "running", "lease_expires_at": {"$lt": now}}
+
+    await db.admin_jobs.update_many(
+        {**expired, "attempts": {"$gte": ADMIN_JOB_MAX_ATTEMPTS}},
+        {"$set": {"status": "failed", "error": "Worker lease expired", "finished_at": now, "updated_at": now}}
+    )
+    return await db.admin_jobs.find_one_and_update(
+        {"$or": [{"status": "queued"}, {**expired, "attempts": {"$lt": ADMIN_JOB_MAX_ATTEMPTS}}]},
+        {
+            "$set": {
+                "status": "running", "started_at": now, "updated_at": now,
+                "lease_expires_at": lease_expiry(), "lease_token": str(uuid.uuid4())
+            },
+            "$inc": {"attempts": 1}
+        },
+        sort=[("created_at", ASCENDING)],
+        return_document=ReturnDocument.AFTER
+    )
+
+async def run_admin_job(doc: dict):
+    job = AdminJob(doc)
+    logging.info(f"[jobs] Running {job.type} job {job.id} (attempt {doc.get('attempts')})")
     try:
-        salt, hash_value = password_hash.split(':')
-        hash_obj = hashlib.pbkdf2_hmac('sha256', password.encode(), salt.encode(), 100000)
-        return hash_obj.hex() == hash_value
-    except:
-        return False
+        handler = ADMIN_JOB_HANDLERS.get(job.type)
+        if handler is None:
+            raise ValueError(f"Unknown job type: {job.type}")
+        update = {"status": "succeeded", "result": await handler(job), "error": None}
+    except asyncio.CancelledError:
+        # Shutting down: hand the job back so the next worker resumes it from its checkpoint
+        await db.admin_jobs.update_one(
+            job.owned,
+            {"$set": {"status": "queued"}, "$unset": {"lease_token": ""}, "$inc": {"attempts": -1}}
+        )
+        raise
+    except AdminJobLeaseLost as e:
+        logging.warning(f"[jobs] {str(e)}; leaving it to the new owner")
+        return
+    except Exception as e:
+        logging.error(f"[jobs] {job.type} job {job.id} failed: {str(e)}")
+        update = {"status": "failed", "error": str(e)}
+
+    now = datetime.now(timezone.utc)
+    update.update({"finished_at": now, "updated_at": now})
+    result = await db.admin_jobs.update_one(job.owned, {"$set": update})
+    if result.matched_count == 0:
+        logging.warning(f"[jobs] Lost the lease on job {job.id} before recording its result; discarded")
+        file_id = (update.get("result") or {}).get("file_id")
+        if file_id:
+            await admin_job_files.delete(ObjectId(file_id))
+        return
+    logging.info(f"[jobs] {job.type} job {job.id} {update['status']}")
+
+async def admin_job_worker():
+    """Claim and run jobs one at a time until cancelled"""
+    while True:
+        _admin_job_wakeup.clear()
+        try:
+            doc = await claim_admin_job()
+        except Exception as e:
+            logging.error(f"[jobs] Claim failed: {str(e)}")
+            doc = None
+
+        if doc is None:
+            try:
+                await asyncio.wait_for(_admin_job_wakeup.wait(), ADMIN_JOB_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            continue
+
+        await run_admin_job(doc)
 
 
 # ============================================
@@ -589,7 +3354,7 @@ async def send_webhook_with_retry(
             "webhook_name": webhook_name,
             "url": url,
             "payload": payload,
-            "failed_at": datetime.now(timezone.utc).isoformat(),
+            "failed_at": datetime.now(timezone.utc),
             "retry_count": max_retries + 1,
             "resolved": False
         })
@@ -602,16 +3367,16 @@ async def send_webhook_with_retry(
 
 async def is_email_subscribed(email: str) -> bool:
     """Check if an email is subscribed to marketing emails"""
-    email = email.lower().strip()
+    email = normalize_email(email)
     
     # Check user record first
-    user = await db.users.find_one({"email": email, "email_subscribed": False})
+    user = await db.users.find_one({"email_normalized": email, "email_subscribed": False})
     if user:
         logging.info(f"[subscription_check] {email} is unsubscribed (user record)")
         return False
     
     # Check email_subscriptions
-    sub = await db.email_subscriptions.find_one({"email": email, "email_subscribed": False})
+    sub = await db.email_subscriptions.find_one({"email_normalized": email, "email_subscribed": False})
     if sub:
         logging.info(f"[subscription_check] {email} is unsubscribed (subscription record)")
         return False
@@ -808,8 +3573,8 @@ async def send_n8n_waitlist_webhook(
         webhook_name="waitlist"
     )
 
-async def get_current_user(request: Request) -> Optional[dict]:
-    """Get current user from session token (cookie or header)"""
+def request_session_token(request: Request) -> Optional[str]:
+    """Session token from the cookie, X-Session-Token or a Bearer header"""
     # Try cookie first
     session_token = request.cookies.get("session_token")
     
@@ -823,26 +3588,50 @@ async def get_current_user(request: Request) -> Optional[dict]:
         if auth_header and auth_header.startswith("Bearer "):
             session_token = auth_header[7:]
     
+    return session_token or None
+
+async def get_current_user(request: Request) -> Optional[dict]:
+    """Get current user from session token (cookie or header)"""
+    session_token = request_session_token(request)
     if not session_token:
         return None
     
-    # Find session
-    session = await db.user_sessions.find_one({"session_token": session_token}, {"_id": 0})
-    if not session:
-        return None
-    
-    # Check expiry
-    expires_at = session.get("expires_at")
-    if isinstance(expires_at, str):
-        expires_at = datetime.fromisoformat(expires_at)
-    if expires_at.tzinfo is None:
-        expires_at = expires_at.replace(tzinfo=timezone.utc)
-    if expires_at < datetime.now(timezone.utc):
-        return None
+    if is_signed_session_token(session_token):
+        # Signed tokens are checked without a database read
+        claims = verify_session_token(session_token)
+        if not claims:
+            return None
+        user_id = claims["uid"]
+    else:
+        # Find session; only tokens that exist are cached, so made-up tokens
+        # can't fill the cache and evict real sessions
+        session = session_cache.get(session_token)
+        if session is None:
+            doc = await db.user_sessions.find_one({"session_token": session_token}, {"_id": 0, "user_id": 1, "expires_at": 1})
+            if not doc:
+                return None
+            session = (doc["user_id"], doc.get("expires_at"))
+            session_cache.set(session_token, session)
+        user_id, expires_at = session
+        if not user_id or not expires_at:
+            return None
+        
+        # Check expiry; string dates remain until backfill_date_fields has run
+        if isinstance(expires_at, str):
+            expires_at = parse_datetime(expires_at)
+        if expires_at.tzinfo is None:
+            expires_at = expires_at.replace(tzinfo=timezone.utc)
+        if expires_at < datetime.now(timezone.utc):
+            return None
     
     # Get user
-    user = await db.users.find_one({"user_id": session["user_id"]}, {"_id": 0})
-    return user
+    user = user_cache.get(user_id)
+    if user is None:
+        user = await db.users.find_one({"user_id": user_id}, {"_id": 0})
+        if not user:
+            return None
+        user_cache.set(user_id, user)
+    return dict(user)
 
 async def send_order_confirmation_email(order: dict):
     """Send order confirmation webhook to n8n"""
@@ -921,30 +3710,27 @@ async def get_public_stats():
     No authentication required.
     Used by n8n Discord bot to update stats dashboard.
     """
-    # Get today's date range
-    today_start = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
-    today_iso = today_start.isoformat()
+    # Read the write-time counters for all time and today
+    today = counter_day()
+    keys = [COUNTER_ALL_TIME, today]
+    docs = await db.daily_counters.find({"_id": {"$in": keys}}).to_list(2)
     
-    # Total counts
-    total_signups = await db.users.count_documents({})
-    total_waitlist = await db.waitlist.count_documents({})
-    total_giveaway_entries = await db.email_subscriptions.count_documents({"source": "giveaway_popup"})
+    if not any(doc["_id"] == COUNTER_ALL_TIME for doc in docs):
+        # Counters not seeded yet - build them from the source collections
+        await reconcile_counters(days=1)
+        docs = await db.daily_counters.find({"_id": {"$in": keys}}).to_list(2)
     
-    # Today's counts
-    signups_today = await db.users.count_documents({"created_at": {"$gte": today_iso}})
-    waitlist_today = await db.waitlist.count_documents({"created_at": {"$gte": today_iso}})
-    giveaway_today = await db.email_subscriptions.count_documents({
-        "source": "giveaway_popup",
-        "timestamp": {"$gte": today_iso}
-    })
+    counters = {doc["_id"]: doc for doc in docs}
+    totals = counters.get(COUNTER_ALL_TIME, {})
+    todays = counters.get(today, {})
     
     return {
-        "total_signups": total_signups,
-        "total_waitlist": total_waitlist,
-        "total_giveaway_entries": total_giveaway_entries,
-        "signups_today": signups_today,
-        "waitlist_today": waitlist_today,
-        "giveaway_today": giveaway_today,
+        "total_signups": totals.get("signups", 0),
+        "total_waitlist": totals.get("waitlist", 0),
+        "total_giveaway_entries": totals.get("giveaway", 0),
+        "signups_today": todays.get("signups", 0),
+        "waitlist_today": todays.get("waitlist", 0),
+        "giveaway_today": todays.get("giveaway", 0),
         "updated_at": datetime.now(timezone.utc).isoformat()
     }
 
@@ -1011,16 +3797,12 @@ async def create_status_check(input: StatusCheckCreate):
     status_dict = input.model_dump()
     status_obj = StatusCheck(**status_dict)
     doc = status_obj.model_dump()
-    doc['timestamp'] = doc['timestamp'].isoformat()
     _ = await db.status_checks.insert_one(doc)
     return status_obj
 
 @api_router.get("/status", response_model=List[StatusCheck])
 async def get_status_checks():
     status_checks = await db.status_checks.find({}, {"_id": 0}).to_list(1000)
-    for check in status_checks:
-        if isinstance(check['timestamp'], str):
-            check['timestamp'] = datetime.fromisoformat(check['timestamp'])
     return status_checks
 
 
@@ -1065,12 +3847,14 @@ async def subscribe_email(input: EmailSubscriptionCreate):
     )
     
     doc = subscription.model_dump()
-    doc['timestamp'] = doc['timestamp'].isoformat()
+    doc['email_normalized'] = normalize_email(subscription.email)
     
     await db.email_subscriptions.insert_one(doc)
+    schedule_contact_refresh(subscription.email)
     
     # If this is a giveaway entry, send webhook to n8n
     if input.source == "giveaway_popup":
+        await increment_counter("giveaway")
         asyncio.create_task(send_n8n_giveaway_webhook(input.email.lower()))
     
     return EmailResponse(
@@ -1097,19 +3881,25 @@ async def giveaway_entry_webhook(request: Request):
         return {"success": False, "message": str(e)}
 
 @api_router.get("/emails/list", response_model=List[EmailSubscription])
-async def get_email_subscriptions(source: Optional[str] = None):
+async def get_email_subscriptions(response: Response, source: Optional[str] = None,
+                                  limit: int = 1000, cursor: str = ""):
     """
-    Get all email subscriptions, optionally filtered by source.
+    Get email subscriptions newest first, optionally filtered by source.
+    The next page's cursor is returned in the X-Next-Cursor header.
     """
     query = {}
     if source:
         query["source"] = source
     
-    subscriptions = await db.email_subscriptions.find(query, {"_id": 0}).to_list(10000)
+    try:
+        subscriptions, next_cursor = await keyset_page(
+            db.email_subscriptions, query, "timestamp", page_limit(limit, 10000), cursor, {"_id": 0}
+        )
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
     
-    for sub in subscriptions:
-        if isinstance(sub.get('timestamp'), str):
-            sub['timestamp'] = datetime.fromisoformat(sub['timestamp'])
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
     
     return subscriptions
 
@@ -1118,16 +3908,15 @@ async def get_email_stats():
     """
     Get email subscription statistics.
     """
-    total = await db.email_subscriptions.count_documents({})
-    giveaway = await db.email_subscriptions.count_documents({"source": "giveaway_popup"})
-    early_access = await db.email_subscriptions.count_documents({"source": "early_access"})
-    notify_me = await db.email_subscriptions.count_documents({"source": "notify_me"})
+    sources = ["giveaway_popup", "early_access", "notify_me"]
+    counts = await db.email_subscriptions.aggregate([
+        {"$group": {"_id": "$source", "count": {"$sum": 1}}}
+    ]).to_list(None)
+    by_source = {row["_id"]: row["count"] for row in counts}
     
     return {
-        "total": total,
-        "giveaway_popup": giveaway,
-        "early_access": early_access,
-        "notify_me": notify_me
+        "total": sum(by_source.values()),
+        **{source: by_source.get(source, 0) for source in sources}
     }
 
 
@@ -1142,7 +3931,7 @@ async def unsubscribe_email(request: Request):
     Sets email_subscribed: false on all matching records.
     """
     body = await request.json()
-    email = body.get("email", "").lower().strip()
+    email = normalize_email(body.get("email"))
     
     if not email:
         raise HTTPException(status_code=400, detail="Email is required")
@@ -1150,23 +3939,24 @@ async def unsubscribe_email(request: Request):
     try:
         # Update user record if exists
         user_result = await db.users.update_one(
-            {"email": email},
-            {"$set": {"email_subscribed": False, "unsubscribed_at": datetime.now(timezone.utc).isoformat()}}
+            {"email_normalized": email},
+            {"$set": {"email_subscribed": False, "unsubscribed_at": datetime.now(timezone.utc)}}
         )
         
         # Update all email_subscriptions records for this email
         subs_result = await db.email_subscriptions.update_many(
-            {"email": email},
-            {"$set": {"email_subscribed": False, "unsubscribed_at": datetime.now(timezone.utc).isoformat()}}
+            {"email_normalized": email},
+            {"$set": {"email_subscribed": False, "unsubscribed_at": datetime.now(timezone.utc)}}
         )
         
         # Update waitlist records
         waitlist_result = await db.waitlist.update_many(
-            {"email": email},
-            {"$set": {"email_subscribed": False, "unsubscribed_at": datetime.now(timezone.utc).isoformat()}}
+            {"email_normalized": email},
+            {"$set": {"email_subscribed": False, "unsubscribed_at": datetime.now(timezone.utc)}}
         )
         
         total_updated = user_result.modified_count + subs_result.modified_count + waitlist_result.modified_count
+        schedule_contact_refresh(email)
         
         logging.info(f"Unsubscribed {email}: users={user_result.modified_count}, subs={subs_result.modified_count}, waitlist={waitlist_result.modified_count}")
         
@@ -1185,15 +3975,15 @@ async def unsubscribe_email(request: Request):
 @api_router.get("/check-subscription/{email}")
 async def check_email_subscription(email: str):
     """Check if an email is subscribed to marketing emails"""
-    email = email.lower().strip()
+    email = normalize_email(email)
     
     # Check user record first
-    user = await db.users.find_one({"email": email})
+    user = await db.users.find_one({"email_normalized": email}, {"_id": 0, "email_subscribed": 1})
     if user and user.get("email_subscribed") == False:
         return {"subscribed": False}
     
     # Check email_subscriptions
-    sub = await db.email_subscriptions.find_one({"email": email, "email_subscribed": False})
+    sub = await db.email_subscriptions.find_one({"email_normalized": email, "email_subscribed": False}, {"_id": 1})
     if sub:
         return {"subscribed": False}
     
@@ -1218,8 +4008,8 @@ async def get_giveaway_entries_for_upsell():
     query = {
         "source": "giveaway_popup",
         "timestamp": {
-            "$gte": one_day_ago_start.isoformat(),
-            "$lt": one_day_ago_end.isoformat()
+            "$gte": one_day_ago_start,
+            "$lt": one_day_ago_end
         },
         "$or": [
             {"upsell_sent": False},
@@ -1259,7 +4049,7 @@ async def mark_upsell_sent(request: Request):
         {
             "$set": {
                 "upsell_sent": True,
-                "upsell_sent_at": datetime.now(timezone.utc).isoformat()
+                "upsell_sent_at": datetime.now(timezone.utc)
             }
         }
     )
@@ -1390,8 +4180,6 @@ async def track_visitor(request: Request):
     
     # Store in database
     doc = session.model_dump()
-    doc['first_visit'] = doc['first_visit'].isoformat()
-    doc['last_activity'] = doc['last_activity'].isoformat()
     
     await db.visitor_sessions.insert_one(doc)
     
@@ -1411,8 +4199,7 @@ async def visitor_heartbeat(heartbeat: VisitorHeartbeat, request: Request):
     session = await db.visitor_sessions.find_one({"session_id": heartbeat.session_id})
     
     if session:
-        last_activity = datetime.fromisoformat(session['last_activity']) if isinstance(session['last_activity'], str) else session['last_activity']
-        first_visit = datetime.fromisoformat(session['first_visit']) if isinstance(session['first_visit'], str) else session['first_visit']
+        first_visit = session['first_visit']
         
         now = datetime.now(timezone.utc)
         duration = int((now - first_visit).total_seconds())
@@ -1421,7 +4208,7 @@ async def visitor_heartbeat(heartbeat: VisitorHeartbeat, request: Request):
             {"session_id": heartbeat.session_id},
             {
                 "$set": {
-                    "last_activity": now.isoformat(),
+                    "last_activity": now,
                     "session_duration": duration,
                     "is_active": True
                 },
@@ -1451,7 +4238,6 @@ async def track_pageview(request: Request):
     )
     
     doc = pageview.model_dump()
-    doc['timestamp'] = doc['timestamp'].isoformat()
     
     await db.page_views.insert_one(doc)
     
@@ -1474,7 +4260,6 @@ async def track_event(request: Request):
     )
     
     doc = event.model_dump()
-    doc['timestamp'] = doc['timestamp'].isoformat()
     
     await db.analytics_events.insert_one(doc)
     
@@ -1502,118 +4287,51 @@ async def get_analytics_overview(request: Request, days: int = 7):
     if not user or not is_admin_user(user['email']):
         raise HTTPException(status_code=403, detail="Admin access required")
     
-    # Calculate date range
-    start_date = datetime.now(timezone.utc) - timedelta(days=days)
-    start_date_iso = start_date.isoformat()
-    
-    # Get visitor counts
-    total_visitors = await db.visitor_sessions.count_documents({
-        "first_visit": {"$gte": start_date_iso}
-    })
-    
-    # Get unique visitors (by session_id)
-    unique_sessions = await db.visitor_sessions.distinct("session_id", {
-        "first_visit": {"$gte": start_date_iso}
-    })
-    unique_visitors = len(unique_sessions)
-    
-    # Get registered vs guest counts
-    registered_users = await db.visitor_sessions.count_documents({
-        "first_visit": {"$gte": start_date_iso},
-        "user_type": "registered"
-    })
+    # Calculate date range (hour-aligned to match the rollup buckets)
+    now = datetime.now(timezone.utc)
+    start_hour = floor_hour(now - timedelta(days=days))
     
-    guest_visitors = await db.visitor_sessions.count_documents({
-        "first_visit": {"$gte": start_date_iso},
-        "user_type": "guest"
-    })
+    # Closed hours come from rollups; only hours past the watermark are read raw
+    state = await db.analytics_rollups.find_one({"_id": ANALYTICS_ROLLUP_STATE})
+    through = max(state["through"], start_hour) if state else start_hour
     
     # Get active sessions (last 5 minutes)
-    five_mins_ago = (datetime.now(timezone.utc) - timedelta(minutes=5)).isoformat()
-    active_sessions = await db.visitor_sessions.count_documents({
-        "last_activity": {"$gte": five_mins_ago},
-        "is_active": True
-    })
-    
-    # Get total page views
-    total_page_views = await db.page_views.count_documents({
-        "timestamp": {"$gte": start_date_iso}
-    })
-    
-    # Calculate average session duration
-    sessions = await db.visitor_sessions.find({
-        "first_visit": {"$gte": start_date_iso}
-    }, {"session_duration": 1}).to_list(10000)
-    
-    avg_duration = sum(s.get('session_duration', 0) for s in sessions) / len(sessions) if sessions else 0
-    
-    # Get top pages
-    page_counts = await db.page_views.aggregate([
-        {"$match": {"timestamp": {"$gte": start_date_iso}}},
-        {"$group": {"_id": "$page_path", "count": {"$sum": 1}}},
-        {"$sort": {"count": -1}},
-        {"$limit": 10}
-    ]).to_list(10)
-    
-    top_pages = [{"page": p["_id"], "views": p["count"]} for p in page_counts]
-    
-    # Get top countries
-    country_counts = await db.visitor_sessions.aggregate([
-        {"$match": {"first_visit": {"$gte": start_date_iso}, "country": {"$ne": None}}},
-        {"$group": {"_id": "$country", "count": {"$sum": 1}, "country_code": {"$first": "$country_code"}}},
-        {"$sort": {"count": -1}},
-        {"$limit": 10}
-    ]).to_list(10)
-    
-    top_countries = [{"country": c["_id"], "country_code": c.get("country_code"), "visitors": c["count"]} for c in country_counts]
-    
-    # Get traffic sources
-    source_counts = await db.visitor_sessions.aggregate([
-        {"$match": {"first_visit": {"$gte": start_date_iso}}},
-        {"$group": {"_id": "$referrer", "count": {"$sum": 1}}},
-        {"$sort": {"count": -1}},
-        {"$limit": 10}
-    ]).to_list(10)
-    
-    traffic_sources = [{"source": s["_id"] or "direct", "visitors": s["count"]} for s in source_counts]
-    
-    # Get conversion funnel
-    cart_events = await db.analytics_events.count_documents({
-        "timestamp": {"$gte": start_date_iso},
-        "event_type": "add_to_cart"
-    })
-    
-    checkout_events = await db.analytics_events.count_documents({
-        "timestamp": {"$gte": start_date_iso},
-        "event_type": "begin_checkout"
-    })
-    
-    purchase_events = await db.analytics_events.count_documents({
-        "timestamp": {"$gte": start_date_iso},
-        "event_type": "purchase"
-    })
+    five_mins_ago = now - timedelta(minutes=5)
+    
+    rolled_up, live, active_sessions = await asyncio.gather(
+        db.analytics_rollups.find({"_id": {"$gte": start_hour, "$lt": through}}).to_list(None),
+        aggregate_analytics_hours(through, now),
+        db.visitor_sessions.count_documents({
+            "last_activity": {"$gte": five_mins_ago},
+            "is_active": True
+        })
+    )
+    totals = merge_analytics_buckets(rolled_up + list(live.values()))
     
+    total_visitors = totals["visitors"]
+    avg_duration = totals["duration_sum"] / total_visitors if total_visitors else 0
+    purchase_events = totals["events"]["purchase"]
     conversion_rate = (purchase_events / total_visitors * 100) if total_visitors > 0 else 0
     
     funnel = ConversionFunnel(
         visitor_count=total_visitors,
-        cart_additions=cart_events,
-        checkout_started=checkout_events,
+        cart_additions=totals["events"]["add_to_cart"],
+        checkout_started=totals["events"]["begin_checkout"],
         purchases=purchase_events,
         conversion_rate=round(conversion_rate, 2)
     )
     
     return AnalyticsOverview(
         total_visitors=total_visitors,
-        unique_visitors=unique_visitors,
-        registered_users=registered_users,
-        guest_visitors=guest_visitors,
+        unique_visitors=totals["unique_visitors"],
+        registered_users=totals["registered"],
+        guest_visitors=totals["guests"],
         active_sessions=active_sessions,
-        total_page_views=total_page_views,
+        total_page_views=totals["page_views"],
         avg_session_duration=round(avg_duration, 2),
-        top_pages=top_pages,
-        top_countries=top_countries,
-        traffic_sources=traffic_sources,
+        top_pages=totals["pages"],
+        top_countries=totals["countries"],
+        traffic_sources=totals["referrers"],
         conversion_funnel=funnel.model_dump()
     )
 
@@ -1675,7 +4393,7 @@ async def get_realtime_analytics(request: Request):
     if not user or not is_admin_user(user['email']):
         raise HTTPException(status_code=403, detail="Admin access required")
     
-    five_mins_ago = (datetime.now(timezone.utc) - timedelta(minutes=5)).isoformat()
+    five_mins_ago = datetime.now(timezone.utc) - timedelta(minutes=5)
     
     # Active visitors
     active_visitors = await db.visitor_sessions.find({
@@ -1688,10 +4406,6 @@ async def get_realtime_analytics(request: Request):
         "timestamp": {"$gte": five_mins_ago}
     }, {"_id": 0}).sort("timestamp", -1).to_list(50)
     
-    for event in recent_events:
-        if isinstance(event.get('timestamp'), str):
-            event['timestamp'] = event['timestamp']
-    
     return {
         "active_count": len(active_visitors),
         "active_visitors": active_visitors,
@@ -1718,7 +4432,7 @@ async def register(user_data: UserRegister, response: Response):
     user = User(
         email=user_data.email.lower(),
         name=user_data.name,
-        password_hash=hash_password(user_data.password),
+        password_hash=await password_hasher.hash(user_data.password),
         auth_provider="email",
         gymnastics_type=user_data.gymnastics_type,
         gender=user_data.gender,
@@ -1732,9 +4446,10 @@ async def register(user_data: UserRegister, response: Response):
     )
     
     doc = user.model_dump()
-    doc['created_at'] = doc['created_at'].isoformat()
-    doc['updated_at'] = doc['updated_at'].isoformat()
+    doc['email_normalized'] = normalize_email(user.email)
     await db.users.insert_one(doc)
+    await increment_counter("signups")
+    schedule_contact_refresh(user.email)
     
     # Send webhook to n8n for welcome email
     asyncio.create_task(send_n8n_signup_webhook(
@@ -1746,16 +4461,12 @@ async def register(user_data: UserRegister, response: Response):
     ))
     
     # Create session
-    session = UserSession(user_id=user.user_id)
-    session_doc = session.model_dump()
-    session_doc['expires_at'] = session_doc['expires_at'].isoformat()
-    session_doc['created_at'] = session_doc['created_at'].isoformat()
-    await db.user_sessions.insert_one(session_doc)
+    session_token = await issue_session(user.user_id, user.email)
     
     # Set cookie
     response.set_cookie(
         key="session_token",
-        value=session.session_token,
+        value=session_token,
         httponly=True,
         secure=True,
         samesite="none",
@@ -1765,7 +4476,7 @@ async def register(user_data: UserRegister, response: Response):
     
     return {
         "success": True,
-        "token": session.session_token,  # Include token for localStorage fallback
+        "token": session_token,  # Include token for localStorage fallback
         "user": UserResponse(
             user_id=user.user_id,
             email=user.email,
@@ -1793,20 +4504,19 @@ async def login(credentials: UserLogin, response: Response):
     if user.get('auth_provider') == 'google':
         raise HTTPException(status_code=400, detail="This account uses Google login. Please sign in with Google.")
     
-    if not user.get('password_hash') or not verify_password(credentials.password, user['password_hash']):
+    if not user.get('password_hash') or not await password_hasher.verify(credentials.password, user['password_hash']):
         raise HTTPException(status_code=401, detail="Invalid email or password")
     
+    if password_needs_rehash(user['password_hash']):
+        asyncio.create_task(rehash_password(user['user_id'], user['password_hash'], credentials.password))
+    
     # Create session
-    session = UserSession(user_id=user['user_id'])
-    session_doc = session.model_dump()
-    session_doc['expires_at'] = session_doc['expires_at'].isoformat()
-    session_doc['created_at'] = session_doc['created_at'].isoformat()
-    await db.user_sessions.insert_one(session_doc)
+    session_token = await issue_session(user['user_id'], user['email'])
     
     # Set cookie
     response.set_cookie(
         key="session_token",
-        value=session.session_token,
+        value=session_token,
         httponly=True,
         secure=True,
         samesite="none",
@@ -1816,7 +4526,7 @@ async def login(credentials: UserLogin, response: Response):
     
     return {
         "success": True,
-        "token": session.session_token,  # Include token for localStorage fallback
+        "token": session_token,  # Include token for localStorage fallback
         "user": UserResponse(
             user_id=user['user_id'],
             email=user['email'],
@@ -1870,10 +4580,11 @@ async def exchange_session(request: Request, response: Response):
             {"$set": {
                 "name": auth_data.get('name', user['name']),
                 "picture": auth_data.get('picture'),
-                "updated_at": datetime.now(timezone.utc).isoformat()
+                "updated_at": datetime.now(timezone.utc)
             }}
         )
         user_id = user['user_id']
+        invalidate_cached_user(user_id)
     else:
         # Generate unique first order discount code for new user
         unique_code = f"WELCOME{uuid.uuid4().hex[:6].upper()}"
@@ -1893,26 +4604,24 @@ async def exchange_session(request: Request, response: Response):
             total_credits_redeemed=0
         )
         doc = new_user.model_dump()
-        doc['created_at'] = doc['created_at'].isoformat()
-        doc['updated_at'] = doc['updated_at'].isoformat()
+        doc['email_normalized'] = normalize_email(new_user.email)
         await db.users.insert_one(doc)
+        await increment_counter("signups")
         user_id = new_user.user_id
         user = doc
         
         # Welcome webhook will be sent after profile completion
         # (when user provides gymnastics_type in /auth/complete-profile)
     
+    schedule_contact_refresh(auth_data['email'])
+    
     # Create session
-    session = UserSession(user_id=user_id)
-    session_doc = session.model_dump()
-    session_doc['expires_at'] = session_doc['expires_at'].isoformat()
-    session_doc['created_at'] = session_doc['created_at'].isoformat()
-    await db.user_sessions.insert_one(session_doc)
+    session_token = await issue_session(user_id, auth_data['email'].lower())
     
     # Set cookie
     response.set_cookie(
         key="session_token",
-        value=session.session_token,
+        value=session_token,
         httponly=True,
         secure=True,
         samesite="none",
@@ -1922,7 +4631,7 @@ async def exchange_session(request: Request, response: Response):
     
     return {
         "success": True,
-        "token": session.session_token,  # Include token for localStorage fallback
+        "token": session_token,  # Include token for localStorage fallback
         "user": UserResponse(
             user_id=user_id,
             email=auth_data['email'],
@@ -1969,8 +4678,13 @@ async def logout(request: Request, response: Response):
     """Logout user"""
     session_token = request.cookies.get("session_token")
     
-    if session_token:
+    if session_token and is_signed_session_token(session_token):
+        claims = verify_session_token(session_token)
+        if claims:
+            await session_revocations.revoke_token(claims)
+    elif session_token:
         await db.user_sessions.delete_one({"session_token": session_token})
+        session_cache.invalidate(session_token)
     
     response.delete_cookie(key="session_token", path="/")
     
@@ -1996,7 +4710,7 @@ async def complete_profile(request: Request):
     # Update user profile
     update_data = {
         "gymnastics_type": gymnastics_type,
-        "updated_at": datetime.now(timezone.utc).isoformat()
+        "updated_at": datetime.now(timezone.utc)
     }
     
     if age:
@@ -2008,6 +4722,7 @@ async def complete_profile(request: Request):
         {"user_id": user['user_id']},
         {"$set": update_data}
     )
+    invalidate_cached_user(user['user_id'])
     
     # Now send the welcome email webhook with complete data
     # Only send if this user signed up via Google and hasn't received welcome email yet
@@ -2036,6 +4751,12 @@ async def validate_first_order_discount(request: Request):
     body = await request.json()
     code = body.get('code', '').upper()
     
+    # Read the flag from the database; the cached user may predate its use
+    user = await db.users.find_one(
+        {"user_id": user['user_id']},
+        {"_id": 0, "has_used_first_order_discount": 1, "first_order_discount_code": 1}
+    ) or {}
+    
     # Check if user has already used their first order discount
     if user.get('has_used_first_order_discount', False):
         return {
@@ -2066,17 +4787,22 @@ async def use_first_order_discount(request: Request):
     if not user:
         raise HTTPException(status_code=401, detail="Not authenticated")
     
-    # Update user to mark discount as used and increment order count
-    await db.users.update_one(
-        {"user_id": user['user_id']},
+    # Update user to mark discount as used and increment order count; the
+    # filter makes concurrent calls mark it (and count the order) only once
+    result = await db.users.update_one(
+        {"user_id": user['user_id'], "has_used_first_order_discount": {"$ne": True}},
         {
             "$set": {
                 "has_used_first_order_discount": True,
-                "updated_at": datetime.now(timezone.utc).isoformat()
+                "updated_at": datetime.now(timezone.utc)
             },
             "$inc": {"order_count": 1}
         }
     )
+    invalidate_cached_user(user['user_id'])
+    
+    if result.modified_count == 0:
+        raise HTTPException(status_code=400, detail="First order discount already used")
     
     return {"success": True, "message": "First order discount marked as used"}
 
@@ -2125,18 +4851,33 @@ async def redeem_credits(request: Request, redemption: CreditRedemptionRequest):
     if not user:
         raise HTTPException(status_code=401, detail="Not authenticated")
     
-    current_credits = user.get("raze_credits", 0)
-    
     # Find the tier
     tier = next((t for t in CREDIT_TIERS if t["credits"] == redemption.tier_credits), None)
     
     if not tier:
         raise HTTPException(status_code=400, detail="Invalid redemption tier")
     
-    if current_credits < tier["credits"]:
+    # Deduct credits from user; the balance check is part of the update, so
+    # concurrent redemptions can't spend the same credits twice
+    updated = await db.users.find_one_and_update(
+        {"user_id": user["user_id"], "raze_credits": {"$gte": tier["credits"]}},
+        {
+            "$inc": {
+                "raze_credits": -tier["credits"],
+                "total_credits_redeemed": tier["credits"]
+            },
+            "$set": {"updated_at": datetime.now(timezone.utc)}
+        },
+        projection={"_id": 0, "raze_credits": 1},
+        return_document=ReturnDocument.AFTER
+    )
+    invalidate_cached_user(user["user_id"])
+    
+    if updated is None:
+        current = await db.users.find_one({"user_id": user["user_id"]}, {"_id": 0, "raze_credits": 1}) or {}
         raise HTTPException(
             status_code=400, 
-            detail=f"Insufficient credits. You have {current_credits}, need {tier['credits']}"
+            detail=f"Insufficient credits. You have {current.get('raze_credits', 0)}, need {tier['credits']}"
         )
     
     # Generate unique discount code
@@ -2151,33 +4892,27 @@ async def redeem_credits(request: Request, redemption: CreditRedemptionRequest):
         "max_uses": 1,
         "current_uses": 0,
         "is_active": True,
-        "created_at": datetime.now(timezone.utc).isoformat(),
-        "expires_at": (datetime.now(timezone.utc) + timedelta(days=30)).isoformat(),
+        "created_at": datetime.now(timezone.utc),
+        "expires_at": datetime.now(timezone.utc) + timedelta(days=30),
         "description": f"APEX Credits Redemption - {tier['label']}"
     }
     
-    await db.promo_codes.insert_one(promo)
-    
-    # Deduct credits from user
-    new_credits = current_credits - tier["credits"]
-    await db.users.update_one(
-        {"user_id": user["user_id"]},
-        {
-            "$set": {
-                "raze_credits": new_credits,
-                "updated_at": datetime.now(timezone.utc)
-            },
-            "$inc": {
-                "total_credits_redeemed": tier["credits"]
-            }
-        }
-    )
+    try:
+        await db.promo_codes.insert_one(promo)
+    except Exception:
+        # Give the credits back if the code could not be created
+        await db.users.update_one(
+            {"user_id": user["user_id"]},
+            {"$inc": {"raze_credits": tier["credits"], "total_credits_redeemed": -tier["credits"]}}
+        )
+        invalidate_cached_user(user["user_id"])
+        raise
     
     return {
         "success": True,
         "discount_code": discount_code,
         "discount_amount": tier["discount"],
-        "remaining_credits": new_credits,
+        "remaining_credits": updated["raze_credits"],
         "expires_in_days": 30,
         "message": f"Successfully redeemed {tier['credits']} credits for {tier['label']}!"
     }
@@ -2197,12 +4932,6 @@ async def get_user_orders(request: Request):
         {"_id": 0}
     ).sort("created_at", -1).to_list(100)
     
-    for order in orders:
-        if isinstance(order.get('created_at'), str):
-            order['created_at'] = datetime.fromisoformat(order['created_at'])
-        if isinstance(order.get('updated_at'), str):
-            order['updated_at'] = datetime.fromisoformat(order['updated_at'])
-    
     return orders
 
 
@@ -2242,7 +4971,7 @@ async def seed_inventory():
         for item in DEFAULT_INVENTORY:
             item['reserved'] = 0
             item['low_stock_threshold'] = 5
-            item['updated_at'] = datetime.now(timezone.utc).isoformat()
+            item['updated_at'] = datetime.now(timezone.utc)
             await db.inventory.insert_one(item)
         logger.info(f"Seeded {len(DEFAULT_INVENTORY)} inventory items")
 
@@ -2321,7 +5050,7 @@ async def update_inventory(update: InventoryUpdate):
     """Update inventory for a specific variant (admin only)"""
     result = await db.inventory.update_one(
         {"product_id": update.product_id, "color": update.color, "size": update.size},
-        {"$set": {"quantity": update.quantity, "updated_at": datetime.now(timezone.utc).isoformat()}}
+        {"$set": {"quantity": update.quantity, "updated_at": datetime.now(timezone.utc)}}
     )
     
     if result.matched_count == 0:
@@ -2336,7 +5065,7 @@ async def bulk_update_inventory(updates: InventoryBulkUpdate):
     for update in updates.items:
         result = await db.inventory.update_one(
             {"product_id": update.product_id, "color": update.color, "size": update.size},
-            {"$set": {"quantity": update.quantity, "updated_at": datetime.now(timezone.utc).isoformat()}}
+            {"$set": {"quantity": update.quantity, "updated_at": datetime.now(timezone.utc)}}
         )
         if result.matched_count > 0:
             updated += 1
@@ -2395,7 +5124,7 @@ async def commit_inventory(items: List[Dict]):
             {"product_id": item['product_id'], "color": item['color'], "size": item['size']},
             {
                 "$inc": {"quantity": -item['quantity'], "reserved": -item['quantity']},
-                "$set": {"updated_at": datetime.now(timezone.utc).isoformat()}
+                "$set": {"updated_at": datetime.now(timezone.utc)}
             }
         )
     
@@ -2414,7 +5143,7 @@ async def seed_promo_codes():
             code_data['uses'] = 0
             code_data['active'] = True
             code_data['expires_at'] = None
-            code_data['created_at'] = datetime.now(timezone.utc).isoformat()
+            code_data['created_at'] = datetime.now(timezone.utc)
             await db.promo_codes.insert_one(code_data)
         logger.info(f"Seeded {len(DEFAULT_PROMO_CODES)} promo codes")
 
@@ -2436,8 +5165,6 @@ async def validate_promo_code(data: PromoCodeValidate):
     # Check expiry
     if promo.get('expires_at'):
         expires = promo['expires_at']
-        if isinstance(expires, str):
-            expires = datetime.fromisoformat(expires)
         if expires < datetime.now(timezone.utc):
             raise HTTPException(status_code=400, detail="This promo code has expired")
     
@@ -2499,6 +5226,11 @@ async def create_promo_code(data: PromoCodeCreate):
     if existing:
         raise HTTPException(status_code=400, detail="Promo code already exists")
     
+    try:
+        expires_at = parse_datetime(data.expires_at)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid expires_at date")
+    
     promo = {
         "code": code,
         "discount_type": data.discount_type,
@@ -2507,8 +5239,8 @@ async def create_promo_code(data: PromoCodeCreate):
         "max_uses": data.max_uses,
         "uses": 0,
         "active": True,
-        "expires_at": data.expires_at,
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "expires_at": expires_at,
+        "created_at": datetime.now(timezone.utc)
     }
     
     await db.promo_codes.insert_one(promo)
@@ -2620,13 +5352,13 @@ async def create_order(input: OrderCreate):
     )
     
     doc = order.model_dump()
-    doc['created_at'] = doc['created_at'].isoformat()
-    doc['updated_at'] = doc['updated_at'].isoformat()
     # Convert nested models to dicts
     doc['items'] = [item.model_dump() if hasattr(item, 'model_dump') else item for item in doc['items']]
     doc['shipping'] = doc['shipping'].model_dump() if hasattr(doc['shipping'], 'model_dump') else doc['shipping']
+    doc['email_normalized'] = normalize_email(doc['shipping'].get('email'))
     
     await db.orders.insert_one(doc)
+    schedule_contact_refresh(doc['shipping'].get('email'))
     
     return OrderResponse(
         success=True,
@@ -2637,13 +5369,15 @@ async def create_order(input: OrderCreate):
 
 @api_router.get("/orders", response_model=List[Order])
 async def get_orders(
+    response: Response,
     status: Optional[str] = None,
     email: Optional[str] = None,
     limit: int = 100,
-    skip: int = 0
+    cursor: str = ""
 ):
     """
-    Get all orders with optional filters.
+    Get all orders with optional filters, newest first.
+    The next page's cursor is returned in the X-Next-Cursor header.
     Admin endpoint.
     """
     query = {}
@@ -2652,13 +5386,13 @@ async def get_orders(
     if email:
         query["shipping.email"] = email.lower()
     
-    orders = await db.orders.find(query, {"_id": 0}).sort("created_at", -1).skip(skip).limit(limit).to_list(limit)
+    try:
+        orders, next_cursor = await keyset_page(db.orders, query, "created_at", page_limit(limit), cursor, {"_id": 0})
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
     
-    for order in orders:
-        if isinstance(order.get('created_at'), str):
-            order['created_at'] = datetime.fromisoformat(order['created_at'])
-        if isinstance(order.get('updated_at'), str):
-            order['updated_at'] = datetime.fromisoformat(order['updated_at'])
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
     
     return orders
 
@@ -2667,30 +5401,25 @@ async def get_order_stats():
     """
     Get order statistics.
     """
-    total = await db.orders.count_documents({})
-    pending = await db.orders.count_documents({"status": "pending"})
-    confirmed = await db.orders.count_documents({"status": "confirmed"})
-    processing = await db.orders.count_documents({"status": "processing"})
-    shipped = await db.orders.count_documents({"status": "shipped"})
-    delivered = await db.orders.count_documents({"status": "delivered"})
-    cancelled = await db.orders.count_documents({"status": "cancelled"})
-    
-    # Calculate revenue
+    statuses = ["pending", "confirmed", "processing", "shipped", "delivered", "cancelled"]
+    
+    # Counts and revenue per status in a single pass
     pipeline = [
-        {"$match": {"status": {"$nin": ["cancelled"]}}},
-        {"$group": {"_id": None, "total_revenue": {"$sum": "$total"}}}
+        {"$group": {
+            "_id": "$status",
+            "count": {"$sum": 1},
+            "revenue": {"$sum": "$total"}
+        }}
     ]
-    revenue_result = await db.orders.aggregate(pipeline).to_list(1)
-    total_revenue = revenue_result[0]["total_revenue"] if revenue_result else 0
+    rows = await db.orders.aggregate(pipeline).to_list(None)
+    
+    total = sum(row["count"] for row in rows)
+    total_revenue = sum(row["revenue"] for row in rows if row["_id"] != "cancelled")
+    by_status = {row["_id"]: row["count"] for row in rows}
     
     return {
         "total_orders": total,
-        "pending": pending,
-        "confirmed": confirmed,
-        "processing": processing,
-        "shipped": shipped,
-        "delivered": delivered,
-        "cancelled": cancelled,
+        **{status: by_status.get(status, 0) for status in statuses},
         "total_revenue": round(total_revenue, 2)
     }
 
@@ -2709,11 +5438,6 @@ async def get_order(order_id: str):
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
     
-    if isinstance(order.get('created_at'), str):
-        order['created_at'] = datetime.fromisoformat(order['created_at'])
-    if isinstance(order.get('updated_at'), str):
-        order['updated_at'] = datetime.fromisoformat(order['updated_at'])
-    
     return order
 
 @api_router.patch("/orders/{order_id}", response_model=OrderResponse)
@@ -2731,7 +5455,7 @@ async def update_order(order_id: str, update: OrderUpdate):
         raise HTTPException(status_code=404, detail="Order not found")
     
     # Build update
-    update_data = {"updated_at": datetime.now(timezone.utc).isoformat()}
+    update_data = {"updated_at": datetime.now(timezone.utc)}
     
     if update.status:
         valid_statuses = ["pending", "confirmed", "processing", "shipped", "delivered", "cancelled"]
@@ -2741,9 +5465,9 @@ async def update_order(order_id: str, update: OrderUpdate):
         
         # Add timestamp for status changes
         if update.status == "shipped" and not order.get("shipped_at"):
-            update_data["shipped_at"] = datetime.now(timezone.utc).isoformat()
+            update_data["shipped_at"] = datetime.now(timezone.utc)
         elif update.status == "delivered" and not order.get("delivered_at"):
-            update_data["delivered_at"] = datetime.now(timezone.utc).isoformat()
+            update_data["delivered_at"] = datetime.now(timezone.utc)
             
             # Award APEX credits when order is delivered
             # $1 spent = 1 credit (based on order total, rounded down)
@@ -2766,6 +5490,7 @@ async def update_order(order_id: str, update: OrderUpdate):
                                 "$set": {"updated_at": datetime.now(timezone.utc)}
                             }
                         )
+                        invalidate_cached_user(user.get("user_id"))
                         update_data["credits_awarded"] = credits_to_award
                         print(f"Awarded {credits_to_award} APEX credits to {customer_email}")
     
@@ -2790,10 +5515,6 @@ async def update_order(order_id: str, update: OrderUpdate):
     
     # Get updated order
     updated_order = await db.orders.find_one({"id": order["id"]}, {"_id": 0})
-    if isinstance(updated_order.get('created_at'), str):
-        updated_order['created_at'] = datetime.fromisoformat(updated_order['created_at'])
-    if isinstance(updated_order.get('updated_at'), str):
-        updated_order['updated_at'] = datetime.fromisoformat(updated_order['updated_at'])
     
     return OrderResponse(
         success=True,
@@ -2857,8 +5578,9 @@ async def create_checkout_session(checkout_data: CheckoutRequest, request: Reque
             "discount_description": checkout_data.discount_description,
             "shipping_cost": checkout_data.shipping_cost,
             "total": checkout_data.total,
-            "created_at": datetime.now(timezone.utc).isoformat()
+            "created_at": datetime.now(timezone.utc)
         }
+        pending_order["expires_at"] = pending_order["created_at"] + timedelta(hours=PENDING_ORDER_RETENTION_HOURS)
         await db.pending_orders.insert_one(pending_order)
         
         # Create payment transaction record
@@ -2871,8 +5593,7 @@ async def create_checkout_session(checkout_data: CheckoutRequest, request: Reque
             metadata=metadata
         )
         tx_doc = transaction.model_dump()
-        tx_doc['created_at'] = tx_doc['created_at'].isoformat()
-        tx_doc['updated_at'] = tx_doc['updated_at'].isoformat()
+        tx_doc['expires_at'] = transaction.created_at + timedelta(days=PAYMENT_TRANSACTION_RETENTION_DAYS)
         await db.payment_transactions.insert_one(tx_doc)
         
         return {
@@ -2903,14 +5624,11 @@ async def get_checkout_status(session_id: str, request: Request):
         status: CheckoutStatusResponse = await stripe_checkout.get_checkout_status(session_id)
         
         # Update payment transaction
-        await db.payment_transactions.update_one(
-            {"session_id": session_id},
-            {"$set": {
-                "status": status.status,
-                "payment_status": status.payment_status,
-                "updated_at": datetime.now(timezone.utc).isoformat()
-            }}
-        )
+        await record_payment_status(session_id, {
+            "status": status.status,
+            "payment_status": status.payment_status,
+            "updated_at": datetime.now(timezone.utc)
+        })
         
         # If paid, create the order
         if status.payment_status == "paid":
@@ -2936,12 +5654,12 @@ async def get_checkout_status(session_id: str, request: Request):
                     
                     doc = order.model_dump()
                     doc['stripe_session_id'] = session_id
-                    doc['created_at'] = doc['created_at'].isoformat()
-                    doc['updated_at'] = doc['updated_at'].isoformat()
                     doc['items'] = [item.model_dump() if hasattr(item, 'model_dump') else item for item in doc['items']]
                     doc['shipping'] = doc['shipping'].model_dump() if hasattr(doc['shipping'], 'model_dump') else doc['shipping']
+                    doc['email_normalized'] = normalize_email(doc['shipping'].get('email'))
                     
                     await db.orders.insert_one(doc)
+                    schedule_contact_refresh(doc['shipping'].get('email'))
                     
                     # Update payment transaction with order ID
                     await db.payment_transactions.update_one(
@@ -2967,7 +5685,7 @@ async def get_checkout_status(session_id: str, request: Request):
                             {"product_id": inv_item['product_id'], "color": inv_item['color'], "size": inv_item['size']},
                             {
                                 "$inc": {"quantity": -inv_item['quantity']},
-                                "$set": {"updated_at": datetime.now(timezone.utc).isoformat()}
+                                "$set": {"updated_at": datetime.now(timezone.utc)}
                             }
                         )
                     
@@ -3022,14 +5740,11 @@ async def stripe_webhook(request: Request):
         
         # Update payment transaction based on webhook
         if webhook_response.session_id:
-            await db.payment_transactions.update_one(
-                {"session_id": webhook_response.session_id},
-                {"$set": {
-                    "status": webhook_response.event_type,
-                    "payment_status": webhook_response.payment_status,
-                    "updated_at": datetime.now(timezone.utc).isoformat()
-                }}
-            )
+            await record_payment_status(webhook_response.session_id, {
+                "status": webhook_response.event_type,
+                "payment_status": webhook_response.payment_status,
+                "updated_at": datetime.now(timezone.utc)
+            })
         
         return {"success": True, "event_type": webhook_response.event_type}
         
@@ -3183,7 +5898,7 @@ async def join_waitlist(entry: WaitlistEntry):
                 {"$set": {
                     "sizes": merged_sizes,
                     "size": merged_size_string,
-                    "updated_at": datetime.now(timezone.utc).isoformat()
+                    "updated_at": datetime.now(timezone.utc)
                 }}
             )
             
@@ -3229,6 +5944,7 @@ async def join_waitlist(entry: WaitlistEntry):
         waitlist_entry = {
             "id": str(uuid.uuid4()),
             "email": entry.email.lower(),
+            "email_normalized": normalize_email(entry.email),
             "product_id": entry.product_id,
             "product_name": entry.product_name,
             "variant": entry.variant,
@@ -3237,12 +5953,14 @@ async def join_waitlist(entry: WaitlistEntry):
             "image": entry.image,  # Store product image URL
             "position": position,
             "access_code": access_code,
-            "created_at": datetime.now(timezone.utc).isoformat(),
+            "created_at": datetime.now(timezone.utc),
             "notified": False,
             "purchased": False
         }
         
         await db.waitlist.insert_one(waitlist_entry)
+        await increment_counter("waitlist")
+        schedule_contact_refresh(entry.email)
         
         # Send webhook to n8n for waitlist confirmation email
         product_image = entry.image or ""
@@ -3414,7 +6132,7 @@ async def create_shipping_label(request: CreateLabelRequest):
                     "label_url": transaction.label_url,
                     "carrier": transaction.rate.provider if transaction.rate else None,
                     "status": "processing",
-                    "updated_at": datetime.now(timezone.utc).isoformat()
+                    "updated_at": datetime.now(timezone.utc)
                 }}
             )
             
@@ -3480,8 +6198,55 @@ async def get_tracking_status(carrier: str, tracking_number: str):
 # ADMIN ROUTES
 # ============================================
 
-# Store admin sessions (in production, use Redis or database)
-admin_sessions = set()
+# Password-login admin sessions live in admin_sessions so every worker sees
+# them; a TTL index removes them when they expire.
+ADMIN_SESSION_TTL_SECONDS = 24 * 60 * 60
+# How long a worker trusts its cached answer for a token; bounds how long a
+# logout on another worker takes to apply here
+ADMIN_SESSION_CACHE_TTL_SECONDS = int(os.environ.get("ADMIN_SESSION_CACHE_TTL_SECONDS", "30"))
+
+
+class AdminSessionStore:
+    """Admin tokens in MongoDB behind a per-process read-through cache
+
+    Only a SHA-256 of each token is stored.
+    """
+
+    def __init__(self):
+        # token hash -> expires_at, or False for tokens that aren't valid
+        self.cache = TTLCache(ADMIN_SESSION_CACHE_TTL_SECONDS, maxsize=1000)
+
+    @staticmethod
+    def _key(token: str) -> str:
+        return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+    async def create(self) -> str:
+        token = secrets.token_urlsafe(32)
+        now = datetime.now(timezone.utc)
+        expires_at = now + timedelta(seconds=ADMIN_SESSION_TTL_SECONDS)
+        await db.admin_sessions.insert_one({"_id": self._key(token), "created_at": now, "expires_at": expires_at})
+        self.cache.set(self._key(token), expires_at)
+        return token
+
+    async def is_valid(self, token: Optional[str]) -> bool:
+        if not token:
+            return False
+        key = self._key(token)
+        expires_at = self.cache.get(key)
+        if expires_at is None:
+            session = await db.admin_sessions.find_one({"_id": key}, {"expires_at": 1})
+            expires_at = session["expires_at"] if session else False
+            self.cache.set(key, expires_at)
+        # The TTL monitor only runs once a minute, so check expiry here too
+        return bool(expires_at) and expires_at > datetime.now(timezone.utc)
+
+    async def revoke(self, token: str):
+        key = self._key(token)
+        await db.admin_sessions.delete_one({"_id": key})
+        self.cache.set(key, False)
+
+
+admin_sessions = AdminSessionStore()
 
 @api_router.post("/admin/login")
 async def admin_login(credentials: AdminLogin, response: Response):
@@ -3490,8 +6255,7 @@ async def admin_login(credentials: AdminLogin, response: Response):
         raise HTTPException(status_code=401, detail="Invalid admin password")
     
     # Generate admin session token
-    admin_token = secrets.token_urlsafe(32)
-    admin_sessions.add(admin_token)
+    admin_token = await admin_sessions.create()
     
     response.set_cookie(
         key="admin_token",
@@ -3509,15 +6273,20 @@ async def admin_login(credentials: AdminLogin, response: Response):
 async def verify_admin(request: Request):
     """Verify admin session - either via admin_token or logged-in admin user"""
     # First check admin_token (from password login)
-    admin_token = request.cookies.get("admin_token")
-    if admin_token and admin_token in admin_sessions:
+    if await admin_sessions.is_valid(request.cookies.get("admin_token")):
         return True
     
     # Also check header for API calls
-    admin_token = request.headers.get("X-Admin-Token")
-    if admin_token and admin_token in admin_sessions:
+    if await admin_sessions.is_valid(request.headers.get("X-Admin-Token")):
         return True
     
+    # Signed session tokens carry the admin flag, so no lookup is needed
+    session_token = request_session_token(request)
+    if session_token and is_signed_session_token(session_token):
+        claims = verify_session_token(session_token)
+        if claims and claims.get("adm") and is_admin_user(claims.get("em", "")):
+            return True
+    
     # Check if logged-in user is an admin
     user = await get_current_user(request)
     if user and is_admin_user(user.get('email', '')):
@@ -3528,21 +6297,111 @@ async def verify_admin(request: Request):
 @api_router.post("/admin/logout")
 async def admin_logout(request: Request, response: Response):
     """Admin logout"""
-    admin_token = request.cookies.get("admin_token")
-    if admin_token and admin_token in admin_sessions:
-        admin_sessions.discard(admin_token)
+    admin_token = request.cookies.get("admin_token") or request.headers.get("X-Admin-Token")
+    if admin_token:
+        await admin_sessions.revoke(admin_token)
     
     response.delete_cookie("admin_token", path="/")
     return {"success": True, "message": "Admin logged out"}
 
-@api_router.get("/admin/verify")
-async def verify_admin_session(request: Request):
-    """Verify if admin is logged in"""
-    try:
-        await verify_admin(request)
-        return {"authenticated": True}
-    except HTTPException:
-        return {"authenticated": False}
+@api_router.get("/admin/verify")
+async def verify_admin_session(request: Request):
+    """Verify if admin is logged in"""
+    try:
+        await verify_admin(request)
+        return {"authenticated": True}
+    except HTTPException:
+        return {"authenticated": False}
+
+@api_router.get("/admin/indexes")
+async def get_index_report(request: Request):
+    """Report drift between the declared index registry and MongoDB"""
+    await verify_admin(request)
+
+    drift = await get_index_drift()
+    return {"in_sync": not drift, "drift": drift}
+
+@api_router.get("/admin/retention")
+async def get_retention_report(request: Request):
+    """Retention policy per collection, rows awaiting the TTL monitor and the last sweep"""
+    await verify_admin(request)
+    
+    policies = retention_policies(datetime.now(timezone.utc))
+    names = list(policies)
+    totals, awaiting, paid_pending, last_sweep, ttl_deleted = await asyncio.gather(
+        asyncio.gather(*(db[name].estimated_document_count() for name in names)),
+        asyncio.gather(*(db[name].count_documents(policies[name]["expired"]) for name in names)),
+        count_paid_pending_orders(),
+        db.admin_reports.find_one({"_id": "retention"}, {"_id": 0}),
+        ttl_deleted_documents()
+    )
+    
+    return {
+        "collections": {
+            name: {
+                "retention": policies[name]["retention"],
+                "documents": total,
+                "awaiting_ttl": pending
+            }
+            for name, total, pending in zip(names, totals, awaiting)
+        },
+        # Paid checkouts whose order was never created (customer didn't return)
+        "paid_pending_orders": paid_pending,
+        "ttl_deleted_documents": ttl_deleted,
+        "last_sweep": last_sweep
+    }
+
+@api_router.post("/admin/retention/sweep")
+async def run_retention_sweep(request: Request):
+    """Date or delete legacy rows that the TTL indexes cannot expire"""
+    await verify_admin(request)
+    
+    return await sweep_retention()
+
+@api_router.post("/admin/stats/reconcile")
+async def reconcile_stats_counters(request: Request, days: int = COUNTER_RECONCILE_DAYS):
+    """Repair public stats counters against the source collections"""
+    await verify_admin(request)
+    
+    return await reconcile_counters(days=min(days, 366))
+
+@api_router.post("/admin/analytics/rollup")
+async def run_analytics_rollup(request: Request):
+    """Fold any closed hours into the analytics rollups now"""
+    await verify_admin(request)
+    
+    return await rollup_analytics()
+
+@api_router.post("/admin/contacts/rebuild")
+async def rebuild_contacts_endpoint(request: Request):
+    """Queue a regeneration of the contacts read model; poll it under /admin/jobs"""
+    await verify_admin(request)
+
+    return await queue_contacts_rebuild()
+
+@api_router.get("/admin/db-metrics")
+async def get_db_metrics(request: Request):
+    """MongoDB connection pool and command latency metrics"""
+    await verify_admin(request)
+
+    return {
+        "pool_options": MONGO_POOL_OPTIONS,
+        **mongo_metrics.snapshot(),
+        "log_writer": log_writer.stats(),
+        "password_hashing": password_hasher.stats(),
+        "caches": {
+            "sessions": session_cache.stats(),
+            "users": user_cache.stats(),
+            "counts": count_cache.stats()
+        }
+    }
+
+@api_router.post("/admin/indexes/sync")
+async def sync_indexes(request: Request):
+    """Create any declared indexes that are missing"""
+    await verify_admin(request)
+
+    return await ensure_indexes()
 
 @api_router.get("/admin/stats")
 async def get_admin_stats(request: Request, timeframe: str = "all"):
@@ -3552,126 +6411,112 @@ async def get_admin_stats(request: Request, timeframe: str = "all"):
         timeframe: "today", "7d", "30d", "90d", or "all"
     """
     await verify_admin(request)
-    
+    return await compute_admin_stats(timeframe)
+
+async def compute_admin_stats(timeframe: str = "all") -> dict:
+    """Admin statistics for a timeframe; shared by /admin/stats and /admin/dashboard"""
     # Calculate date filter based on timeframe
     date_filter = {}
     now = datetime.now(timezone.utc)
     
     if timeframe == "today":
         start_date = now.replace(hour=0, minute=0, second=0, microsecond=0)
-        date_filter = {"$gte": start_date.isoformat()}
+        date_filter = {"$gte": start_date}
     elif timeframe == "7d":
         start_date = now - timedelta(days=7)
-        date_filter = {"$gte": start_date.isoformat()}
+        date_filter = {"$gte": start_date}
     elif timeframe == "30d":
         start_date = now - timedelta(days=30)
-        date_filter = {"$gte": start_date.isoformat()}
+        date_filter = {"$gte": start_date}
     elif timeframe == "90d":
         start_date = now - timedelta(days=90)
-        date_filter = {"$gte": start_date.isoformat()}
+        date_filter = {"$gte": start_date}
     # "all" = no filter
     
-    # Build queries with date filter
-    user_query = {"created_at": date_filter} if date_filter else {}
-    subscriber_query = {"timestamp": date_filter} if date_filter else {}
-    waitlist_query = {"created_at": date_filter} if date_filter else {}
-    order_query = {"created_at": date_filter} if date_filter else {}
-    
-    # Total counts (filtered by timeframe)
-    total_users = await db.users.count_documents(user_query)
-    total_subscribers = await db.email_subscriptions.count_documents(subscriber_query)
-    total_orders = await db.orders.count_documents(order_query)
-    total_waitlist = await db.waitlist.count_documents(waitlist_query)
-    
-    # Giveaway entries (filtered)
-    giveaway_query = {"source": "giveaway_popup"}
-    if date_filter:
-        giveaway_query["timestamp"] = date_filter
-    total_giveaway = await db.email_subscriptions.count_documents(giveaway_query)
-    
-    # User type breakdown (MAG, WAG, Others)
-    mag_query = {"discipline": "MAG"}
-    wag_query = {"discipline": "WAG"}
-    other_query = {"$or": [{"discipline": {"$exists": False}}, {"discipline": {"$nin": ["MAG", "WAG"]}}]}
-    
-    if date_filter:
-        mag_query["created_at"] = date_filter
-        wag_query["created_at"] = date_filter
-        other_query["created_at"] = date_filter
-    
-    mag_users = await db.users.count_documents(mag_query)
-    wag_users = await db.users.count_documents(wag_query)
-    other_users = total_users - mag_users - wag_users
-    
-    # Waitlist breakdown by discipline
-    mag_waitlist_query = {"discipline": "MAG"}
-    wag_waitlist_query = {"discipline": "WAG"}
-    other_waitlist_query = {"$or": [{"discipline": {"$exists": False}}, {"discipline": {"$nin": ["MAG", "WAG"]}}]}
-    
-    if date_filter:
-        mag_waitlist_query["created_at"] = date_filter
-        wag_waitlist_query["created_at"] = date_filter
-        other_waitlist_query["created_at"] = date_filter
-    
-    mag_waitlist = await db.waitlist.count_documents(mag_waitlist_query)
-    wag_waitlist = await db.waitlist.count_documents(wag_waitlist_query)
-    other_waitlist = total_waitlist - mag_waitlist - wag_waitlist
-    
-    # Get recent signups (last 7 days) - always relative to now
-    week_ago = (now - timedelta(days=7)).isoformat()
-    recent_users = await db.users.count_documents({"created_at": {"$gte": week_ago}})
-    recent_subscribers = await db.email_subscriptions.count_documents({"timestamp": {"$gte": week_ago}})
-    recent_giveaway = await db.email_subscriptions.count_documents({"source": "giveaway_popup", "timestamp": {"$gte": week_ago}})
-    recent_waitlist = await db.waitlist.count_documents({"created_at": {"$gte": week_ago}})
+    # Recent stats are always the last 7 days, independent of timeframe
+    week_ago = now - timedelta(days=7)
+    recent = {"$gte": week_ago}
+    
+    def windowed(field: str, extra: Optional[dict] = None) -> dict:
+        query = dict(extra or {})
+        if date_filter:
+            query[field] = date_filter
+        return query
+    
+    def discipline_facets() -> Dict[str, dict]:
+        return {
+            "total": windowed("created_at"),
+            "mag": windowed("created_at", {"discipline": "MAG"}),
+            "wag": windowed("created_at", {"discipline": "WAG"}),
+            "recent": {"created_at": recent}
+        }
+    
+    # One faceted round trip per collection, all collections in parallel
+    users, waitlist, subscribers, orders = await asyncio.gather(
+        facet_counts(db.users, discipline_facets()),
+        facet_counts(db.waitlist, discipline_facets()),
+        facet_counts(db.email_subscriptions, {
+            "total": windowed("timestamp"),
+            "giveaway": windowed("timestamp", {"source": "giveaway_popup"}),
+            "recent": {"timestamp": recent},
+            "recent_giveaway": {"source": "giveaway_popup", "timestamp": recent}
+        }),
+        facet_counts(db.orders, {"total": windowed("created_at")})
+    )
     
     return {
         "timeframe": timeframe,
-        "total_users": total_users,
-        "total_subscribers": total_subscribers,
-        "total_orders": total_orders,
-        "total_waitlist": total_waitlist,
-        "total_giveaway": total_giveaway,
+        "total_users": users["total"],
+        "total_subscribers": subscribers["total"],
+        "total_orders": orders["total"],
+        "total_waitlist": waitlist["total"],
+        "total_giveaway": subscribers["giveaway"],
         # User breakdown by discipline
-        "mag_users": mag_users,
-        "wag_users": wag_users,
-        "other_users": other_users,
+        "mag_users": users["mag"],
+        "wag_users": users["wag"],
+        "other_users": users["total"] - users["mag"] - users["wag"],
         # Waitlist breakdown by discipline
-        "mag_waitlist": mag_waitlist,
-        "wag_waitlist": wag_waitlist,
-        "other_waitlist": other_waitlist,
+        "mag_waitlist": waitlist["mag"],
+        "wag_waitlist": waitlist["wag"],
+        "other_waitlist": waitlist["total"] - waitlist["mag"] - waitlist["wag"],
         # Recent stats (always last 7 days)
-        "recent_users_7d": recent_users,
-        "recent_subscribers_7d": recent_subscribers,
-        "recent_giveaway_7d": recent_giveaway,
-        "recent_waitlist_7d": recent_waitlist
+        "recent_users_7d": users["recent"],
+        "recent_subscribers_7d": subscribers["recent"],
+        "recent_giveaway_7d": subscribers["recent_giveaway"],
+        "recent_waitlist_7d": waitlist["recent"]
     }
 
 @api_router.get("/admin/users")
-async def get_all_users(request: Request, skip: int = 0, limit: int = 500):
-    """Get all registered users with their activity data"""
+async def get_all_users(request: Request, limit: int = 500, cursor: str = ""):
+    """Get all registered users with their activity data, newest first"""
     await verify_admin(request)
     
-    users = await db.users.find(
-        {}, 
-        {"_id": 0, "password_hash": 0}  # Exclude sensitive data
-    ).sort("created_at", -1).skip(skip).limit(limit).to_list(limit)
+    try:
+        users, next_cursor = await keyset_page(
+            db.users, {}, "created_at", page_limit(limit), cursor,
+            {"_id": 0, "password_hash": 0}  # Exclude sensitive data
+        )
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    
+    # Fetch related activity for the whole page with one query per collection
+    emails = [user.get('email', '') for user in users]
+    waitlist_by_email, subscriptions_by_email, orders_by_email, carts_by_email, total = await asyncio.gather(
+        group_by_email(db.waitlist, emails, {"product_name": 1}),
+        group_by_email(db.email_subscriptions, emails, {"source": 1}),
+        group_by_email(db.orders, emails, {"total": 1, "status": 1}),
+        group_by_email(db.carts, emails, {"items": 1}),
+        cached_count(db.users)
+    )
     
     # Enrich each user with their activity data
     enriched_users = []
     for user in users:
-        email = user.get('email', '')
-        
-        # Check if user is in waitlist
-        waitlist_entries = await db.waitlist.find({"email": email}, {"_id": 0}).to_list(100)
-        
-        # Check if user has any email subscriptions (giveaway, early_access, etc.)
-        subscriptions = await db.email_subscriptions.find({"email": email}, {"_id": 0}).to_list(100)
-        
-        # Check if user has any orders
-        orders = await db.orders.find({"customer_email": email}, {"_id": 0, "order_id": 1, "total": 1, "status": 1}).to_list(100)
-        
-        # Check if user has any abandoned carts
-        carts = await db.carts.find({"email": email}, {"_id": 0}).to_list(10)
+        key = normalize_email(user.get('email', ''))
+        waitlist_entries = waitlist_by_email.get(key, [])
+        subscriptions = subscriptions_by_email.get(key, [])
+        orders = orders_by_email.get(key, [])
+        carts = carts_by_email.get(key, [])
         
         # Determine signup source
         signup_source = "direct"
@@ -3700,376 +6545,360 @@ async def get_all_users(request: Request, skip: int = 0, limit: int = 500):
             "cart_items": carts[0].get('items', []) if carts else []
         })
     
-    total = await db.users.count_documents({})
-    
     return {
         "users": enriched_users,
         "total": total,
-        "skip": skip,
-        "limit": limit
+        "limit": limit,
+        "next_cursor": next_cursor
     }
 
 @api_router.get("/admin/all-contacts")
-async def get_all_contacts(request: Request):
-    """Get comprehensive list of all contacts (users, subscribers, waitlist) with their activities"""
-    await verify_admin(request)
-    
-    # Get all unique emails from all sources
-    all_contacts = {}
+async def get_all_contacts(request: Request, skip: int = 0, limit: int = 500):
+    """Get comprehensive list of all contacts (users, subscribers, waitlist) with their activities
     
-    # 1. Get all users
-    users = await db.users.find({}, {"_id": 0, "password_hash": 0}).to_list(1000)
-    for user in users:
-        email = user.get('email', '').lower()
-        if email:
-            all_contacts[email] = {
-                "email": email,
-                "name": user.get('name', ''),
-                "discipline": user.get('discipline', 'unknown'),
-                "auth_provider": user.get('auth_provider', ''),
-                "signed_up": True,
-                "signup_date": user.get('created_at', ''),
-                "signup_source": "direct",
-                "has_giveaway_entry": False,
-                "has_early_access": False,
-                "waitlist_products": [],
-                "orders_count": 0,
-                "total_spent": 0,
-                "has_cart": False
-            }
+    Args:
+        skip/limit: paging over contacts newest first (limit capped at 1000)
+    """
+    await verify_admin(request)
     
-    # 2. Get all email subscriptions
-    subscriptions = await db.email_subscriptions.find({}, {"_id": 0}).to_list(5000)
-    for sub in subscriptions:
-        email = sub.get('email', '').lower()
-        source = sub.get('source', '')
-        
-        if email not in all_contacts:
-            all_contacts[email] = {
-                "email": email,
-                "name": sub.get('name', ''),
-                "discipline": sub.get('discipline', 'unknown'),
-                "auth_provider": "",
-                "signed_up": False,
-                "signup_date": sub.get('timestamp', ''),
-                "signup_source": source,
-                "has_giveaway_entry": False,
-                "has_early_access": False,
-                "waitlist_products": [],
-                "orders_count": 0,
-                "total_spent": 0,
-                "has_cart": False
-            }
-        
-        if source == 'giveaway_popup':
-            all_contacts[email]["has_giveaway_entry"] = True
-            if all_contacts[email]["signup_source"] == "direct":
-                all_contacts[email]["signup_source"] = "giveaway"
-        elif source == 'early_access':
-            all_contacts[email]["has_early_access"] = True
-            if all_contacts[email]["signup_source"] == "direct":
-                all_contacts[email]["signup_source"] = "early_access"
-    
-    # 3. Get all waitlist entries
-    waitlist = await db.waitlist.find({}, {"_id": 0}).to_list(5000)
-    for entry in waitlist:
-        email = entry.get('email', '').lower()
-        product = entry.get('product_name', '')
-        
-        if email not in all_contacts:
-            all_contacts[email] = {
-                "email": email,
-                "name": entry.get('name', ''),
-                "discipline": entry.get('discipline', 'unknown'),
-                "auth_provider": "",
-                "signed_up": False,
-                "signup_date": entry.get('created_at', ''),
-                "signup_source": "waitlist",
-                "has_giveaway_entry": False,
-                "has_early_access": False,
-                "waitlist_products": [],
-                "orders_count": 0,
-                "total_spent": 0,
-                "has_cart": False
-            }
-        
-        if product and product not in all_contacts[email]["waitlist_products"]:
-            all_contacts[email]["waitlist_products"].append(product)
-    
-    # 4. Get all orders
-    orders = await db.orders.find({}, {"_id": 0, "customer_email": 1, "total": 1}).to_list(5000)
-    for order in orders:
-        email = (order.get('customer_email', '') or '').lower()
-        if email and email in all_contacts:
-            all_contacts[email]["orders_count"] += 1
-            all_contacts[email]["total_spent"] += order.get('total', 0)
-    
-    # 5. Get all carts
-    carts = await db.carts.find({}, {"_id": 0, "email": 1}).to_list(5000)
-    for cart in carts:
-        email = (cart.get('email', '') or '').lower()
-        if email and email in all_contacts:
-            all_contacts[email]["has_cart"] = True
-    
-    # Convert to list and sort by signup date
-    contacts_list = list(all_contacts.values())
-    contacts_list.sort(key=lambda x: x.get('signup_date', ''), reverse=True)
+    limit = page_limit(limit)
+    cursor = db.contacts.find({}, CONTACT_PROJECTION).sort(
+        [("signup_date", DESCENDING), ("_id", DESCENDING)]
+    ).skip(max(skip, 0)).limit(limit)
+    
+    def flagged(condition) -> dict:
+        return {"$sum": {"$cond": [condition, 1, 0]}}
+    
+    contacts_list, summary = await asyncio.gather(
+        cursor.to_list(limit),
+        db.contacts.aggregate([
+            {"$group": {
+                "_id": None,
+                "total": {"$sum": 1},
+                "total_signed_up": flagged("$signed_up"),
+                "total_giveaway": flagged("$has_giveaway_entry"),
+                "total_early_access": flagged("$has_early_access"),
+                "total_with_waitlist": flagged({"$gt": [{"$size": "$waitlist_products"}, 0]}),
+                "total_with_orders": flagged({"$gt": ["$orders_count", 0]}),
+                "total_with_cart": flagged("$has_cart"),
+                "mag_count": flagged({"$eq": ["$discipline", "MAG"]}),
+                "wag_count": flagged({"$eq": ["$discipline", "WAG"]})
+            }}
+        ]).to_list(1)
+    )
+    summary = summary[0] if summary else {}
+    total = summary.pop("total", 0)
+    summary.pop("_id", None)
     
     return {
         "contacts": contacts_list,
-        "total": len(contacts_list),
+        "total": total,
         "summary": {
-            "total_signed_up": sum(1 for c in contacts_list if c["signed_up"]),
-            "total_giveaway": sum(1 for c in contacts_list if c["has_giveaway_entry"]),
-            "total_early_access": sum(1 for c in contacts_list if c["has_early_access"]),
-            "total_with_waitlist": sum(1 for c in contacts_list if c["waitlist_products"]),
-            "total_with_orders": sum(1 for c in contacts_list if c["orders_count"] > 0),
-            "total_with_cart": sum(1 for c in contacts_list if c["has_cart"]),
-            "mag_count": sum(1 for c in contacts_list if c["discipline"] == "MAG"),
-            "wag_count": sum(1 for c in contacts_list if c["discipline"] == "WAG"),
-            "other_count": sum(1 for c in contacts_list if c["discipline"] not in ["MAG", "WAG"])
+            "total_signed_up": summary.get("total_signed_up", 0),
+            "total_giveaway": summary.get("total_giveaway", 0),
+            "total_early_access": summary.get("total_early_access", 0),
+            "total_with_waitlist": summary.get("total_with_waitlist", 0),
+            "total_with_orders": summary.get("total_with_orders", 0),
+            "total_with_cart": summary.get("total_with_cart", 0),
+            "mag_count": summary.get("mag_count", 0),
+            "wag_count": summary.get("wag_count", 0),
+            "other_count": total - summary.get("mag_count", 0) - summary.get("wag_count", 0)
         }
     }
 
 @api_router.get("/admin/subscribers")
-async def get_all_subscribers(request: Request, source: Optional[str] = None, skip: int = 0, limit: int = 100):
-    """Get all email subscribers"""
+async def get_all_subscribers(request: Request, source: Optional[str] = None, limit: int = 100, cursor: str = ""):
+    """Get all email subscribers, newest first"""
     await verify_admin(request)
     
     query = {}
     if source:
         query["source"] = source
     
-    subscribers = await db.email_subscriptions.find(
-        query, 
-        {"_id": 0}
-    ).sort("timestamp", -1).skip(skip).limit(limit).to_list(limit)
-    
-    total = await db.email_subscriptions.count_documents(query)
+    try:
+        (subscribers, next_cursor), total = await asyncio.gather(
+            keyset_page(db.email_subscriptions, query, "timestamp", page_limit(limit), cursor, {"_id": 0}),
+            cached_count(db.email_subscriptions, query)
+        )
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
     
     return {
         "subscribers": subscribers,
         "total": total,
-        "skip": skip,
-        "limit": limit
+        "limit": limit,
+        "next_cursor": next_cursor
     }
 
 @api_router.get("/admin/waitlist")
-async def get_all_waitlist(request: Request, skip: int = 0, limit: int = 100):
-    """Get all waitlist entries"""
+async def get_all_waitlist(request: Request, limit: int = 100, cursor: str = ""):
+    """Get all waitlist entries, newest first"""
     await verify_admin(request)
     
-    entries = await db.waitlist.find(
-        {}, 
-        {"_id": 0}
-    ).sort("created_at", -1).skip(skip).limit(limit).to_list(limit)
-    
-    total = await db.waitlist.count_documents({})
+    try:
+        (entries, next_cursor), total = await asyncio.gather(
+            keyset_page(db.waitlist, {}, "created_at", page_limit(limit), cursor, {"_id": 0}),
+            cached_count(db.waitlist)
+        )
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
     
     return {
         "waitlist": entries,
         "total": total,
-        "skip": skip,
-        "limit": limit
+        "limit": limit,
+        "next_cursor": next_cursor
     }
 
 @api_router.get("/admin/orders")
-async def get_all_orders(request: Request, skip: int = 0, limit: int = 100):
-    """Get all orders"""
+async def get_all_orders(request: Request, limit: int = 100, cursor: str = ""):
+    """Get all orders, newest first"""
     await verify_admin(request)
     
-    orders = await db.orders.find(
-        {}, 
-        {"_id": 0}
-    ).sort("created_at", -1).skip(skip).limit(limit).to_list(limit)
-    
-    total = await db.orders.count_documents({})
+    try:
+        (orders, next_cursor), total = await asyncio.gather(
+            keyset_page(db.orders, {}, "created_at", page_limit(limit), cursor, {"_id": 0}),
+            cached_count(db.orders)
+        )
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
     
     return {
         "orders": orders,
         "total": total,
-        "skip": skip,
-        "limit": limit
+        "limit": limit,
+        "next_cursor": next_cursor
     }
 
 # ============== NEW ADMIN FEATURES ==============
 
 @api_router.get("/admin/export/contacts")
-async def export_contacts_csv(request: Request):
-    """Export all contacts to CSV format"""
-    await verify_admin(request)
-    
-    # Get all contacts using the same logic as all-contacts endpoint
-    all_contacts = {}
+async def export_contacts_csv(request: Request, gzip: bool = False, background: bool = False):
+    """Export all contacts to CSV format
     
-    users = await db.users.find({}, {"_id": 0, "password_hash": 0}).to_list(10000)
-    for user in users:
-        email = user.get('email', '').lower()
-        if email:
-            all_contacts[email] = {
-                "email": email,
-                "name": user.get('name', ''),
-                "discipline": user.get('discipline', 'unknown'),
-                "auth_provider": user.get('auth_provider', ''),
-                "signed_up": "Yes",
-                "signup_date": user.get('created_at', ''),
-                "has_giveaway": "No",
-                "has_early_access": "No",
-                "waitlist_products": "",
-                "orders_count": 0,
-                "total_spent": 0
-            }
+    Rows are streamed from a database cursor as they are read.
     
-    subscriptions = await db.email_subscriptions.find({}, {"_id": 0}).to_list(10000)
-    for sub in subscriptions:
-        email = sub.get('email', '').lower()
-        source = sub.get('source', '')
-        if email not in all_contacts:
-            all_contacts[email] = {
-                "email": email,
-                "name": sub.get('name', ''),
-                "discipline": sub.get('discipline', 'unknown'),
-                "auth_provider": "",
-                "signed_up": "No",
-                "signup_date": sub.get('timestamp', ''),
-                "has_giveaway": "No",
-                "has_early_access": "No",
-                "waitlist_products": "",
-                "orders_count": 0,
-                "total_spent": 0
-            }
-        if source == 'giveaway_popup':
-            all_contacts[email]["has_giveaway"] = "Yes"
-        elif source == 'early_access':
-            all_contacts[email]["has_early_access"] = "Yes"
+    Args:
+        gzip: compress the download (raze_contacts.csv.gz)
+        background: run as an export_contacts job and return its id instead
+    """
+    await verify_admin(request)
     
-    waitlist = await db.waitlist.find({}, {"_id": 0}).to_list(10000)
-    for entry in waitlist:
-        email = entry.get('email', '').lower()
-        product = entry.get('product_name', '')
-        if email in all_contacts:
-            existing = all_contacts[email]["waitlist_products"]
-            all_contacts[email]["waitlist_products"] = f"{existing}, {product}" if existing else product
-    
-    orders = await db.orders.find({}, {"_id": 0, "customer_email": 1, "total": 1}).to_list(10000)
-    for order in orders:
-        email = (order.get('customer_email', '') or '').lower()
-        if email and email in all_contacts:
-            all_contacts[email]["orders_count"] += 1
-            all_contacts[email]["total_spent"] += order.get('total', 0)
-    
-    # Convert to CSV
-    import csv
-    import io
-    output = io.StringIO()
-    fieldnames = ["email", "name", "discipline", "auth_provider", "signed_up", "signup_date", 
-                  "has_giveaway", "has_early_access", "waitlist_products", "orders_count", "total_spent"]
-    writer = csv.DictWriter(output, fieldnames=fieldnames)
-    writer.writeheader()
-    for contact in all_contacts.values():
-        writer.writerow(contact)
+    if background:
+        return await submit_admin_job("export_contacts", {"gzip": gzip})
     
-    from fastapi.responses import StreamingResponse
-    output.seek(0)
+    filename = "raze_contacts.csv.gz" if gzip else "raze_contacts.csv"
     return StreamingResponse(
-        iter([output.getvalue()]),
-        media_type="text/csv",
-        headers={"Content-Disposition": "attachment; filename=raze_contacts.csv"}
+        stream_csv(contact_csv_rows(), CONTACT_CSV_FIELDS, compress=gzip),
+        media_type="application/gzip" if gzip else "text/csv",
+        headers={"Content-Disposition": f"attachment; filename={filename}"}
     )
 
+CONTACT_CSV_FIELDS = ["email", "name", "discipline", "auth_provider", "signed_up", "signup_date",
+                      "has_giveaway", "has_early_access", "waitlist_products", "orders_count", "total_spent"]
+
+async def contact_csv_rows() -> AsyncIterator[dict]:
+    """Contacts as CSV rows, newest signup first"""
+    cursor = db.contacts.find({}, CONTACT_PROJECTION).sort("signup_date", -1).batch_size(1000)
+    async for contact in cursor:
+        yield {
+            "email": contact.get('email', ''),
+            "name": contact.get('name', ''),
+            "discipline": contact.get('discipline', 'unknown'),
+            "auth_provider": contact.get('auth_provider', ''),
+            "signed_up": "Yes" if contact.get('signed_up') else "No",
+            "signup_date": to_iso(contact.get('signup_date')),
+            "has_giveaway": "Yes" if contact.get('has_giveaway_entry') else "No",
+            "has_early_access": "Yes" if contact.get('has_early_access') else "No",
+            "waitlist_products": ", ".join(contact.get('waitlist_products', [])),
+            "orders_count": contact.get('orders_count', 0),
+            "total_spent": contact.get('total_spent', 0)
+        }
+
+# Search tiers, best first: exact email, every term an exact token, every term a token prefix
+CONTACT_SEARCH_TIERS = ("email", "token", "prefix")
+
+def contact_search_tier_query(tier: str, q: str, terms: List[str]) -> dict:
+    """Contacts filter for one ranking tier, excluding matches of better tiers"""
+    if tier == "email":
+        return {"_id": q}
+    exact = {"search_tokens": {"$all": terms}}
+    if tier == "token":
+        return {**exact, "_id": {"$ne": q}}
+    prefixes = [{"search_tokens": re.compile("^" + re.escape(term))} for term in terms]
+    return {"$and": prefixes, "_id": {"$ne": q}, "$nor": [exact]}
+
+@api_router.get("/admin/autocomplete")
+async def autocomplete_contacts(request: Request, q: str = "", limit: int = 10):
+    """Complete a contact email or name prefix from the in-memory index"""
+    await verify_admin(request)
+    
+    started = time.perf_counter()
+    results = contact_autocomplete.complete(q, min(max(limit, 1), 50)) if q.strip() else []
+    
+    return {
+        "query": q,
+        "results": results,
+        "took_ms": round((time.perf_counter() - started) * 1000, 3)
+    }
+
+@api_router.get("/admin/autocomplete/stats")
+async def autocomplete_stats(request: Request):
+    """Size and approximate memory footprint of the autocomplete index"""
+    await verify_admin(request)
+    
+    return contact_autocomplete.stats()
+
+@api_router.post("/admin/segments/evaluate")
+async def evaluate_segment(request: Request, segment_request: SegmentRequest):
+    """Count a segment expression's contacts and list the first `limit` emails"""
+    await verify_admin(request)
+    
+    started = time.perf_counter()
+    try:
+        bitmap = segment_index.evaluate(segment_request.segment)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    return {
+        "count": bitmap.bit_count(),
+        "emails": segment_index.members(bitmap, min(max(segment_request.limit, 0), 10000)),
+        "took_ms": round((time.perf_counter() - started) * 1000, 3)
+    }
+
+@api_router.get("/admin/segments/attributes")
+async def segment_attributes_endpoint(request: Request):
+    """Segment attributes and values with their member counts"""
+    await verify_admin(request)
+    
+    return segment_index.stats()
+
 @api_router.get("/admin/search")
 async def search_contacts(request: Request, q: str = "", discipline: str = "", source: str = "", 
-                          start_date: str = "", end_date: str = ""):
-    """Search and filter contacts"""
+                          start_date: str = "", end_date: str = "", limit: int = 50, cursor: str = ""):
+    """Search and filter contacts
+    
+    Matches the query against tokens of each contact's email, name and order
+    numbers. Results are ranked exact email, then exact tokens, then token
+    prefixes, and paginated with the returned next_cursor.
+    """
     await verify_admin(request)
     
-    results = []
+    try:
+        start = parse_datetime(start_date)
+        end = parse_datetime(end_date)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid start_date or end_date")
     
-    # Search users
-    user_query = {}
-    if q:
-        user_query["$or"] = [
-            {"email": {"$regex": q, "$options": "i"}},
-            {"name": {"$regex": q, "$options": "i"}}
-        ]
-    if discipline and discipline != "all":
-        user_query["discipline"] = discipline
-    if start_date:
-        user_query["created_at"] = {"$gte": start_date}
-    if end_date:
-        if "created_at" in user_query:
-            user_query["created_at"]["$lte"] = end_date
-        else:
-            user_query["created_at"] = {"$lte": end_date}
+    try:
+        position = decode_cursor(cursor) if cursor else {}
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
     
-    users = await db.users.find(user_query, {"_id": 0, "password_hash": 0}).to_list(500)
-    for user in users:
-        results.append({
-            "email": user.get('email', ''),
-            "name": user.get('name', ''),
-            "discipline": user.get('discipline', 'unknown'),
-            "type": "user",
-            "source": user.get('auth_provider', 'direct'),
-            "date": user.get('created_at', '')
-        })
+    limit = min(max(limit, 1), 500)
     
-    # Search subscribers
-    sub_query = {}
-    if q:
-        sub_query["email"] = {"$regex": q, "$options": "i"}
+    # Filters shared by every tier
+    filters = {}
+    if discipline and discipline != "all":
+        filters["discipline"] = discipline
     if source and source != "all":
-        sub_query["source"] = source
-    if start_date:
-        sub_query["timestamp"] = {"$gte": start_date}
-    if end_date:
-        if "timestamp" in sub_query:
-            sub_query["timestamp"]["$lte"] = end_date
+        filters["sources"] = source
+    if start or end:
+        filters["signup_date"] = {}
+        if start:
+            filters["signup_date"]["$gte"] = start
+        if end:
+            filters["signup_date"]["$lte"] = end
+    
+    q = normalize_email(q)
+    terms = q.split()
+    tiers = CONTACT_SEARCH_TIERS if terms else ("all",)
+    
+    # Resume from the cursor's tier and position within it
+    tier_index = tiers.index(position["tier"]) if position.get("tier") in tiers else 0
+    after = position.get("after")
+    
+    results = []
+    seen = set()
+    for tier in tiers[tier_index:]:
+        query = dict(filters)
+        if tier != "all":
+            query = {"$and": [query, contact_search_tier_query(tier, q, terms)]}
+        if after is not None:
+            query = {"$and": [query, {"_id": {"$gt": after}}]}
+        
+        # One extra row tells us whether another page exists
+        needed = limit + 1 - len(results)
+        contacts = await db.contacts.find(query).sort("_id", 1).limit(needed).to_list(needed)
+        for contact in contacts:
+            if contact["_id"] in seen:
+                continue
+            seen.add(contact["_id"])
+            results.append((tier, contact))
+        
+        after = None
+        if len(results) > limit:
+            break
+    
+    next_cursor = None
+    if len(results) > limit:
+        results = results[:limit]
+        last_tier, last_contact = results[-1]
+        next_cursor = encode_cursor({"tier": last_tier, "after": last_contact["_id"]})
+    
+    formatted = []
+    for tier, contact in results:
+        sources = contact.get('sources', [])
+        if contact.get('signed_up'):
+            contact_type, contact_source = "user", contact.get('auth_provider') or 'direct'
+        elif sources:
+            contact_type, contact_source = "subscriber", contact.get('signup_source', '')
         else:
-            sub_query["timestamp"] = {"$lte": end_date}
-    
-    subs = await db.email_subscriptions.find(sub_query, {"_id": 0}).to_list(500)
-    for sub in subs:
-        email = sub.get('email', '')
-        if not any(r['email'] == email for r in results):
-            results.append({
-                "email": email,
-                "name": sub.get('name', ''),
-                "discipline": sub.get('discipline', 'unknown'),
-                "type": "subscriber",
-                "source": sub.get('source', ''),
-                "date": sub.get('timestamp', '')
-            })
+            contact_type, contact_source = "waitlist", "waitlist"
+        formatted.append({
+            "email": contact.get('email', ''),
+            "name": contact.get('name', ''),
+            "discipline": contact.get('discipline', 'unknown'),
+            "type": contact_type,
+            "source": contact_source,
+            "date": contact.get('signup_date', ''),
+            "match": tier
+        })
     
-    return {"results": results, "total": len(results)}
+    return {"results": formatted, "total": len(formatted), "next_cursor": next_cursor}
 
 @api_router.get("/admin/giveaway/pick-winner")
-async def pick_giveaway_winner(request: Request):
-    """Randomly pick a giveaway winner"""
-    await verify_admin(request)
-    import random
+async def pick_giveaway_winner(request: Request, count: int = 1, exclude_previous: bool = True):
+    """Randomly pick giveaway winners
     
-    entries = await db.email_subscriptions.find(
-        {"source": "giveaway_popup"},
-        {"_id": 0}
-    ).to_list(10000)
+    Args:
+        count: number of winners, each with a different email
+        exclude_previous: skip emails that already won (is_winner)
+    """
+    await verify_admin(request)
     
-    if not entries:
-        return {"success": False, "message": "No giveaway entries found"}
+    winners, total_entries = await asyncio.gather(
+        draw_giveaway_entries(min(max(count, 1), 100), exclude_previous),
+        cached_count(db.email_subscriptions, {"source": GIVEAWAY_SOURCE})
+    )
     
-    winner = random.choice(entries)
+    if not winners:
+        return {"success": False, "message": "No eligible giveaway entries found"}
     
     # Log the winner selection
-    await db.activity_log.insert_one({
+    log_writer.write("activity_log", {
         "action": "giveaway_winner_picked",
-        "winner_email": winner.get('email'),
-        "total_entries": len(entries),
-        "timestamp": datetime.now(timezone.utc).isoformat()
+        "winner_email": winners[0].get('email'),
+        "winner_emails": [winner.get('email') for winner in winners],
+        "total_entries": total_entries,
+        "timestamp": datetime.now(timezone.utc)
     })
     
     return {
         "success": True,
-        "winner": winner,
-        "total_entries": len(entries)
+        "winner": winners[0],
+        "winners": winners,
+        "total_entries": total_entries
     }
 
 @api_router.get("/admin/user/{email}/details")
@@ -4077,28 +6906,28 @@ async def get_user_details(request: Request, email: str):
     """Get detailed view of a single user's activity"""
     await verify_admin(request)
     
-    email_lower = email.lower()
+    email_query = {"email_normalized": normalize_email(email)}
     
     # Get user account
-    user = await db.users.find_one({"email": {"$regex": f"^{email_lower}$", "$options": "i"}}, {"_id": 0, "password_hash": 0})
+    user = await db.users.find_one(email_query, {"_id": 0, "password_hash": 0})
     
     # Get all subscriptions
-    subscriptions = await db.email_subscriptions.find({"email": {"$regex": f"^{email_lower}$", "$options": "i"}}, {"_id": 0}).to_list(100)
+    subscriptions = await db.email_subscriptions.find(email_query, {"_id": 0}).to_list(100)
     
     # Get waitlist entries
-    waitlist = await db.waitlist.find({"email": {"$regex": f"^{email_lower}$", "$options": "i"}}, {"_id": 0}).to_list(100)
+    waitlist = await db.waitlist.find(email_query, {"_id": 0}).to_list(100)
     
     # Get orders
-    orders = await db.orders.find({"customer_email": {"$regex": f"^{email_lower}$", "$options": "i"}}, {"_id": 0}).to_list(100)
+    orders = await db.orders.find(email_query, {"_id": 0}).to_list(100)
     
     # Get carts
-    carts = await db.carts.find({"email": {"$regex": f"^{email_lower}$", "$options": "i"}}, {"_id": 0}).to_list(10)
+    carts = await db.carts.find(email_query, {"_id": 0}).to_list(10)
     
     # Get notes
-    notes = await db.user_notes.find({"email": {"$regex": f"^{email_lower}$", "$options": "i"}}, {"_id": 0}).sort("created_at", -1).to_list(100)
+    notes = await db.user_notes.find(email_query, {"_id": 0}).sort("created_at", -1).to_list(100)
     
     # Get email logs
-    email_logs = await db.email_logs.find({"recipient": {"$regex": f"^{email_lower}$", "$options": "i"}}, {"_id": 0}).sort("sent_at", -1).to_list(50)
+    email_logs = await db.email_logs.find(email_query, {"_id": 0}).sort("sent_at", -1).to_list(50)
     
     return {
         "email": email,
@@ -4126,16 +6955,16 @@ async def update_inventory(request: Request, product_id: int, size: str, quantit
     
     result = await db.inventory.update_one(
         {"product_id": product_id, "size": size},
-        {"$set": {"quantity": quantity, "updated_at": datetime.now(timezone.utc).isoformat()}}
+        {"$set": {"quantity": quantity, "updated_at": datetime.now(timezone.utc)}}
     )
     
     # Log the change
-    await db.activity_log.insert_one({
+    log_writer.write("activity_log", {
         "action": "inventory_update",
         "product_id": product_id,
         "size": size,
         "new_quantity": quantity,
-        "timestamp": datetime.now(timezone.utc).isoformat()
+        "timestamp": datetime.now(timezone.utc)
     })
     
     return {"success": result.modified_count > 0}
@@ -4145,54 +6974,56 @@ async def delete_contact(request: Request, email: str):
     """Delete a contact from all collections"""
     await verify_admin(request)
     
-    email_lower = email.lower()
+    email_query = {"email_normalized": normalize_email(email)}
     
     # Delete from all collections
     deleted = {
-        "users": (await db.users.delete_many({"email": {"$regex": f"^{email_lower}$", "$options": "i"}})).deleted_count,
-        "subscriptions": (await db.email_subscriptions.delete_many({"email": {"$regex": f"^{email_lower}$", "$options": "i"}})).deleted_count,
-        "waitlist": (await db.waitlist.delete_many({"email": {"$regex": f"^{email_lower}$", "$options": "i"}})).deleted_count,
-        "carts": (await db.carts.delete_many({"email": {"$regex": f"^{email_lower}$", "$options": "i"}})).deleted_count
+        "users": await delete_counted("users", email_query),
+        "subscriptions": await delete_counted("email_subscriptions", email_query),
+        "waitlist": await delete_counted("waitlist", email_query),
+        "carts": (await db.carts.delete_many(email_query)).deleted_count
     }
+    invalidate_cached_user()
+    await refresh_contacts(email)
     
     # Log the deletion
-    await db.activity_log.insert_one({
+    log_writer.write("activity_log", {
         "action": "contact_deleted",
         "email": email,
         "deleted_counts": deleted,
-        "timestamp": datetime.now(timezone.utc).isoformat()
+        "timestamp": datetime.now(timezone.utc)
     })
     
     return {"success": True, "deleted": deleted}
 
 @api_router.post("/admin/bulk-delete")
-async def bulk_delete_contacts(request: Request, emails: List[str] = []):
-    """Delete multiple contacts at once"""
+async def bulk_delete_contacts(request: Request, emails: List[str] = [], background: bool = False):
+    """Delete multiple contacts at once (background=true queues a bulk_delete job)"""
     await verify_admin(request)
     
-    deleted_total = 0
-    for email in emails:
-        email_lower = email.lower()
-        deleted_total += (await db.users.delete_many({"email": {"$regex": f"^{email_lower}$", "$options": "i"}})).deleted_count
-        deleted_total += (await db.email_subscriptions.delete_many({"email": {"$regex": f"^{email_lower}$", "$options": "i"}})).deleted_count
-        deleted_total += (await db.waitlist.delete_many({"email": {"$regex": f"^{email_lower}$", "$options": "i"}})).deleted_count
-    
-    await db.activity_log.insert_one({
-        "action": "bulk_delete",
-        "emails": emails,
-        "deleted_count": deleted_total,
-        "timestamp": datetime.now(timezone.utc).isoformat()
-    })
+    if background:
+        return await submit_admin_job("bulk_delete", {"emails": emails})
+    
+    result = await bulk_delete_emails(emails, ["users", "email_subscriptions", "waitlist"])
+    log_bulk_action("bulk_delete", emails, result)
     
-    return {"success": True, "deleted_count": deleted_total}
+    return {
+        "success": True,
+        "deleted_count": sum(result["deleted"].values()),
+        "deleted": result["deleted"]
+    }
 
 @api_router.get("/admin/activity-log")
-async def get_activity_log(request: Request, limit: int = 50):
-    """Get recent activity log"""
+async def get_activity_log(request: Request, limit: int = 50, cursor: str = ""):
+    """Get recent activity log, newest first"""
     await verify_admin(request)
     
-    logs = await db.activity_log.find({}, {"_id": 0}).sort("timestamp", -1).limit(limit).to_list(limit)
-    return {"logs": logs}
+    try:
+        logs, next_cursor = await keyset_page(db.activity_log, {}, "timestamp", page_limit(limit), cursor, {"_id": 0})
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    
+    return {"logs": logs, "next_cursor": next_cursor}
 
 @api_router.get("/admin/discount-codes")
 async def get_discount_codes(request: Request):
@@ -4214,22 +7045,27 @@ async def create_discount_code(request: Request, code: str, discount_percent: in
     """Create a new discount code"""
     await verify_admin(request)
     
+    try:
+        expires = parse_datetime(expires_at)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid expires_at date")
+    
     new_code = {
         "code": code.upper(),
         "discount_percent": discount_percent,
         "max_uses": max_uses,
-        "expires_at": expires_at,
-        "created_at": datetime.now(timezone.utc).isoformat(),
+        "expires_at": expires,
+        "created_at": datetime.now(timezone.utc),
         "active": True
     }
     
     await db.discount_codes.insert_one(new_code)
     
-    await db.activity_log.insert_one({
+    log_writer.write("activity_log", {
         "action": "discount_code_created",
         "code": code.upper(),
         "discount_percent": discount_percent,
-        "timestamp": datetime.now(timezone.utc).isoformat()
+        "timestamp": datetime.now(timezone.utc)
     })
     
     return {"success": True, "code": new_code}
@@ -4238,112 +7074,180 @@ async def create_discount_code(request: Request, code: str, discount_percent: in
 async def get_email_logs(request: Request, status: str = "", limit: int = 100):
     """Get email delivery logs"""
     await verify_admin(request)
-    
+    return await query_email_logs(status, limit)
+
+async def query_email_logs(status: str = "", limit: int = 100) -> dict:
+    """Latest email logs plus the per-status summary"""
     query = {}
     if status:
         query["status"] = status
     
-    logs = await db.email_logs.find(query, {"_id": 0}).sort("sent_at", -1).limit(limit).to_list(limit)
-    
-    # Get summary stats
-    total_sent = await db.email_logs.count_documents({})
-    total_delivered = await db.email_logs.count_documents({"status": "delivered"})
-    total_bounced = await db.email_logs.count_documents({"status": "bounced"})
-    total_failed = await db.email_logs.count_documents({"status": "failed"})
+    # Fetch the page, the per-status counts of the retained logs and the
+    # lifetime totals (which outlive EMAIL_LOG_RETENTION_DAYS) concurrently
+    logs, status_counts, counters = await asyncio.gather(
+        db.email_logs.find(query, {"_id": 0}).sort("sent_at", -1).limit(limit).to_list(limit),
+        db.email_logs.aggregate([
+            {"$group": {"_id": "$status", "count": {"$sum": 1}}}
+        ]).to_list(None),
+        db.log_counters.find_one({"_id": EMAIL_LOG_COUNTER_ID})
+    )
+    by_status = {row["_id"]: row["count"] for row in status_counts}
+    lifetime = (counters or {}).get("status", {})
     
     return {
         "logs": logs,
         "summary": {
-            "total_sent": total_sent,
-            "delivered": total_delivered,
-            "bounced": total_bounced,
-            "failed": total_failed
+            "total_sent": sum(by_status.values()),
+            "delivered": by_status.get("delivered", 0),
+            "bounced": by_status.get("bounced", 0),
+            "failed": by_status.get("failed", 0),
+            "retention_days": EMAIL_LOG_RETENTION_DAYS,
+            "lifetime": {
+                "total_sent": sum(lifetime.values()),
+                "delivered": lifetime.get("delivered", 0),
+                "bounced": lifetime.get("bounced", 0),
+                "failed": lifetime.get("failed", 0)
+            }
         }
     }
 
-@api_router.get("/admin/duplicates")
-async def find_duplicates(request: Request):
-    """Find duplicate email entries across collections"""
+# Composite dashboard snapshots are shared by every open admin tab for this long
+ADMIN_DASHBOARD_TTL_SECONDS = float(os.environ.get("ADMIN_DASHBOARD_TTL_SECONDS", "5"))
+dashboard_cache = TTLCache(ADMIN_DASHBOARD_TTL_SECONDS, maxsize=32)
+# Snapshot builds in progress, so concurrent requests await one build
+_dashboard_builds: Dict[tuple, asyncio.Task] = {}
+
+async def build_admin_dashboard(timeframe: str, email_log_limit: int) -> dict:
+    """Compute every dashboard panel concurrently and cache the snapshot"""
+    (admin_stats, order_stats, inventory_stats,
+     email_stats, email_logs, waitlist_stats) = await asyncio.gather(
+        compute_admin_stats(timeframe),
+        get_order_stats(),
+        get_inventory_stats(),
+        get_email_stats(),
+        query_email_logs(limit=email_log_limit),
+        get_waitlist_stats()
+    )
+    snapshot = {
+        "generated_at": datetime.now(timezone.utc).isoformat(),
+        "admin_stats": admin_stats,
+        "order_stats": order_stats,
+        "inventory_stats": inventory_stats,
+        "email_stats": email_stats,
+        "email_logs": email_logs,
+        "waitlist_stats": waitlist_stats
+    }
+    dashboard_cache.set((timeframe, email_log_limit), snapshot)
+    return snapshot
+
+@api_router.get("/admin/dashboard")
+async def get_admin_dashboard(request: Request, timeframe: str = "all", email_log_limit: int = 200,
+                              fresh: bool = False):
+    """Everything the admin dashboard loads, in one response
+    
+    Returns the same payloads as /admin/stats, /orders/stats, /inventory/stats,
+    /emails/stats, /admin/email-logs and /waitlist/stats. Snapshots are cached
+    for ADMIN_DASHBOARD_TTL_SECONDS and concurrent misses share a single build;
+    fresh=true skips the cache.
+    """
     await verify_admin(request)
     
-    # Get all emails from all sources
-    all_emails = {}
+    key = (timeframe, page_limit(email_log_limit))
+    if not fresh:
+        snapshot = dashboard_cache.get(key)
+        if snapshot is not None:
+            return snapshot
     
-    users = await db.users.find({}, {"email": 1, "_id": 0}).to_list(10000)
-    for u in users:
-        email = u.get('email', '').lower()
-        if email:
-            if email not in all_emails:
-                all_emails[email] = {"user": 0, "subscription": 0, "waitlist": 0}
-            all_emails[email]["user"] += 1
+    build = _dashboard_builds.get(key)
+    if build is None:
+        build = asyncio.create_task(build_admin_dashboard(*key))
+        _dashboard_builds[key] = build
+        build.add_done_callback(lambda _: _dashboard_builds.pop(key, None))
     
-    subs = await db.email_subscriptions.find({}, {"email": 1, "_id": 0}).to_list(10000)
-    for s in subs:
-        email = s.get('email', '').lower()
-        if email:
-            if email not in all_emails:
-                all_emails[email] = {"user": 0, "subscription": 0, "waitlist": 0}
-            all_emails[email]["subscription"] += 1
+    # Shield the shared build so one client disconnecting doesn't cancel it for the rest
+    return await asyncio.shield(build)
+
+@api_router.get("/admin/duplicates")
+async def find_duplicates(request: Request, limit: int = 500, cursor: str = "", cached: bool = False):
+    """Find duplicate email entries across collections
     
-    waitlist = await db.waitlist.find({}, {"email": 1, "_id": 0}).to_list(10000)
-    for w in waitlist:
-        email = w.get('email', '').lower()
-        if email:
-            if email not in all_emails:
-                all_emails[email] = {"user": 0, "subscription": 0, "waitlist": 0}
-            all_emails[email]["waitlist"] += 1
+    Args:
+        limit: page size; pass the returned next_cursor to continue
+        cached: read the last report from POST /admin/duplicates/report
+            instead of aggregating live
+    """
+    await verify_admin(request)
     
-    # Find duplicates (more than 1 entry in any collection or entries in multiple collections)
-    duplicates = []
-    for email, counts in all_emails.items():
-        total = counts["user"] + counts["subscription"] + counts["waitlist"]
-        if counts["user"] > 1 or counts["subscription"] > 1 or counts["waitlist"] > 1:
-            duplicates.append({"email": email, "counts": counts, "reason": "multiple_entries"})
+    try:
+        after = decode_cursor(cursor).get("after") if cursor else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    
+    limit = min(max(limit, 1), 5000)
+    page_filter = {"_id": {"$gt": after}} if after is not None else {}
+    
+    if cached:
+        meta = await db.admin_reports.find_one({"_id": "duplicates"}, {"_id": 0})
+        if not meta:
+            raise HTTPException(status_code=404, detail="No duplicates report yet")
+        rows = await db[DUPLICATES_REPORT_COLLECTION].find(page_filter).sort("_id", 1).limit(limit + 1).to_list(limit + 1)
+        total = meta["total"]
+    else:
+        meta = None
+        first_collection = next(iter(DUPLICATE_SOURCES))
+        result = await db[first_collection].aggregate(duplicates_pipeline() + [
+            {"$facet": {
+                "rows": [{"$match": page_filter}, {"$limit": limit + 1}],
+                "total": [{"$count": "n"}]
+            }}
+        ], allowDiskUse=True).to_list(1)
+        rows = result[0]["rows"] if result else []
+        total = result[0]["total"][0]["n"] if result and result[0]["total"] else 0
+    
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor({"after": rows[-1]["_id"]})
     
-    return {"duplicates": duplicates, "total": len(duplicates)}
+    return {
+        "duplicates": [format_duplicate(row) for row in rows],
+        "total": total,
+        "next_cursor": next_cursor,
+        "generated_at": meta["generated_at"] if meta else None
+    }
 
-@api_router.post("/admin/merge-duplicates")
-async def merge_duplicates(request: Request, email: str):
-    """Merge duplicate entries for an email (keeps one of each type)"""
+@api_router.post("/admin/duplicates/report")
+async def refresh_duplicates_report(request: Request):
+    """Rebuild the cached duplicates report"""
     await verify_admin(request)
     
-    email_lower = email.lower()
+    return await build_duplicates_report()
+
+@api_router.post("/admin/merge-duplicates")
+async def merge_duplicates(request: Request, email: str = "", emails: List[str] = [], background: bool = False):
+    """Merge duplicate entries for one or more emails (keeps one of each type)
     
-    # For subscriptions, keep only the first one of each source
-    subs = await db.email_subscriptions.find({"email": {"$regex": f"^{email_lower}$", "$options": "i"}}).to_list(100)
-    seen_sources = set()
-    to_delete = []
-    for sub in subs:
-        source = sub.get('source', '')
-        if source in seen_sources:
-            to_delete.append(sub['_id'])
-        else:
-            seen_sources.add(source)
-    
-    for id in to_delete:
-        await db.email_subscriptions.delete_one({"_id": id})
-    
-    # For waitlist, keep only one entry per product
-    waitlist = await db.waitlist.find({"email": {"$regex": f"^{email_lower}$", "$options": "i"}}).to_list(100)
-    seen_products = set()
-    to_delete = []
-    for w in waitlist:
-        product = w.get('product_name', '')
-        if product in seen_products:
-            to_delete.append(w['_id'])
-        else:
-            seen_products.add(product)
+    Subscriptions keep one entry per source, waitlist one entry per product.
+    background=true queues a merge_duplicates job instead.
+    """
+    await verify_admin(request)
     
-    for id in to_delete:
-        await db.waitlist.delete_one({"_id": id})
+    targets = ([email] if email else []) + list(emails)
+    if not targets:
+        raise HTTPException(status_code=400, detail="email or emails is required")
     
-    await db.activity_log.insert_one({
-        "action": "duplicates_merged",
-        "email": email,
-        "timestamp": datetime.now(timezone.utc).isoformat()
-    })
+    if background:
+        return await submit_admin_job("merge_duplicates", {"emails": targets})
+    
+    result = await bulk_merge_duplicates(targets)
+    log_bulk_action("duplicates_merged", targets, result)
     
-    return {"success": True, "message": f"Merged duplicates for {email}"}
+    label = targets[0] if len(targets) == 1 else f"{result['emails']} emails"
+    return {
+        "success": True,
+        "message": f"Merged duplicates for {label}",
+        "deleted": result["deleted"]
+    }
 
 @api_router.post("/admin/user/{email}/notes")
 async def add_user_note(request: Request, email: str, note: str):
@@ -4352,8 +7256,9 @@ async def add_user_note(request: Request, email: str, note: str):
     
     new_note = {
         "email": email.lower(),
+        "email_normalized": normalize_email(email),
         "note": note,
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "created_at": datetime.now(timezone.utc)
     }
     
     await db.user_notes.insert_one(new_note)
@@ -4366,7 +7271,7 @@ async def get_user_notes(request: Request, email: str):
     await verify_admin(request)
     
     notes = await db.user_notes.find(
-        {"email": {"$regex": f"^{email.lower()}$", "$options": "i"}},
+        {"email_normalized": normalize_email(email)},
         {"_id": 0}
     ).sort("created_at", -1).to_list(100)
     
@@ -4378,7 +7283,7 @@ async def resend_welcome_email(request: Request, email: str, email_type: str = "
     await verify_admin(request)
     
     # Get user info
-    user = await db.users.find_one({"email": {"$regex": f"^{email.lower()}$", "$options": "i"}}, {"_id": 0, "password_hash": 0})
+    user = await db.users.find_one({"email_normalized": normalize_email(email)}, {"_id": 0, "password_hash": 0})
     
     if not user:
         return {"success": False, "message": "User not found"}
@@ -4396,19 +7301,20 @@ async def resend_welcome_email(request: Request, email: str, email_type: str = "
             await client.post(N8N_WEBHOOK_URL, json=webhook_data, timeout=10)
         
         # Log the resend
-        await db.email_logs.insert_one({
+        log_writer.write("email_logs", {
             "recipient": email,
+            "email_normalized": normalize_email(email),
             "email_type": email_type,
             "status": "sent",
             "resend": True,
-            "sent_at": datetime.now(timezone.utc).isoformat()
+            "sent_at": datetime.now(timezone.utc)
         })
         
-        await db.activity_log.insert_one({
+        log_writer.write("activity_log", {
             "action": "email_resent",
             "email": email,
             "email_type": email_type,
-            "timestamp": datetime.now(timezone.utc).isoformat()
+            "timestamp": datetime.now(timezone.utc)
         })
         
         return {"success": True, "message": f"Email resent to {email}"}
@@ -4417,35 +7323,48 @@ async def resend_welcome_email(request: Request, email: str, email_type: str = "
 
 # ============== END NEW ADMIN FEATURES ==============
 
+# Bulk email target -> segment expression
+BULK_EMAIL_AUDIENCES = {
+    "all": {"or": [{"signed_up": True}, {"subscribed": True}]},
+    "subscribers": {"subscribed": True},
+    "users": {"signed_up": True},
+    "waitlist": {"waitlist": True},
+    "early_access": {"early_access": True},
+}
+
 @api_router.post("/admin/send-bulk-email")
-async def send_bulk_email(request: Request, email_request: BulkEmailRequest):
-    """Send bulk email request to n8n webhook"""
+async def send_bulk_email(request: Request, email_request: BulkEmailRequest, background: bool = False):
+    """Send bulk email request to n8n webhook (background=true queues a bulk_email job)"""
     await verify_admin(request)
     
-    # Get target emails based on target type
-    emails = []
-    
-    if email_request.target == "all":
-        # Get all unique emails from subscribers and users
-        subscribers = await db.email_subscriptions.find({}, {"email": 1, "_id": 0}).to_list(10000)
-        users = await db.users.find({}, {"email": 1, "_id": 0}).to_list(10000)
-        emails = list(set([s["email"] for s in subscribers] + [u["email"] for u in users]))
-    
-    elif email_request.target == "subscribers":
-        subscribers = await db.email_subscriptions.find({}, {"email": 1, "_id": 0}).to_list(10000)
-        emails = list(set([s["email"] for s in subscribers]))
-    
-    elif email_request.target == "users":
-        users = await db.users.find({}, {"email": 1, "_id": 0}).to_list(10000)
-        emails = [u["email"] for u in users]
-    
-    elif email_request.target == "waitlist":
-        waitlist = await db.waitlist.find({}, {"email": 1, "_id": 0}).to_list(10000)
-        emails = list(set([w["email"] for w in waitlist]))
-    
-    elif email_request.target == "early_access":
-        subscribers = await db.email_subscriptions.find({"source": "early_access"}, {"email": 1, "_id": 0}).to_list(10000)
-        emails = [s["email"] for s in subscribers]
+    if background:
+        try:
+            return await submit_admin_job("bulk_email", email_request.model_dump())
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    
+    return await dispatch_bulk_email(email_request)
+
+def bulk_email_audience(email_request: BulkEmailRequest) -> dict:
+    """Segment expression for a bulk email; raises ValueError if it is unknown or malformed"""
+    audience = email_request.segment or BULK_EMAIL_AUDIENCES.get(email_request.target)
+    if audience is None:
+        raise ValueError(f"Unknown target: {email_request.target}")
+    SegmentIndex().evaluate(audience)
+    return audience
+
+async def dispatch_bulk_email(email_request: BulkEmailRequest) -> dict:
+    """Resolve the audience and hand the recipients to the n8n bulk email webhook"""
+    # Get target emails from the segment, or the preset for the target type
+    try:
+        audience = bulk_email_audience(email_request)
+    except ValueError as e:
+        return {"success": False, "message": f"Invalid segment: {str(e)}", "sent_count": 0}
+    # Catch the bitmaps up with contacts built on any worker since the last
+    # sync, so recent signups and unsubscribes count
+    await sync_segment_index()
+    index = segment_index
+    emails = index.members(index.evaluate(audience))
     
     if not emails:
         return {"success": False, "message": "No recipients found", "sent_count": 0}
@@ -4453,7 +7372,7 @@ async def send_bulk_email(request: Request, email_request: BulkEmailRequest):
     # Send webhook to n8n with all recipients
     payload = {
         "event_type": "bulk_email",
-        "target": email_request.target,
+        "target": "segment" if email_request.segment else email_request.target,
         "subject": email_request.subject,
         "html_content": email_request.html_content,
         "recipients": emails,
@@ -4503,11 +7422,12 @@ async def delete_subscriber(request: Request, email: str):
     """Delete a subscriber"""
     await verify_admin(request)
     
-    result = await db.email_subscriptions.delete_many({"email": email.lower()})
+    deleted_count = await delete_counted("email_subscriptions", {"email_normalized": normalize_email(email)})
+    await refresh_contacts(email)
     
     return {
         "success": True,
-        "deleted_count": result.deleted_count
+        "deleted_count": deleted_count
     }
 
 @api_router.delete("/admin/user/{user_id}")
@@ -4515,17 +7435,240 @@ async def delete_user(request: Request, user_id: str):
     """Delete a user"""
     await verify_admin(request)
     
+    user = await db.users.find_one({"user_id": user_id}, {"_id": 0, "email": 1})
+    
     # Delete user sessions
     await db.user_sessions.delete_many({"user_id": user_id})
+    await session_revocations.revoke_user(user_id)
     
     # Delete user
-    result = await db.users.delete_one({"user_id": user_id})
+    deleted_count = await delete_counted("users", {"user_id": user_id})
+    invalidate_cached_user(user_id)
+    if user:
+        await refresh_contacts(user.get('email'))
     
     return {
         "success": True,
-        "deleted": result.deleted_count > 0
+        "deleted": deleted_count > 0
     }
 
+# ============== ADMIN JOBS ==============
+
+# Live job status is pushed to /events subscribers this often
+ADMIN_JOB_EVENT_INTERVAL_SECONDS = 1
+# Comment line sent on idle event streams so proxies keep them open
+ADMIN_JOB_EVENT_KEEPALIVE_SECONDS = 15
+
+async def run_cleanup_job(job: AdminJob, action: str, cleanup: Callable, **kwargs) -> dict:
+    """Run a bulk contact cleanup helper, resuming after the last finished chunk"""
+    emails = job.params.get("emails") or []
+    keys = _cleanup_keys(emails)
+    done = job.checkpoint.get("done", 0)
+    deleted_before = job.checkpoint.get("deleted", {})
+
+    def merged(deleted: dict) -> dict:
+        return {name: deleted_before.get(name, 0) + count for name, count in deleted.items()}
+
+    async def on_progress(chunk_done: int, _total: int, deleted: dict):
+        await job.progress(done + chunk_done, len(keys), {"done": done + chunk_done, "deleted": merged(deleted)})
+
+    await job.progress(done, len(keys))
+    result = await cleanup(keys[done:], on_progress=on_progress, **kwargs)
+    deleted = merged(result["deleted"])
+
+    log_bulk_action(action, emails, {"deleted": deleted})
+    return {"emails": len(keys), "deleted": deleted, "deleted_count": sum(deleted.values())}
+
+def emails_job_params(params: dict) -> dict:
+    emails = params.get("emails", [])
+    if not isinstance(emails, list) or not all(isinstance(email, str) for email in emails):
+        raise ValueError("emails must be a list of strings")
+    return {"emails": emails}
+
+def bulk_email_job_params(params: dict) -> dict:
+    try:
+        email_request = BulkEmailRequest(**params)
+    except ValidationError as e:
+        raise ValueError(f"Invalid bulk_email params: {e.errors()[0]['msg']}")
+    bulk_email_audience(email_request)
+    return email_request.model_dump()
+
+def export_job_params(params: dict) -> dict:
+    if not isinstance(params.get("gzip", False), bool):
+        raise ValueError("gzip must be true or false")
+    return {"gzip": params.get("gzip", False)}
+
+@admin_job("bulk_delete", validate=emails_job_params)
+async def bulk_delete_job(job: AdminJob) -> dict:
+    return await run_cleanup_job(
+        job, "bulk_delete", bulk_delete_emails, collections=["users", "email_subscriptions", "waitlist"]
+    )
+
+@admin_job("merge_duplicates", validate=emails_job_params)
+async def merge_duplicates_job(job: AdminJob) -> dict:
+    return await run_cleanup_job(job, "duplicates_merged", bulk_merge_duplicates)
+
+@admin_job("bulk_email", validate=bulk_email_job_params)
+async def bulk_email_job(job: AdminJob) -> dict:
+    # A retry must not send the campaign twice
+    if job.checkpoint.get("dispatching"):
+        raise RuntimeError("Interrupted while sending; check n8n before resubmitting")
+    await job.progress(0, 1, {"dispatching": True})
+
+    result = await dispatch_bulk_email(BulkEmailRequest(**job.params))
+    if not result["success"]:
+        raise RuntimeError(result["message"])
+    await job.progress(1, 1)
+    return result
+
+@admin_job("rebuild_contacts")
+async def rebuild_contacts_job(job: AdminJob) -> dict:
+    async def on_progress(built: int):
+        await job.progress(built, None)
+
+    result = await rebuild_contacts(on_progress=on_progress)
+    # Other processes pick the new documents up through contact_index_sync_loop
+    await asyncio.gather(load_contact_autocomplete(), load_segment_index())
+    return result
+
+@admin_job("export_contacts", validate=export_job_params)
+async def export_contacts_job(job: AdminJob) -> dict:
+    """Write the contacts CSV to GridFS; fetch it from /admin/jobs/{job_id}/result"""
+    gzip = bool(job.params.get("gzip"))
+    filename = "raze_contacts.csv.gz" if gzip else "raze_contacts.csv"
+    total = await db.contacts.estimated_document_count()
+    written = 0
+
+    async def rows():
+        nonlocal written
+        async for row in contact_csv_rows():
+            yield row
+            written += 1
+            if written % CSV_STREAM_CHUNK_ROWS == 0:
+                await job.progress(written, total)
+
+    # An interrupted export simply starts over: the file is only kept once complete
+    upload = admin_job_files.open_upload_stream(filename, metadata={
+        "job_id": job.id,
+        "content_type": "application/gzip" if gzip else "text/csv"
+    })
+    size = 0
+    try:
+        async for chunk in stream_csv(rows(), CONTACT_CSV_FIELDS, compress=gzip):
+            await upload.write(chunk)
+            size += len(chunk)
+    except BaseException:
+        await upload.abort()
+        raise
+    await upload.close()
+
+    await job.progress(written, written)
+    return {"file_id": str(upload._id), "filename": filename, "rows": written, "bytes": size}
+
+async def get_admin_job_doc(job_id: str, projection: Optional[dict] = None) -> dict:
+    job = await db.admin_jobs.find_one({"_id": job_id}, projection)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@api_router.post("/admin/jobs")
+async def create_admin_job(request: Request, job_request: AdminJobRequest):
+    """Queue a background admin job
+    
+    Types: bulk_email (BulkEmailRequest fields), export_contacts (gzip),
+    merge_duplicates (emails), bulk_delete (emails).
+    """
+    await verify_admin(request)
+    
+    try:
+        return await submit_admin_job(job_request.type, job_request.params)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@api_router.get("/admin/jobs")
+async def list_admin_jobs(request: Request, limit: int = 50, cursor: str = ""):
+    """Recent admin jobs, newest first"""
+    await verify_admin(request)
+    
+    try:
+        jobs, next_cursor = await keyset_page(
+            db.admin_jobs, {}, "created_at", page_limit(limit, 200), cursor,
+            {"params": 0, "checkpoint": 0, "result": 0}
+        )
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    
+    return {"jobs": [format_admin_job(job) for job in jobs], "next_cursor": next_cursor}
+
+@api_router.get("/admin/jobs/{job_id}")
+async def get_admin_job(request: Request, job_id: str):
+    """Status, progress and result of one job"""
+    await verify_admin(request)
+    
+    return format_admin_job(await get_admin_job_doc(job_id))
+
+@api_router.get("/admin/jobs/{job_id}/events")
+async def stream_admin_job(request: Request, job_id: str):
+    """Server-sent events with the job's status until it finishes"""
+    await verify_admin(request)
+    await get_admin_job_doc(job_id, {"_id": 1})
+    
+    async def events():
+        last = None
+        idle = 0.0
+        while not await request.is_disconnected():
+            job = await db.admin_jobs.find_one({"_id": job_id}, {"params": 0})
+            if job is None:
+                break
+            payload = json.dumps(format_admin_job(job), default=to_iso)
+            if payload != last:
+                yield f"event: job\ndata: {payload}\n\n"
+                last = payload
+                idle = 0.0
+            elif idle >= ADMIN_JOB_EVENT_KEEPALIVE_SECONDS:
+                yield ": keepalive\n\n"
+                idle = 0.0
+            if job["status"] in ADMIN_JOB_TERMINAL_STATES:
+                break
+            await asyncio.sleep(ADMIN_JOB_EVENT_INTERVAL_SECONDS)
+            idle += ADMIN_JOB_EVENT_INTERVAL_SECONDS
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@api_router.get("/admin/jobs/{job_id}/result")
+async def get_admin_job_result(request: Request, job_id: str):
+    """A finished job's result; jobs that produced a file return the file"""
+    await verify_admin(request)
+    
+    job = await get_admin_job_doc(job_id, {"status": 1, "result": 1, "error": 1})
+    if job["status"] not in ADMIN_JOB_TERMINAL_STATES:
+        raise HTTPException(status_code=409, detail=f"Job is {job['status']}")
+    if job["status"] == "failed":
+        raise HTTPException(status_code=500, detail=job.get("error") or "Job failed")
+    
+    result = job.get("result") or {}
+    if "file_id" not in result:
+        return result
+    
+    grid_out = await admin_job_files.open_download_stream(ObjectId(result["file_id"]))
+    
+    async def chunks():
+        while True:
+            data = await grid_out.readchunk()
+            if not data:
+                break
+            yield data
+    
+    return StreamingResponse(
+        chunks(),
+        media_type=(grid_out.metadata or {}).get("content_type", "application/octet-stream"),
+        headers={"Content-Disposition": f"attachment; filename={result['filename']}"}
+    )
+
 
 # CORS configuration - when using credentials, cannot use wildcard '*'
 # Must specify exact origins or use a dynamic origin callback
@@ -4539,6 +7682,7 @@ if cors_origins_env == '*':
         allow_origin_regex=r"https://.*\.emergentagent\.com|https://.*\.preview\.emergentagent\.com|https://razetraining\.com|https://www\.razetraining\.com|http://localhost:.*",
         allow_methods=["*"],
         allow_headers=["*"],
+        expose_headers=["X-Next-Cursor"],
     )
 else:
     app.add_middleware(
@@ -4547,6 +7691,7 @@ else:
         allow_origins=cors_origins_env.split(','),
         allow_methods=["*"],
         allow_headers=["*"],
+        expose_headers=["X-Next-Cursor"],
     )
 
 # ============================================
@@ -4588,15 +7733,9 @@ async def get_visitor_count():
     return {"count": len(active_visitors), "timestamp": datetime.now(timezone.utc).isoformat()}
 
 @api_router.get("/admin/visitors")
-async def admin_get_visitors(admin_token: str = Cookie(default=None)):
+async def admin_get_visitors(request: Request):
     """Get detailed visitor info (admin only)"""
-    if not admin_token:
-        raise HTTPException(status_code=401, detail="Admin authentication required")
-    
-    # Verify admin token
-    session = await db.admin_sessions.find_one({"token": admin_token})
-    if not session:
-        raise HTTPException(status_code=401, detail="Invalid admin session")
+    await verify_admin(request)
     
     # Clean up inactive visitors
     cutoff = datetime.now(timezone.utc) - timedelta(seconds=VISITOR_TIMEOUT_SECONDS)
@@ -4627,6 +7766,7 @@ async def track_abandoned_cart(cart_data: AbandonedCartCreate):
         abandoned_cart = {
             "id": str(uuid.uuid4()),
             "email": cart_data.email.lower(),
+            "email_normalized": normalize_email(cart_data.email),
             "cart_items": cart_data.cart_items,
             "cart_total": cart_data.cart_total,
             "user_id": cart_data.user_id,
@@ -4908,9 +8048,7 @@ async def admin_select_giveaway_winner(request: Request):
     3. Sends winner notification email via n8n webhook
     """
     # Check admin auth
-    admin_token = request.cookies.get("admin_token")
-    if not admin_token:
-        raise HTTPException(status_code=401, detail="Admin authentication required")
+    await verify_admin(request)
     
     body = await request.json()
     email = body.get("email")
@@ -4940,7 +8078,7 @@ async def admin_select_giveaway_winner(request: Request):
         {
             "$set": {
                 "is_winner": True,
-                "winner_selected_at": datetime.now(timezone.utc).isoformat(),
+                "winner_selected_at": datetime.now(timezone.utc),
                 "prize": prize,
                 "entry_id": entry_id
             }
@@ -4977,6 +8115,78 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+async def startup_maintenance():
+    """Backfills for data written by older versions, then the contacts read model check"""
+    try:
+        await backfill_normalized_emails()
+    except Exception as e:
+        logger.error(f"Normalized email backfill failed: {str(e)}")
+
+    try:
+        await backfill_date_fields()
+    except Exception as e:
+        logger.error(f"Date field backfill failed: {str(e)}")
+
+    try:
+        await ensure_contacts()
+    except Exception as e:
+        logger.error(f"Contacts rebuild check failed: {str(e)}")
+
+@app.on_event("startup")
+async def startup_db_client():
+    try:
+        await ensure_indexes()
+    except Exception as e:
+        logger.error(f"Index bootstrap failed: {str(e)}")
+
+    # Migrations run in the background so the server takes traffic at once
+    app.state.startup_maintenance_task = asyncio.create_task(startup_maintenance())
+
+    try:
+        await seed_email_log_counters()
+    except Exception as e:
+        logger.error(f"Email log counter seed failed: {str(e)}")
+    app.state.log_writer_task = asyncio.create_task(log_writer.run())
+    app.state.session_revocation_task = asyncio.create_task(session_revocation_loop())
+    app.state.retention_sweep_task = asyncio.create_task(retention_sweep_loop())
+
+    app.state.counter_reconcile_task = asyncio.create_task(counter_reconcile_loop())
+
+    try:
+        await load_contact_autocomplete()
+    except Exception as e:
+        logger.error(f"Autocomplete index load failed: {str(e)}")
+
+    try:
+        await load_segment_index()
+    except Exception as e:
+        logger.error(f"Segment index load failed: {str(e)}")
+
+    app.state.analytics_rollup_task = asyncio.create_task(analytics_rollup_loop())
+    app.state.contact_index_sync_task = asyncio.create_task(contact_index_sync_loop())
+    app.state.admin_job_workers = [asyncio.create_task(admin_job_worker()) for _ in range(ADMIN_JOB_WORKERS)]
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    background_tasks = (
+        "analytics_rollup_task", "session_revocation_task", "retention_sweep_task",
+        "counter_reconcile_task", "contact_index_sync_task", "startup_maintenance_task"
+    )
+    for task_name in background_tasks:
+        task = getattr(app.state, task_name, None)
+        if task:
+            task.cancel()
+    # Let workers hand their running jobs back before the client closes
+    workers = getattr(app.state, "admin_job_workers", [])
+    for worker in workers:
+        worker.cancel()
+    await asyncio.gather(*workers, return_exceptions=True)
+    # Let an in-flight flush finish (cancelling could lose its batch), then
+    # write out whatever is still buffered
+    writer_task = getattr(app.state, "log_writer_task", None)
+    if writer_task:
+        log_writer.stop()
+        await writer_task
+    await log_writer.flush()
+    password_hasher.executor.shutdown(wait=False)
     client.close()
\ No newline at end of file
@@ -0,0 +1,122 @@
+import copy
+import os
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+# server reads these at import time; nothing here connects to MongoDB
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "test_database")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+def _matches(doc: dict, query: dict) -> bool:
+    for field, condition in query.items():
+        value = doc.get(field)
+        if isinstance(condition, dict):
+            for operator, operand in condition.items():
+                if operator == "$in" and value not in operand:
+                    return False
+                if operator == "$ne" and value == operand:
+                    return False
+                if operator == "$exists" and (field in doc) != operand:
+                    return False
+        elif value != condition:
+            return False
+    return True
+
+
+class FakeCursor:
+    def __init__(self, docs):
+        self.docs = iter(docs)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self.docs)
+        except StopIteration:
+            raise StopAsyncIteration
+
+
+class FakeCollection:
+    """The handful of motor collection methods the tests reach, over a list of dicts
+
+    Queries support plain equality plus $in, $ne and $exists; updates support
+    $set and $unset.
+    """
+
+    def __init__(self):
+        self.docs = []
+
+    def matching(self, query: dict) -> list:
+        return [doc for doc in self.docs if _matches(doc, query)]
+
+    def find(self, query: dict, projection=None):
+        return FakeCursor(copy.deepcopy(self.matching(query)))
+
+    async def find_one(self, query: dict, projection=None):
+        found = self.matching(query)
+        return copy.deepcopy(found[0]) if found else None
+
+    async def insert_one(self, doc: dict):
+        self.docs.append(copy.deepcopy(doc))
+
+    async def insert_many(self, docs: list, ordered: bool = True):
+        self.docs.extend(copy.deepcopy(docs))
+
+    async def update_one(self, query: dict, update: dict, upsert: bool = False):
+        found = self.matching(query)
+        if found:
+            doc = found[0]
+        elif upsert:
+            doc = {field: value for field, value in query.items() if not isinstance(value, dict)}
+            self.docs.append(doc)
+        else:
+            return SimpleNamespace(modified_count=0)
+        doc.update(update.get("$set", {}))
+        for field in update.get("$unset", {}):
+            doc.pop(field, None)
+        return SimpleNamespace(modified_count=1)
+
+    async def bulk_write(self, requests: list, ordered: bool = True):
+        modified = 0
+        for request in requests:
+            modified += (await self.update_one(request._filter, request._doc)).modified_count
+        return SimpleNamespace(modified_count=modified)
+
+    async def distinct(self, field: str, query: dict) -> list:
+        values = []
+        for doc in self.matching(query):
+            if doc.get(field) not in values:
+                values.append(doc.get(field))
+        return values
+
+
+class FakeDatabase:
+    def __init__(self):
+        self.collections = {}
+
+    def __getitem__(self, name: str) -> FakeCollection:
+        return self.collections.setdefault(name, FakeCollection())
+
+    def __getattr__(self, name: str) -> FakeCollection:
+        return self[name]
+
+
+@pytest.fixture
+def fake_db(monkeypatch):
+    """Replace server.db with an in-memory stand-in for the test's duration"""
+    import server
+
+    database = FakeDatabase()
+    monkeypatch.setattr(server, "db", database)
+    return database
@@ -0,0 +1,56 @@
+import base64
+import json
+
+import pytest
+from bson import ObjectId
+
+from server import _cursor_id, _cursor_id_value, decode_cursor, encode_cursor, keyset_page
+
+
+def raw_cursor(value) -> str:
+    return base64.urlsafe_b64encode(json.dumps(value).encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def test_round_trip():
+    position = {"v": "2025-01-02T03:04:05+00:00", "oid": "65a0c0ffee0000000000abcd"}
+    token = encode_cursor(position)
+
+    assert "=" not in token
+    assert decode_cursor(token) == position
+
+
+@pytest.mark.parametrize("value", [ObjectId(), "user_123", 42])
+def test_id_round_trip(value):
+    assert _cursor_id_value(decode_cursor(encode_cursor(_cursor_id(value)))) == value
+
+
+@pytest.mark.parametrize("token", ["not base64!", raw_cursor([1, 2]), raw_cursor("text"), raw_cursor({"v": 1})[:6]])
+def test_decode_rejects_malformed_tokens(token):
+    with pytest.raises(ValueError):
+        decode_cursor(token)
+
+
+@pytest.mark.parametrize("position", [
+    {"oid": "not-an-object-id"},
+    {"oid": 12},
+    {"id": True},
+    {"id": ["a"]},
+    {"id": {"$gt": ""}},
+    {},
+])
+def test_id_rejects_mistyped_values(position):
+    with pytest.raises(ValueError):
+        _cursor_id_value(position)
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("position", [
+    {"v": 1700000000, "id": "x"},
+    {"v": "yesterday", "id": "x"},
+    {"v": {"$ne": None}, "id": "x"},
+    {"v": None, "oid": "zz"},
+])
+async def test_keyset_page_rejects_bad_cursors_before_querying(position):
+    # Rejected while the cursor is decoded, so the collection is never touched
+    with pytest.raises(ValueError):
+        await keyset_page(None, {}, "created_at", 10, encode_cursor(position))
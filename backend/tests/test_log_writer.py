@@ -0,0 +1,99 @@
+import asyncio
+
+import pytest
+
+import server
+from server import LogWriter
+
+from .conftest import FakeCollection
+
+
+class GatedCollection(FakeCollection):
+    """insert_many waits until the test opens the gate"""
+
+    def __init__(self):
+        super().__init__()
+        self.started = asyncio.Event()
+        self.gate = asyncio.Event()
+
+    async def insert_many(self, docs, ordered=True):
+        self.started.set()
+        await self.gate.wait()
+        await super().insert_many(docs, ordered)
+
+
+class FailingOnceCollection(FakeCollection):
+    def __init__(self):
+        super().__init__()
+        self.failures = 1
+
+    async def insert_many(self, docs, ordered=True):
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError("connection reset")
+        await super().insert_many(docs, ordered)
+
+
+@pytest.mark.anyio
+async def test_stop_flushes_what_is_buffered(fake_db):
+    writer = LogWriter()
+    task = asyncio.create_task(writer.run())
+    writer.write("page_views", {"n": 1})
+    writer.write("analytics_events", {"n": 2})
+
+    writer.stop()
+    await asyncio.wait_for(task, 1)
+    await writer.flush()
+
+    assert [doc["n"] for doc in fake_db.page_views.docs] == [1]
+    assert [doc["n"] for doc in fake_db.analytics_events.docs] == [2]
+    assert writer.stats()["written"] == 2
+
+
+@pytest.mark.anyio
+async def test_stop_waits_for_the_flush_in_progress(fake_db, monkeypatch):
+    monkeypatch.setattr(server, "LOG_FLUSH_BATCH_SIZE", 2)
+    collection = fake_db.collections["page_views"] = GatedCollection()
+    writer = LogWriter()
+    task = asyncio.create_task(writer.run())
+
+    writer.write("page_views", {"n": 1})
+    writer.write("page_views", {"n": 2})
+    await asyncio.wait_for(collection.started.wait(), 1)
+    # Arrives while the first batch is being written
+    writer.write("page_views", {"n": 3})
+
+    writer.stop()
+    await asyncio.sleep(0)
+    assert not task.done()
+
+    collection.gate.set()
+    await asyncio.wait_for(task, 1)
+    await writer.flush()
+
+    assert sorted(doc["n"] for doc in collection.docs) == [1, 2, 3]
+    assert writer.stats()["dropped"] == 0
+
+
+@pytest.mark.anyio
+async def test_failed_flush_keeps_entries_for_the_next_one(fake_db):
+    collection = fake_db.collections["page_views"] = FailingOnceCollection()
+    writer = LogWriter()
+    writer.write("page_views", {"n": 1})
+
+    await writer.flush()
+    assert collection.docs == []
+    assert writer.stats()["pending"]["page_views"] == 1
+
+    await writer.flush()
+    assert [doc["n"] for doc in collection.docs] == [1]
+
+
+def test_full_buffer_drops_the_oldest_entries(monkeypatch):
+    monkeypatch.setattr(server, "LOG_BUFFER_MAX", 3)
+    writer = LogWriter()
+    for n in range(5):
+        writer.write("page_views", {"n": n})
+
+    assert [doc["n"] for doc in writer.buffers["page_views"]] == [2, 3, 4]
+    assert writer.stats()["dropped"] == 2
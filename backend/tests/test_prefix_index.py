@@ -0,0 +1,71 @@
+from server import PrefixIndex
+
+
+def build(*pairs):
+    index = PrefixIndex()
+    for key, value in pairs:
+        index.add(key, value)
+    return index
+
+
+def test_search_matches_prefixes_inside_an_edge_label():
+    index = build(("alice@example.com", "a1"), ("alina@example.com", "a2"), ("bob@example.com", "b1"))
+
+    assert sorted(index.search("al", 10)) == ["a1", "a2"]
+    assert index.search("alic", 10) == ["a1"]
+    assert index.search("b", 10) == ["b1"]
+    assert index.search("c", 10) == []
+    assert index.search("alicex", 10) == []
+
+
+def test_search_prefers_shallower_completions_and_respects_limit():
+    index = build(("ann", "short"), ("anne", "longer"), ("annette", "longest"))
+
+    assert index.search("ann", 10) == ["short", "longer", "longest"]
+    assert index.search("ann", 2) == ["short", "longer"]
+
+
+def test_values_under_one_key_are_deduplicated():
+    index = build(("jo", "same"), ("joe", "same"), ("jo", "other"))
+
+    assert index.keys == 2
+    assert index.search("j", 10) == ["other", "same"]
+
+
+def test_remove_drops_only_the_given_value():
+    index = build(("sam", "s1"), ("sam", "s2"))
+
+    index.remove("sam", "s1")
+    assert index.search("sa", 10) == ["s2"]
+    assert index.keys == 1
+
+    index.remove("sam", "missing")
+    index.remove("samuel", "s2")
+    assert index.search("sa", 10) == ["s2"]
+
+
+def test_remove_prunes_and_remerges_edges():
+    index = build(("carla", "c1"))
+    baseline = index.stats()
+
+    index.add("carlos", "c2")
+    index.add("car", "c3")
+    assert index.stats()["nodes"] > baseline["nodes"]
+
+    index.remove("carlos", "c2")
+    index.remove("car", "c3")
+    stats = index.stats()
+    assert stats["keys"] == 1
+    assert stats["nodes"] == baseline["nodes"]
+    assert stats["edges"] == baseline["edges"]
+    assert index.search("carl", 10) == ["c1"]
+
+
+def test_removing_everything_leaves_an_empty_root():
+    index = build(("x", "1"), ("xy", "2"), ("xz", "3"))
+    for key, value in (("xy", "2"), ("x", "1"), ("xz", "3")):
+        index.remove(key, value)
+
+    assert index.keys == 0
+    assert index.root.edges is None
+    assert index.search("", 10) == []
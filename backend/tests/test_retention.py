@@ -0,0 +1,58 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from bson import ObjectId
+
+from server import _date_legacy_rows, record_payment_status
+
+CREATED = datetime(2025, 3, 1, tzinfo=timezone.utc)
+NO_EXPIRY = {"expires_at": {"$exists": False}}
+
+
+def by_session(collection, session_id):
+    return next(doc for doc in collection.docs if doc.get("session_id") == session_id)
+
+
+@pytest.mark.anyio
+async def test_sweep_skips_pending_orders_of_paid_checkouts(fake_db):
+    for session_id in ("paid", "unpaid", "abandoned"):
+        await fake_db.pending_orders.insert_one({"_id": session_id, "session_id": session_id, "created_at": CREATED})
+    await fake_db.payment_transactions.insert_one({"session_id": "paid", "payment_status": "paid"})
+    await fake_db.payment_transactions.insert_one({"session_id": "unpaid", "payment_status": "pending"})
+
+    dated = await _date_legacy_rows(fake_db.pending_orders, NO_EXPIRY, timedelta(hours=24), skip_paid=True)
+
+    assert dated == 2
+    assert "expires_at" not in by_session(fake_db.pending_orders, "paid")
+    assert by_session(fake_db.pending_orders, "unpaid")["expires_at"] == CREATED + timedelta(hours=24)
+    assert by_session(fake_db.pending_orders, "abandoned")["expires_at"] == CREATED + timedelta(hours=24)
+
+
+@pytest.mark.anyio
+async def test_sweep_dates_rows_without_created_at_from_their_object_id(fake_db):
+    legacy_id = ObjectId.from_datetime(CREATED)
+    await fake_db.payment_transactions.insert_one({"_id": legacy_id, "session_id": "s"})
+    await fake_db.payment_transactions.insert_one({"_id": "no-date", "session_id": "t"})
+
+    dated = await _date_legacy_rows(fake_db.payment_transactions, NO_EXPIRY, timedelta(days=30))
+
+    assert dated == 1
+    assert by_session(fake_db.payment_transactions, "s")["expires_at"] == CREATED + timedelta(days=30)
+    assert "expires_at" not in by_session(fake_db.payment_transactions, "t")
+
+
+@pytest.mark.anyio
+async def test_payment_removes_the_expiry_of_the_checkout(fake_db):
+    expires_at = CREATED + timedelta(hours=24)
+    for session_id in ("paid", "pending"):
+        await fake_db.pending_orders.insert_one({"session_id": session_id, "expires_at": expires_at})
+        await fake_db.payment_transactions.insert_one({"session_id": session_id, "expires_at": expires_at})
+
+    await record_payment_status("paid", {"payment_status": "paid"})
+    await record_payment_status("pending", {"payment_status": "pending"})
+
+    assert "expires_at" not in by_session(fake_db.pending_orders, "paid")
+    assert "expires_at" not in by_session(fake_db.payment_transactions, "paid")
+    assert by_session(fake_db.payment_transactions, "paid")["payment_status"] == "paid"
+    assert by_session(fake_db.pending_orders, "pending")["expires_at"] == expires_at
+    assert by_session(fake_db.payment_transactions, "pending")["expires_at"] == expires_at
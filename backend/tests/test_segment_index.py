@@ -0,0 +1,86 @@
+import pytest
+
+from server import SegmentIndex
+
+
+CONTACTS = {
+    "a@x.com": {"discipline": "WAG", "sources": ["giveaway_popup"], "signed_up": True, "orders_count": 2},
+    "b@x.com": {"discipline": "MAG", "counts": {"subscription": 1, "waitlist": 1}, "waitlist_products": ["Grip Bag"]},
+    "c@x.com": {"discipline": "wag", "counts": {"subscription": 1}, "unsubscribed": True},
+    "d@x.com": {"sources": ["footer"]},
+}
+
+
+@pytest.fixture
+def index():
+    index = SegmentIndex()
+    for email, contact in CONTACTS.items():
+        index.set(email, contact)
+    return index
+
+
+def members(index, expression):
+    return sorted(index.members(index.evaluate(expression)))
+
+
+def test_value_leaves_compare_case_insensitively(index):
+    assert members(index, {"discipline": "wag"}) == ["a@x.com", "c@x.com"]
+    assert members(index, {"discipline": " Wag "}) == ["a@x.com", "c@x.com"]
+    assert members(index, {"discipline": "unknown"}) == ["d@x.com"]
+    assert members(index, {"waitlist": "grip bag"}) == ["b@x.com"]
+    assert members(index, {"source": "nowhere"}) == []
+
+
+def test_flags_and_their_negation(index):
+    assert members(index, {"subscribed": True}) == ["b@x.com", "c@x.com"]
+    assert members(index, {"subscribed": False}) == ["a@x.com", "d@x.com"]
+    assert members(index, {"ordered": True}) == ["a@x.com"]
+    assert members(index, {"waitlist": True}) == ["b@x.com"]
+
+
+def test_and_or_not(index):
+    assert members(index, {"and": [{"subscribed": True}, {"not": {"unsubscribed": True}}]}) == ["b@x.com"]
+    assert members(index, {"or": [{"signed_up": True}, {"source": "footer"}]}) == ["a@x.com", "d@x.com"]
+    assert members(index, {"not": {"or": [{"discipline": "wag"}, {"discipline": "mag"}]}}) == ["d@x.com"]
+
+
+def test_set_moves_a_contact_between_bitmaps(index):
+    index.set("d@x.com", {"discipline": "MAG", "counts": {"subscription": 1}})
+
+    assert members(index, {"discipline": "mag"}) == ["b@x.com", "d@x.com"]
+    assert members(index, {"discipline": "unknown"}) == []
+    assert members(index, {"source": "footer"}) == []
+    assert members(index, {"subscribed": True}) == ["b@x.com", "c@x.com", "d@x.com"]
+
+
+def test_remove_frees_the_id_for_reuse(index):
+    freed = index.ids["b@x.com"]
+    index.remove("b@x.com")
+
+    assert members(index, {"subscribed": True}) == ["c@x.com"]
+    assert members(index, {"not": {"signed_up": True}}) == ["c@x.com", "d@x.com"]
+
+    index.set("e@x.com", {"discipline": "MAG"})
+    assert index.ids["e@x.com"] == freed
+    assert members(index, {"discipline": "mag"}) == ["e@x.com"]
+    assert members(index, {"waitlist": "grip bag"}) == []
+
+
+def test_members_limit(index):
+    assert len(index.members(index.universe, 3)) == 3
+    assert len(index.members(index.universe)) == 4
+
+
+@pytest.mark.parametrize("expression", [
+    {},
+    {"and": []},
+    {"or": {"ordered": True}},
+    {"ordered": True, "subscribed": True},
+    {"bogus": True},
+    {"bogus": "value"},
+    {"discipline": 3},
+    "ordered",
+])
+def test_malformed_expressions_raise_value_error(expression):
+    with pytest.raises(ValueError):
+        SegmentIndex().evaluate(expression)
@@ -0,0 +1,98 @@
+import json
+import time
+
+import pytest
+
+import server
+from server import SessionRevocations, sign_session_token, verify_session_token
+
+
+@pytest.fixture(autouse=True)
+def signing(monkeypatch, fake_db):
+    monkeypatch.setattr(server, "SESSION_SECRET", "test-secret")
+    monkeypatch.setattr(server, "session_revocations", SessionRevocations())
+
+
+def sign_claims(claims: dict) -> str:
+    body = server._b64encode(json.dumps(claims).encode("utf-8"))
+    return f"{server.SESSION_TOKEN_PREFIX}{body}.{server._b64encode(server._session_signature(body))}"
+
+
+def test_sign_and_verify():
+    token = sign_session_token("user_1", "a@x.com")
+    claims = verify_session_token(token)
+
+    assert server.is_signed_session_token(token)
+    assert claims["uid"] == "user_1"
+    assert claims["em"] == "a@x.com"
+    assert claims["exp"] - claims["iat"] == pytest.approx(server.SESSION_TTL_SECONDS, abs=1)
+
+
+def test_rejects_tampering():
+    token = sign_session_token("user_1", "a@x.com")
+    body, signature = token[len(server.SESSION_TOKEN_PREFIX):].split(".")
+    forged_body = server._b64encode(json.dumps({"uid": "admin", "exp": time.time() + 60}).encode("utf-8"))
+
+    assert verify_session_token(f"{server.SESSION_TOKEN_PREFIX}{forged_body}.{signature}") is None
+    assert verify_session_token(f"{server.SESSION_TOKEN_PREFIX}{body}.{signature[::-1]}") is None
+    assert verify_session_token(f"{server.SESSION_TOKEN_PREFIX}{body}") is None
+    assert verify_session_token(f"{server.SESSION_TOKEN_PREFIX}not.base64!") is None
+
+
+def test_rejects_other_secrets_and_missing_secret(monkeypatch):
+    token = sign_session_token("user_1", "a@x.com")
+
+    monkeypatch.setattr(server, "SESSION_SECRET", "rotated")
+    assert verify_session_token(token) is None
+    monkeypatch.setattr(server, "SESSION_SECRET", "")
+    assert verify_session_token(token) is None
+
+
+def test_rejects_expired_tokens():
+    now = time.time()
+    expired = sign_claims({"uid": "user_1", "iat": now - 120, "exp": int(now) - 60, "jti": "old"})
+    live = sign_claims({"uid": "user_1", "iat": now, "exp": int(now) + 60, "jti": "new"})
+
+    assert verify_session_token(expired) is None
+    assert verify_session_token(live)["jti"] == "new"
+
+
+@pytest.mark.anyio
+async def test_revoke_token_only_affects_that_token():
+    revoked = sign_session_token("user_1", "a@x.com")
+    other = sign_session_token("user_1", "a@x.com")
+
+    await server.session_revocations.revoke_token(verify_session_token(revoked))
+
+    assert verify_session_token(revoked) is None
+    assert verify_session_token(other) is not None
+
+
+@pytest.mark.anyio
+async def test_revoke_user_spares_tokens_issued_afterwards():
+    before = sign_session_token("user_1", "a@x.com")
+    bystander = sign_session_token("user_2", "b@x.com")
+
+    await server.session_revocations.revoke_user("user_1")
+    # Issued within the same second as the revocation
+    after = sign_session_token("user_1", "a@x.com")
+
+    assert verify_session_token(before) is None
+    assert verify_session_token(after) is not None
+    assert verify_session_token(bystander) is not None
+
+
+@pytest.mark.anyio
+async def test_revocations_reload_in_other_processes(monkeypatch):
+    token = sign_session_token("user_1", "a@x.com")
+    user_token = sign_session_token("user_2", "b@x.com")
+    await server.session_revocations.revoke_token(verify_session_token(token))
+    await server.session_revocations.revoke_user("user_2")
+
+    other_process = SessionRevocations()
+    await other_process.load()
+    monkeypatch.setattr(server, "session_revocations", other_process)
+
+    assert verify_session_token(token) is None
+    assert verify_session_token(user_token) is None
+    assert verify_session_token(sign_session_token("user_2", "b@x.com")) is not None
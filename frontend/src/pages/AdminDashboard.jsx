@@ -274,11 +274,18 @@ const AdminDashboard = () => {
   const loadAllContacts = async () => {
     setLoading(true);
     try {
-      const res = await fetch(`${API_URL}/api/admin/all-contacts`, {
-        headers: getAuthHeaders()
-      });
-      const data = await res.json();
-      setAllContacts(data.contacts || []);
+      // Contacts are served a page at a time
+      const pageSize = 1000;
+      let contacts = [];
+      let data = {};
+      do {
+        const res = await fetch(`${API_URL}/api/admin/all-contacts?skip=${contacts.length}&limit=${pageSize}`, {
+          headers: getAuthHeaders()
+        });
+        data = await res.json();
+        contacts = contacts.concat(data.contacts || []);
+      } while ((data.contacts || []).length === pageSize);
+      setAllContacts(contacts);
       setContactsSummary(data.summary || null);
     } catch (error) {
       console.error('Failed to load contacts:', error);
@@ -600,11 +607,19 @@ const AdminDashboard = () => {
   const loadDuplicates = async () => {
     setLoading(true);
     try {
-      const res = await fetch(`${API_URL}/api/admin/duplicates`, {
-        headers: getAuthHeaders()
-      });
-      const data = await res.json();
-      setDuplicates(data.duplicates || []);
+      // Duplicates are served a page at a time; follow next_cursor to the end
+      let all = [];
+      let cursor = '';
+      do {
+        const query = cursor ? `&cursor=${encodeURIComponent(cursor)}` : '';
+        const res = await fetch(`${API_URL}/api/admin/duplicates?limit=5000${query}`, {
+          headers: getAuthHeaders()
+        });
+        const data = await res.json();
+        all = all.concat(data.duplicates || []);
+        cursor = data.next_cursor;
+      } while (cursor);
+      setDuplicates(all);
     } catch (error) {
       console.error('Failed to load duplicates:', error);
     }